@@ -1,8 +1,38 @@
 from __future__ import annotations
-from .constants import DOMAIN, PLATFORMS
+from .constants import (
+    DOMAIN,
+    PLATFORMS,
+    CONF_SAVE_DELAY,
+    CONF_SAVE_MAX_DIRTY,
+    DEFAULT_SAVE_DELAY,
+    DEFAULT_SAVE_MAX_DIRTY,
+    CONF_TRACE_SAMPLE,
+    CONF_DECODE_WORKERS,
+    CONF_QUEUE_SIZE,
+    DEFAULT_QUEUE_SIZE,
+    CONF_CAPTURE_PATH,
+    CONF_CAPTURE_MAX_BYTES,
+    CONF_CAPTURE_BACKUPS,
+    CONF_OFFLINE_FACTOR,
+    CONF_OFFLINE_MIN,
+    CONF_SENDER_ID,
+    CONF_EVENTS,
+    CONF_EVENT_PORTNUMS,
+    CONF_EVENT_NODES,
+    CONF_EVENT_CHANNELS,
+    CONF_EVENT_RATE_LIMIT,
+    CONF_TYPE,
+    TYPE_GATEWAY,
+)
 from .coordinator import Coordinator, Platform
+from .gateway import Gateway, parse_allowlist
+from .capture import DEFAULT_MAX_BYTES as DEFAULT_CAPTURE_MAX_BYTES, DEFAULT_BACKUPS as DEFAULT_CAPTURE_BACKUPS
+from .events import packet_types, DEFAULT_RATE_LIMIT as DEFAULT_EVENT_RATE_LIMIT
+from .liveness import DEFAULT_FACTOR as DEFAULT_OFFLINE_FACTOR, DEFAULT_MIN_TIMEOUT as DEFAULT_OFFLINE_MIN
 
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, ServiceCall, SupportsResponse
+from homeassistant.exceptions import HomeAssistantError, ServiceValidationError
+from homeassistant.const import EVENT_HOMEASSISTANT_STOP
 from homeassistant.helpers.typing import ConfigType
 from homeassistant.helpers import service
 
@@ -12,8 +42,27 @@ import logging
 
 _LOGGER = logging.getLogger(__name__)
 
+NODE_ID = r"^![0-9a-fA-F]{8}$"
+
 CONFIG_SCHEMA = vol.Schema({
     DOMAIN: vol.Schema({
+        vol.Optional(CONF_SAVE_DELAY, default=DEFAULT_SAVE_DELAY): cv.positive_int,
+        vol.Optional(CONF_SAVE_MAX_DIRTY, default=DEFAULT_SAVE_MAX_DIRTY): cv.positive_int,
+        vol.Optional(CONF_TRACE_SAMPLE, default=0): cv.positive_int,
+        vol.Optional(CONF_DECODE_WORKERS, default=0): vol.All(vol.Coerce(int), vol.Range(min=0, max=8)),
+        vol.Optional(CONF_QUEUE_SIZE, default=DEFAULT_QUEUE_SIZE): vol.All(vol.Coerce(int), vol.Range(min=10)),
+        vol.Optional(CONF_CAPTURE_PATH): cv.string,
+        vol.Optional(CONF_CAPTURE_MAX_BYTES, default=DEFAULT_CAPTURE_MAX_BYTES): vol.All(vol.Coerce(int), vol.Range(min=4096)),
+        vol.Optional(CONF_CAPTURE_BACKUPS, default=DEFAULT_CAPTURE_BACKUPS): vol.All(vol.Coerce(int), vol.Range(min=0)),
+        vol.Optional(CONF_OFFLINE_FACTOR, default=DEFAULT_OFFLINE_FACTOR): vol.All(vol.Coerce(float), vol.Range(min=1)),
+        vol.Optional(CONF_OFFLINE_MIN, default=DEFAULT_OFFLINE_MIN): vol.All(vol.Coerce(int), vol.Range(min=60)),
+        vol.Optional(CONF_SENDER_ID): vol.All(cv.string, vol.Match(NODE_ID)),
+        vol.Optional(CONF_EVENTS): vol.Schema({
+            vol.Optional(CONF_EVENT_PORTNUMS, default=[]): vol.All(cv.ensure_list, [cv.string], packet_types),
+            vol.Optional(CONF_EVENT_NODES, default=[]): vol.All(cv.ensure_list, [vol.All(cv.string, vol.Match(NODE_ID))]),
+            vol.Optional(CONF_EVENT_CHANNELS, default=[]): vol.All(cv.ensure_list, [cv.string]),
+            vol.Optional(CONF_EVENT_RATE_LIMIT, default=DEFAULT_EVENT_RATE_LIMIT): vol.All(vol.Coerce(int), vol.Range(min=1)),
+        }),
     }, extra=vol.ALLOW_EXTRA),
 }, extra=vol.ALLOW_EXTRA)
 
@@ -25,7 +74,10 @@ async def _async_update_entry(hass, entry):
 
 async def async_setup_entry(hass: HomeAssistant, entry):
     platform = hass.data[DOMAIN]
-    coordinator = Coordinator(platform, entry)
+    if entry.options.get(CONF_TYPE) == TYPE_GATEWAY:
+        coordinator = Gateway(platform, entry)
+    else:
+        coordinator = Coordinator(platform, entry)
     entry.runtime_data = coordinator
     await coordinator.async_load()
     await coordinator.async_config_entry_first_refresh()
@@ -39,11 +91,96 @@ async def async_unload_entry(hass: HomeAssistant, entry):
 
     await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
     await coordinator.async_unload()
+    await hass.data[DOMAIN].async_flush()
     entry.runtime_data = None
     return True
 
+async def async_remove_entry(hass: HomeAssistant, entry):
+    await hass.data[DOMAIN].async_remove_data(entry.entry_id)
+
 async def async_setup(hass: HomeAssistant, config: ConfigType) -> bool:
-    platform = Platform(hass)
+    platform = Platform(hass, config.get(DOMAIN, {}))
     await platform.async_load()
     hass.data[DOMAIN] = platform
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, platform.async_shutdown)
+
+    def _node_list(call: ServiceCall) -> set:
+        try:
+            return parse_allowlist(call.data.get("node_id"))
+        except ValueError as e:
+            raise ServiceValidationError(f"Invalid node_id: {call.data['node_id']}") from e
+
+    async def _async_get_topology(call: ServiceCall):
+        roots = _node_list(call) or platform.configured_nodes()
+        platform.topology.tick()
+        return platform.topology.as_dict(roots)
+
+    hass.services.async_register(DOMAIN, "get_topology", _async_get_topology, schema=vol.Schema({
+        vol.Optional("node_id"): cv.string,
+    }), supports_response=SupportsResponse.ONLY)
+
+    async def _async_get_links(call: ServiceCall):
+        nodes = _node_list(call) or platform.configured_nodes()
+        return platform.links.as_dict(nodes)
+
+    hass.services.async_register(DOMAIN, "get_links", _async_get_links, schema=vol.Schema({
+        vol.Optional("node_id"): cv.string,
+    }), supports_response=SupportsResponse.ONLY)
+
+    def _location(call: ServiceCall) -> tuple:
+        if "latitude" in call.data and "longitude" in call.data:
+            return call.data["latitude"], call.data["longitude"]
+        entity_id = call.data.get("entity_id", "zone.home")
+        if not (state := hass.states.get(entity_id)) or state.attributes.get("latitude") is None or state.attributes.get("longitude") is None:
+            raise HomeAssistantError(f"{entity_id} has no location")
+        return state.attributes["latitude"], state.attributes["longitude"]
+
+    async def _async_nodes_within(call: ServiceCall):
+        lat, lon = _location(call)
+        return {"nodes": platform.nodes_as_list(platform.spatial.within(lat, lon, call.data["radius"] * 1000))}
+
+    async def _async_nearest_nodes(call: ServiceCall):
+        lat, lon = _location(call)
+        max_radius = call.data["radius"] * 1000 if "radius" in call.data else None
+        return {"nodes": platform.nodes_as_list(platform.spatial.nearest(lat, lon, call.data["count"], max_radius))}
+
+    location = {
+        vol.Exclusive("entity_id", "location"): cv.entity_id,
+        vol.Inclusive("latitude", "coordinates"): cv.latitude,
+        vol.Inclusive("longitude", "coordinates"): cv.longitude,
+    }
+    hass.services.async_register(DOMAIN, "nodes_within", _async_nodes_within, schema=vol.Schema({
+        **location,
+        vol.Required("radius"): vol.All(vol.Coerce(float), vol.Range(min=0)),
+    }), supports_response=SupportsResponse.ONLY)
+    hass.services.async_register(DOMAIN, "nearest_nodes", _async_nearest_nodes, schema=vol.Schema({
+        **location,
+        vol.Optional("count", default=5): vol.All(vol.Coerce(int), vol.Range(min=1, max=100)),
+        vol.Optional("radius"): vol.All(vol.Coerce(float), vol.Range(min=0)),
+    }), supports_response=SupportsResponse.ONLY)
+
+    def _node_num(call: ServiceCall) -> int:
+        return int(call.data["node_id"][1:], 16)
+
+    async def _async_send_text(call: ServiceCall):
+        return {"status": platform.async_send(_node_num(call), "text", call.data["text"])}
+
+    async def _async_request_position(call: ServiceCall):
+        return {"status": platform.async_send(_node_num(call), "position")}
+
+    async def _async_request_telemetry(call: ServiceCall):
+        return {"status": platform.async_send(_node_num(call), call.data["kind"])}
+
+    node_id = vol.All(cv.string, vol.Match(NODE_ID))
+    hass.services.async_register(DOMAIN, "send_text", _async_send_text, schema=vol.Schema({
+        vol.Required("node_id"): node_id,
+        vol.Required("text"): vol.All(cv.string, vol.Length(min=1, max=200)),
+    }), supports_response=SupportsResponse.OPTIONAL)
+    hass.services.async_register(DOMAIN, "request_position", _async_request_position, schema=vol.Schema({
+        vol.Required("node_id"): node_id,
+    }), supports_response=SupportsResponse.OPTIONAL)
+    hass.services.async_register(DOMAIN, "request_telemetry", _async_request_telemetry, schema=vol.Schema({
+        vol.Required("node_id"): node_id,
+        vol.Optional("kind", default="device_metrics"): vol.In(["device_metrics", "environment_metrics"]),
+    }), supports_response=SupportsResponse.OPTIONAL)
     return True
@@ -2,18 +2,22 @@ from homeassistant.components import binary_sensor
 from homeassistant.helpers.entity import EntityCategory
 
 from .coordinator import BaseEntity
-from .constants import DOMAIN
+from .constants import DOMAIN, CONF_TYPE, TYPE_GATEWAY
 
 import logging
 _LOGGER = logging.getLogger(__name__)
 
 async def async_setup_entry(hass, entry, async_setup_entities):
     coordinator = entry.runtime_data
-    if coordinator._stat_subs:
-        async_setup_entities([_Online(coordinator)])
+    if entry.options.get(CONF_TYPE) == TYPE_GATEWAY:
+        return
+    async_setup_entities([_Online(coordinator)])
 
 class _Online(BaseEntity, binary_sensor.BinarySensorEntity):
 
+    _sections = ("stat", "online")
+    _liveness = False
+
     def __init__(self, coordinator):
         super().__init__(coordinator)
         self.with_name(f"online", "Online")
@@ -21,6 +25,7 @@ class _Online(BaseEntity, binary_sensor.BinarySensorEntity):
 
     @property
     def is_on(self) -> bool | None:
-        if stat := self.coordinator.data.get("stat"):
+        # The stat topic reports the node's own MQTT connection, otherwise the node is online while it keeps reporting
+        if stat := self.coordinator.data.stat:
             return stat == "online"
-        return None
+        return self.coordinator.online
@@ -0,0 +1,83 @@
+import logging
+import os
+import struct
+
+_LOGGER = logging.getLogger(__name__)
+
+# File: MAGIC, then records of RECORD header (receive time, topic length, payload length), topic, payload
+MAGIC = b"MTQC\x01"
+RECORD = struct.Struct("<dHI")
+FLUSH_SIZE = 64 * 1024
+# Buffered records are written at least that often (seconds), a quiet topic loses at most that much on a crash
+FLUSH_INTERVAL = 5
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_BACKUPS = 3
+
+def read_capture(path: str):
+    # Yields (receive time, topic, payload)
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"Not a capture file: {path}")
+        while header := f.read(RECORD.size):
+            if len(header) < RECORD.size:
+                _LOGGER.warning(f"read_capture(): truncated record in {path}")
+                return
+            ts, topic_len, payload_len = RECORD.unpack(header)
+            topic = f.read(topic_len)
+            payload = f.read(payload_len)
+            if len(topic) < topic_len or len(payload) < payload_len:
+                _LOGGER.warning(f"read_capture(): truncated record in {path}")
+                return
+            yield ts, topic.decode("utf8"), payload
+
+class CaptureWriter():
+
+    # Append-only, size rotated capture of raw MQTT packets. Records are buffered on the event loop
+    # and written by the executor, one write at a time
+
+    def __init__(self, hass, path: str, max_bytes: int = DEFAULT_MAX_BYTES, backups: int = DEFAULT_BACKUPS):
+        self.hass = hass
+        self.path = path
+        self._max_bytes = max_bytes
+        self._backups = backups
+        self._buffer = bytearray()
+        self._writing = False
+        self.records = 0
+
+    def write(self, topic: str, payload: bytes, ts: float):
+        topic_bytes = topic.encode("utf8")
+        self._buffer += RECORD.pack(ts, len(topic_bytes), len(payload))
+        self._buffer += topic_bytes
+        self._buffer += payload
+        self.records += 1
+        if len(self._buffer) >= FLUSH_SIZE and not self._writing:
+            self.hass.async_create_background_task(self.async_flush(), "mtastic_mqtt capture")
+
+    async def async_flush(self):
+        if self._writing or not self._buffer:
+            return
+        self._writing = True
+        try:
+            while self._buffer:
+                data, self._buffer = bytes(self._buffer), bytearray()
+                await self.hass.async_add_executor_job(self._write, data)
+        finally:
+            self._writing = False
+
+    def _rotate(self):
+        for i in range(self._backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self._backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    def _write(self, data: bytes):
+        if os.path.exists(self.path) and os.path.getsize(self.path) + len(data) > self._max_bytes:
+            self._rotate()
+        new = not os.path.exists(self.path)
+        with open(self.path, "ab") as f:
+            if new:
+                f.write(MAGIC)
+            f.write(data)
@@ -2,9 +2,25 @@ from homeassistant import config_entries
 import homeassistant.helpers.config_validation as cv
 from homeassistant.helpers.selector import selector
 
-from .constants import DOMAIN
+from .constants import (
+    DOMAIN,
+    CONF_TYPE,
+    CONF_ALLOWLIST,
+    CONF_MIN_PACKETS,
+    TYPE_NODE,
+    TYPE_GATEWAY,
+    DEFAULT_MIN_PACKETS,
+    CONF_MIN_DISTANCE,
+    CONF_MIN_INTERVAL,
+    CONF_DEADBAND_REL,
+    CONF_MAX_SILENCE,
+    CONF_PRIVATE_KEY,
+)
+from .gateway import parse_allowlist
 
 import voluptuous as vol
+import base64
+import binascii
 import logging
 
 _LOGGER = logging.getLogger(__name__)
@@ -12,12 +28,52 @@ _LOGGER = logging.getLogger(__name__)
 async def _validate(hass, input: dict) -> (str | None, dict):
     if "id" in input and (len(input["id"]) != 9 or input["id"][0] != "!"):
         return "invalid_id", None
+    if CONF_ALLOWLIST in input:
+        try:
+            parse_allowlist(input[CONF_ALLOWLIST])
+        except ValueError:
+            return "invalid_allowlist", None
+    if input.get(CONF_PRIVATE_KEY):
+        try:
+            if len(base64.b64decode(input[CONF_PRIVATE_KEY], validate=True)) != 32:
+                return "invalid_private_key", None
+        except binascii.Error:
+            return "invalid_private_key", None
     # if not input.get("pb_topic") and not input.get("json_topic"):
     #     return "no_topic", None
     # if input.get("pb_topic") and input.get("json_topic"):
     #     return "no_topic", None
     return None, input
 
+_FILTER_OPTIONS = (
+    (CONF_MIN_DISTANCE, "m"),
+    (CONF_MIN_INTERVAL, "s"),
+    (CONF_DEADBAND_REL, "%"),
+    (CONF_MAX_SILENCE, "s"),
+)
+
+def _create_gateway_schema(hass, input: dict, flow: str = "config"):
+    schema = vol.Schema({})
+    if flow == "config":
+        schema = schema.extend({
+            vol.Required("title", description={"suggested_value": input.get("title", "")}): selector({"text": {}}),
+        })
+    schema = schema.extend({
+        vol.Required("pb_topic", description={"suggested_value": input.get("pb_topic", "")}): selector({
+            "text": {}
+        }),
+        vol.Optional("key", description={"suggested_value": input.get("key", "")}): selector({
+            "text": { "type": "password" }
+        }),
+        vol.Optional(CONF_ALLOWLIST, description={"suggested_value": input.get(CONF_ALLOWLIST, "")}): selector({
+            "text": {}
+        }),
+        vol.Required(CONF_MIN_PACKETS, default=input.get(CONF_MIN_PACKETS, DEFAULT_MIN_PACKETS)): selector({
+            "number": { "min": 0, "max": 10000, "mode": "box" }
+        }),
+    })
+    return schema
+
 def _create_schema(hass, input: dict, flow: str = "config"):
     schema = vol.Schema({})
     if flow == "config":
@@ -37,15 +93,27 @@ def _create_schema(hass, input: dict, flow: str = "config"):
         vol.Optional("stat_topic", description={"suggested_value": input.get("stat_topic", "")}): selector({
             "text": {}
         }),
+        vol.Optional(CONF_PRIVATE_KEY, description={"suggested_value": input.get(CONF_PRIVATE_KEY, "")}): selector({
+            "text": { "type": "password" }
+        }),
     })
+    if flow == "options":
+        for name, unit in _FILTER_OPTIONS:
+            schema = schema.extend({
+                vol.Optional(name, description={"suggested_value": input.get(name)}): selector({
+                    "number": { "min": 0, "max": 100000, "step": "any", "mode": "box", "unit_of_measurement": unit }
+                }),
+            })
     return schema
 
 class ConfigFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
 
-
     async def async_step_user(self, user_input=None):
+        return self.async_show_menu(step_id="user", menu_options=[TYPE_NODE, TYPE_GATEWAY])
+
+    async def async_step_node(self, user_input=None):
         if user_input is None:
-            return self.async_show_form(step_id="user", data_schema=_create_schema(self.hass, {
+            return self.async_show_form(step_id="node", data_schema=_create_schema(self.hass, {
             }))
         else:
             _LOGGER.debug(f"Input: {user_input}")
@@ -56,7 +124,41 @@ class ConfigFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
                 _LOGGER.debug(f"Ready to save: {data}")
                 return self.async_create_entry(title=data["title"], options=data, data={})
             else:
-                return self.async_show_form(step_id="user", data_schema=_create_schema(self.hass, user_input), errors=dict(base=err))
+                return self.async_show_form(step_id="node", data_schema=_create_schema(self.hass, user_input), errors=dict(base=err))
+
+    async def async_step_gateway(self, user_input=None):
+        if user_input is None:
+            return self.async_show_form(step_id="gateway", data_schema=_create_gateway_schema(self.hass, {
+            }))
+        else:
+            _LOGGER.debug(f"Input: {user_input}")
+            err, data = await _validate(self.hass, user_input)
+            if err is None:
+                data = {**data, CONF_TYPE: TYPE_GATEWAY}
+                _LOGGER.debug(f"Ready to save: {data}")
+                return self.async_create_entry(title=data["title"], options=data, data={})
+            else:
+                return self.async_show_form(step_id="gateway", data_schema=_create_gateway_schema(self.hass, user_input), errors=dict(base=err))
+
+    async def async_step_integration_discovery(self, discovery_info):
+        _LOGGER.debug(f"Discovered: {discovery_info}")
+        await self.async_set_unique_id(discovery_info["id"])
+        self._abort_if_unique_id_configured()
+        for entry in self._async_current_entries(include_ignore=False):
+            if entry.options.get("id") == discovery_info["id"]:
+                return self.async_abort(reason="already_configured")
+        self._discovery_info = discovery_info
+        self.context["title_placeholders"] = {"name": discovery_info["title"]}
+        return await self.async_step_discovery_confirm()
+
+    async def async_step_discovery_confirm(self, user_input=None):
+        if user_input is None:
+            return self.async_show_form(step_id="discovery_confirm", description_placeholders={
+                "name": self._discovery_info["title"],
+                "pb_topic": self._discovery_info["pb_topic"],
+            })
+        data = self._discovery_info
+        return self.async_create_entry(title=data["title"], options=data, data={})
 
     def async_get_options_flow(config_entry):
         return OptionsFlowHandler(config_entry)
@@ -67,16 +169,23 @@ class OptionsFlowHandler(config_entries.OptionsFlowWithConfigEntry):
     def __init__(self, entry):
         super().__init__(entry)
 
+    def _schema(self, input: dict):
+        if self.options.get(CONF_TYPE) == TYPE_GATEWAY:
+            return _create_gateway_schema(self.hass, input, flow="options")
+        return _create_schema(self.hass, input, flow="options")
+
     async def async_step_init(self, user_input=None):
         if user_input is None:
             _LOGGER.debug(f"Making options: {self.config_entry.as_dict()}")
-            return self.async_show_form(step_id="init", data_schema=_create_schema(self.hass, self.options, flow="options"))
+            return self.async_show_form(step_id="init", data_schema=self._schema(self.options))
         else:
             _LOGGER.debug(f"Input: {user_input}")
             err, data = await _validate(self.hass, user_input)
             if err is None:
+                if CONF_TYPE in self.options:
+                    data = {**data, CONF_TYPE: self.options[CONF_TYPE]}
                 _LOGGER.debug(f"Ready to update: {data}")
                 result = self.async_create_entry(title="", data=data)
                 return result
             else:
-                return self.async_show_form(step_id="init", data_schema=_create_schema(self.hass, user_input, flow="options"), errors=dict(base=err))
+                return self.async_show_form(step_id="init", data_schema=self._schema(user_input), errors=dict(base=err))
@@ -2,3 +2,39 @@ import re
 
 DOMAIN = "mtastic_mqtt"
 PLATFORMS = ["binary_sensor", "sensor", "device_tracker"]
+
+CONF_SAVE_DELAY = "save_delay"
+CONF_SAVE_MAX_DIRTY = "save_max_dirty"
+CONF_TRACE_SAMPLE = "trace_sample"
+CONF_DECODE_WORKERS = "decode_workers"
+CONF_QUEUE_SIZE = "queue_size"
+CONF_CAPTURE_PATH = "capture_path"
+CONF_CAPTURE_MAX_BYTES = "capture_max_bytes"
+CONF_CAPTURE_BACKUPS = "capture_backups"
+CONF_OFFLINE_FACTOR = "offline_factor"
+CONF_OFFLINE_MIN = "offline_min"
+CONF_SENDER_ID = "sender_id"
+CONF_EVENTS = "events"
+CONF_EVENT_PORTNUMS = "portnums"
+CONF_EVENT_NODES = "nodes"
+CONF_EVENT_CHANNELS = "channels"
+CONF_EVENT_RATE_LIMIT = "rate_limit"
+
+DEFAULT_SAVE_DELAY = 30
+DEFAULT_SAVE_MAX_DIRTY = 50
+DEFAULT_QUEUE_SIZE = 1000
+
+CONF_TYPE = "type"
+CONF_ALLOWLIST = "allowlist"
+CONF_MIN_PACKETS = "min_packets"
+CONF_PRIVATE_KEY = "private_key"
+
+TYPE_NODE = "node"
+TYPE_GATEWAY = "gateway"
+
+DEFAULT_MIN_PACKETS = 0
+
+CONF_MIN_DISTANCE = "min_distance"
+CONF_MIN_INTERVAL = "min_interval"
+CONF_DEADBAND_REL = "deadband_rel"
+CONF_MAX_SILENCE = "max_silence"
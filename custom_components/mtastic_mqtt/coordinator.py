@@ -3,46 +3,307 @@ from homeassistant.helpers.update_coordinator import (
     DataUpdateCoordinator,
 )
 from homeassistant.exceptions import HomeAssistantError
+from homeassistant.core import callback
 from homeassistant.components.mqtt import client as mqtt_client
 from homeassistant.util import json, dt
 from homeassistant.helpers import storage
+from homeassistant.helpers.event import async_track_time_interval
 
-from meshtastic import mesh_pb2, mqtt_pb2, portnums_pb2, telemetry_pb2
-
-from .constants import DOMAIN
-from .proto import convert_envelope_to_json, try_encrypt_envelope
+from .constants import (
+    DOMAIN,
+    CONF_SAVE_DELAY,
+    CONF_SAVE_MAX_DIRTY,
+    DEFAULT_SAVE_DELAY,
+    DEFAULT_SAVE_MAX_DIRTY,
+    CONF_TRACE_SAMPLE,
+    CONF_DECODE_WORKERS,
+    CONF_QUEUE_SIZE,
+    DEFAULT_QUEUE_SIZE,
+    CONF_CAPTURE_PATH,
+    CONF_CAPTURE_MAX_BYTES,
+    CONF_CAPTURE_BACKUPS,
+    CONF_OFFLINE_FACTOR,
+    CONF_OFFLINE_MIN,
+    CONF_SENDER_ID,
+    CONF_PRIVATE_KEY,
+    CONF_EVENTS,
+    CONF_EVENT_PORTNUMS,
+    CONF_EVENT_NODES,
+    CONF_EVENT_CHANNELS,
+    CONF_EVENT_RATE_LIMIT,
+)
+from .dispatcher import Dispatcher, pki_topic
+from .stats import Stats
+from .state import NodeState
+from .history import NodeHistory, FIELDS as HISTORY_FIELDS
+from .topology import Topology
+from .links import Links
+from .spatial import SpatialIndex
+from .events import PacketEvents, DEFAULT_RATE_LIMIT as DEFAULT_EVENT_RATE_LIMIT
+from .filters import FilterConfig
+from .capture import CaptureWriter, FLUSH_INTERVAL as CAPTURE_FLUSH_INTERVAL, DEFAULT_MAX_BYTES as DEFAULT_CAPTURE_MAX_BYTES, DEFAULT_BACKUPS as DEFAULT_CAPTURE_BACKUPS
+from .outbound import Outbound, Request, downlink_topic, make_data
+from .liveness import Liveness, TICK as LIVENESS_TICK, DEFAULT_FACTOR as DEFAULT_OFFLINE_FACTOR, DEFAULT_MIN_TIMEOUT as DEFAULT_OFFLINE_MIN
 
+import asyncio
 import logging
-from datetime import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 
 _LOGGER = logging.getLogger(__name__)
 
+# Version of the per entry snapshot format, see NodeState.snapshot()
+STORAGE_VERSION = 1
+
 class Platform():
 
-    def __init__(self, hass):
+    def __init__(self, hass, config: dict):
         self.hass = hass
-        self._storage = storage.Store(hass, 1, DOMAIN)
+        self._dispatchers = {}
+        self._save_delay = config.get(CONF_SAVE_DELAY, DEFAULT_SAVE_DELAY)
+        self._save_max_dirty = config.get(CONF_SAVE_MAX_DIRTY, DEFAULT_SAVE_MAX_DIRTY)
+        self.trace_sample = config.get(CONF_TRACE_SAMPLE, 0)
+        self.queue_size = config.get(CONF_QUEUE_SIZE, DEFAULT_QUEUE_SIZE)
+        self.executor = None
+        if workers := config.get(CONF_DECODE_WORKERS, 0):
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{DOMAIN}_decode")
+        self._stores = {}
+        self._states = {}
+        self._dirty = set()
+        self._save_pending = set()
+        self._migrate_lock = asyncio.Lock()
+        self._migrated = False
+        self.stats = Stats()
+        self._entry_stats = {}
+        self.topology = Topology()
+        self.links = Links()
+        self.spatial = SpatialIndex()
+        # PKI keys by node id, private ones of the configured nodes (replaced, not mutated - shared with the decode workers)
+        # and public ones as heard in nodeinfo
+        self.private_keys = {}
+        self.public_keys = {}
+        self.liveness = Liveness(
+            config.get(CONF_OFFLINE_FACTOR, DEFAULT_OFFLINE_FACTOR),
+            config.get(CONF_OFFLINE_MIN, DEFAULT_OFFLINE_MIN),
+        )
+        self._liveness_unsub = None
+        self._capture_unsub = None
+        sender = config.get(CONF_SENDER_ID)
+        self.outbound = Outbound(hass, int(sender[1:], 16) if sender else None)
+        self.events = None
+        if (events := config.get(CONF_EVENTS)) is not None:
+            self.events = PacketEvents(
+                hass,
+                events.get(CONF_EVENT_PORTNUMS, set()),
+                {int(node_id[1:], 16) for node_id in events.get(CONF_EVENT_NODES, ())},
+                set(events.get(CONF_EVENT_CHANNELS, ())),
+                events.get(CONF_EVENT_RATE_LIMIT, DEFAULT_EVENT_RATE_LIMIT),
+            )
+        self.capture = None
+        if path := config.get(CONF_CAPTURE_PATH):
+            self.capture = CaptureWriter(
+                hass,
+                hass.config.path(path),
+                config.get(CONF_CAPTURE_MAX_BYTES, DEFAULT_CAPTURE_MAX_BYTES),
+                config.get(CONF_CAPTURE_BACKUPS, DEFAULT_CAPTURE_BACKUPS),
+            )
 
     async def async_load(self):
-        data_ = await self._storage.async_load()
-        _LOGGER.debug(f"async_load(): Loaded stored data: {data_}")
-        self._storage_data = data_ if data_ else {}
-
-    def get_data(self, key: str, def_={}):
-        if key in self._storage_data:
-            return self._storage_data[key]
-        return def_
-
-    async def async_put_data(self, key: str, data):
-        if data:
-            self._storage_data = {
-                **self._storage_data,
-                key: data,
-            }
-        else:
-            if key in self._storage_data:
-                del self._storage_data[key]
-        await self._storage.async_save(self._storage_data)
+        # Entry states are loaded lazily, see async_load_data()
+        # One timer checks the offline deadlines of all nodes
+        self._liveness_unsub = async_track_time_interval(self.hass, self._liveness_tick, timedelta(seconds=LIVENESS_TICK))
+        if self.capture:
+            self._capture_unsub = async_track_time_interval(
+                self.hass, self._async_capture_flush, timedelta(seconds=CAPTURE_FLUSH_INTERVAL),
+            )
+
+    async def _async_capture_flush(self, now=None):
+        await self.capture.async_flush()
+
+    @callback
+    def _liveness_tick(self, now=None):
+        self.liveness.tick()
+        if self.topology.tick():
+            for dispatcher in self._dispatchers.values():
+                for gateway in dispatcher.gateways:
+                    gateway.on_topology()
+
+    def _store(self, key: str):
+        if not (store := self._stores.get(key)):
+            store = self._stores[key] = storage.Store(self.hass, STORAGE_VERSION, f"{DOMAIN}.{key}")
+        return store
+
+    async def _async_migrate(self):
+        # One time move of the shared store of older versions into the per entry stores
+        async with self._migrate_lock:
+            if self._migrated:
+                return
+            self._migrated = True
+            legacy = storage.Store(self.hass, 1, DOMAIN)
+            if not (data_ := await legacy.async_load()):
+                return
+            entry_ids = {entry.entry_id for entry in self.hass.config_entries.async_entries(DOMAIN)}
+            _LOGGER.info(f"_async_migrate(): migrating {len(data_)} stored nodes")
+            for key, value in data_.items():
+                if key in entry_ids:
+                    await self._store(key).async_save(NodeState.from_dict(value).snapshot())
+            await legacy.async_remove()
+
+    async def async_load_data(self, key: str) -> NodeState:
+        if (state := self._states.get(key)) is not None:
+            return state
+        if not self._migrated:
+            await self._async_migrate()
+        data_ = await self._store(key).async_load()
+        _LOGGER.debug(f"async_load_data(): Loaded stored data of {key}: {data_}")
+        state = self._states[key] = NodeState.from_snapshot(data_)
+        return state
+
+    def put_data(self, key: str, data: NodeState):
+        self._states[key] = data
+        self._dirty.add(key)
+        if len(self._dirty) == self._save_max_dirty:
+            for dirty_key in self._dirty:
+                self._schedule_save(dirty_key, 0)
+        elif key not in self._save_pending:
+            # Delayed save also registers the final write on HA shutdown
+            self._schedule_save(key, self._save_delay)
+
+    def _schedule_save(self, key: str, delay: float):
+        self._save_pending.add(key)
+        self._store(key).async_delay_save(lambda: self._data_to_save(key), delay)
+
+    async def async_remove_data(self, key: str):
+        self._states.pop(key, None)
+        self._dirty.discard(key)
+        self._save_pending.discard(key)
+        await self._store(key).async_remove()
+        self._stores.pop(key, None)
+
+    def entry_stats(self, key: str) -> Stats:
+        if not (stats := self._entry_stats.get(key)):
+            stats = self._entry_stats[key] = Stats()
+        return stats
+
+    def _count_write(self, key: str):
+        self.stats.inc("storage_writes")
+        if stats := self._entry_stats.get(key):
+            stats.inc("storage_writes")
+        self._dirty.discard(key)
+        self._save_pending.discard(key)
+
+    def _data_to_save(self, key: str):
+        _LOGGER.debug(f"_data_to_save(): saving {key}, dirty: {len(self._dirty)}")
+        self._count_write(key)
+        return self._states[key].snapshot()
+
+    async def async_flush(self):
+        if self.capture:
+            await self.capture.async_flush()
+        for key in tuple(self._dirty):
+            self._count_write(key)
+            await self._store(key).async_save(self._states[key].snapshot())
+
+    def is_configured(self, node_num: int) -> bool:
+        return any(d.has_node(node_num) for d in self._dispatchers.values())
+
+    def configured_nodes(self) -> set:
+        return {node_num for d in self._dispatchers.values() for node_num in d.node_nums}
+
+    @callback
+    def on_packet(self, packet, obj: dict):
+        # Every decoded, de-duplicated packet from any topic, feeds the domain wide indexes
+        if obj["type"] == "neighborinfo":
+            self.topology.update(packet.from_node, obj["payload"]["neighbors"])
+        elif obj["type"] == "device_metrics":
+            self.outbound.observe(packet.from_node, obj["payload"])
+        elif obj["type"] == "nodeinfo":
+            if public_key := obj["payload"].get("public_key"):
+                self.public_keys[packet.from_node] = public_key
+        elif obj["type"] == "position":
+            payload = obj["payload"]
+            # None or zero (0, 0) - no position
+            lat = payload["latitude_i"] or 0
+            lon = payload["longitude_i"] or 0
+            if lat or lon:
+                self.spatial.update(packet.from_node, lat / 10000000.0, lon / 10000000.0)
+        if self.events:
+            self.events.on_packet(packet, obj)
+
+    def nodes_as_list(self, matches: list) -> list:
+        # Spatial query results as a service response
+        now = time.time()
+        result = []
+        for distance, node in matches:
+            lat, lon, ts = self.spatial.get(node)
+            result.append({
+                "id": f"!{node:08x}",
+                "distance_km": round(distance / 1000, 3),
+                "latitude": lat,
+                "longitude": lon,
+                "age": round(now - ts),
+                "configured": self.is_configured(node),
+            })
+        return result
+
+    def async_send(self, node_num: int, kind: str, text: str | None = None) -> str:
+        # Queues a packet to a configured node, through the downlink of the topic the node is heard on
+        if self.outbound.sender is None:
+            raise HomeAssistantError(f"{CONF_SENDER_ID} is not configured")
+        if not (coordinator := self.coordinator(node_num)):
+            raise HomeAssistantError(f"Node !{node_num:08x} is not configured")
+        if not (downlink := downlink_topic(coordinator._pb_topic, coordinator.channel, self.outbound.sender)):
+            raise HomeAssistantError(f"Channel of node !{node_num:08x} not known yet, no packet received since the start")
+        topic, channel = downlink
+        return self.outbound.submit(Request(node_num, kind, make_data(kind, text), topic, channel, coordinator.key))
+
+    def listeners(self, node_num: int) -> list:
+        # Coordinators of a node on every topic, a node with a private key is also on its PKI topic
+        return list(dict.fromkeys(c for d in self._dispatchers.values() for c in d.listeners(node_num)))
+
+    def coordinator(self, node_num: int):
+        for dispatcher in self._dispatchers.values():
+            if listeners := dispatcher.listeners(node_num):
+                return listeners[0]
+        return None
+
+    @property
+    def dispatchers(self):
+        return self._dispatchers
+
+    async def async_shutdown(self, event=None):
+        if self._liveness_unsub:
+            self._liveness_unsub()
+            self._liveness_unsub = None
+        if self._capture_unsub:
+            self._capture_unsub()
+            self._capture_unsub = None
+        if self.capture:
+            await self.capture.async_flush()
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    async def async_subscribe(self, topic: str, coordinator):
+        if not (dispatcher := self._dispatchers.get(topic)):
+            dispatcher = self._dispatchers[topic] = Dispatcher(self, topic)
+        await dispatcher.async_add(coordinator)
+        self._update_private_keys()
+
+    def unsubscribe(self, topic: str, coordinator):
+        if dispatcher := self._dispatchers.get(topic):
+            dispatcher.remove(coordinator)
+            if dispatcher.empty:
+                del self._dispatchers[topic]
+        self._update_private_keys()
+
+    def _update_private_keys(self):
+        self.private_keys = {
+            node_num: coordinator.private_key
+            for dispatcher in self._dispatchers.values() for node_num in dispatcher.node_nums
+            for coordinator in dispatcher.listeners(node_num) if coordinator.private_key
+        }
 
 
 class Coordinator(DataUpdateCoordinator):
@@ -57,69 +318,113 @@ class Coordinator(DataUpdateCoordinator):
         self._platform = platform
         self._entry = entry
         self._entry_id = entry.entry_id
-
+        self.changed_sections = None
+        self.stats = platform.entry_stats(entry.entry_id)
+        # channel_id of the last envelope from the node, set by the dispatcher
+        self.channel = None
+        self.history = NodeHistory()
+        self.filter_config = FilterConfig()
 
     async def _async_update(self):
-        return self._platform.get_data(self._entry_id)
+        self.changed_sections = None
+        return await self._platform.async_load_data(self._entry_id)
 
-    async def _async_update_state(self, data: dict):
-        self.async_set_updated_data({
-            **self.data,
-            **data,
-        })
-        await self._platform.async_put_data(self._entry_id, self.data)
+    async def _async_update_state(self, changed: set):
+        if not changed:
+            return
+        self.changed_sections = changed
+        self.async_set_updated_data(self.data)
+        self._platform.put_data(self._entry_id, self.data)
 
     async def async_load(self):
         self._config = self._entry.as_dict()["options"]
         self._node_id = self._config["id"]
         self._id = int(self._node_id[1:], 16)
+        self.filter_config.update(self._config)
         _LOGGER.debug(f"async_load: {self._config}, {self.data}, {self._node_id}, {self._id}")
-        self._data_subs = await mqtt_client.async_subscribe(self.hass, self._config.get("pb_topic"), self._async_on_pb_message, encoding=None)
+        self._pb_topic = self._config.get("pb_topic")
+        state = await self._platform.async_load_data(self._entry_id)
+        interval = state.liveness.interval if state.liveness is not None else None
+        self._platform.liveness.add(self._entry_id, state.last_update, self._on_liveness, interval)
+        if state.nodeinfo is not None and state.nodeinfo.public_key:
+            self._platform.public_keys.setdefault(self._id, state.nodeinfo.public_key)
+        await self._platform.async_subscribe(self._pb_topic, self)
+        # Direct messages to the node are uplinked on the PKI channel, not the node's own
+        self._pki_topic = pki_topic(self._pb_topic) if self.private_key else None
+        if self._pki_topic:
+            await self._platform.async_subscribe(self._pki_topic, self)
         self._stat_subs = None
         if topic := self._config.get("stat_topic"):
             self._stat_subs = await mqtt_client.async_subscribe(self.hass, topic, self._async_on_stat_message)
 
     async def async_unload(self):
         _LOGGER.debug(f"async_unload:")
-        self._data_subs()
-        self._data_subs = None
+        self._platform.unsubscribe(self._pb_topic, self)
+        if self._pki_topic:
+            self._platform.unsubscribe(self._pki_topic, self)
+        self._platform.liveness.remove(self._entry_id)
         if self._stat_subs:
             self._stat_subs()
             self._stat_subs = None
 
-    async def _async_process_message(self, obj):
-        _LOGGER.debug(f"_async_process_message: JSON[{self._id}]: {obj}")
+    def _process_message(self, obj) -> set:
+        # Applies the message to the state in place, returns the changed sections
+        _LOGGER.debug("_process_message: JSON[%s]: %s", self._id, obj)
+        if obj.get("from") != self._id:
+            if obj.get("to") == self._id and "type" in obj:
+                return self._direct_message(obj)
+            return set()
+        now = dt.now().timestamp()
+        # Any decoded packet is a sign of life, unsupported portnums (routing, admin, ...) included
+        changed = self._seen(now)
         if "type" in obj and "payload" in obj:
-            if obj.get("from") != self._id:
-                _LOGGER.debug(f"_async_process_message: ignoring relay message")
-                return
             type_ = obj["type"]
-            payload = {
-                **self.data.get(type_, {}),
-                **obj["payload"],
-            }
+            payload = obj["payload"]
             if type_ == "nodeinfo" and obj.get("sender") != payload.get("id"):
-                return # nodeinfo about other node - ignoring for now
-            dt_now = dt.now()
-            await self._async_update_state({
-                type_: payload,
-                "last_update": dt_now.timestamp(),
-            })
+                return changed # nodeinfo about other node - ignoring for now
+            if self.data.apply(type_, payload):
+                changed.add(type_)
+            if type_ in HISTORY_FIELDS:
+                self.history.add(type_, payload, now)
+                changed.add("history")
+        return changed
+
+    def _direct_message(self, obj) -> set:
+        # PKI direct message to the node (the dispatcher routes those to the recipient too): kept as the last one
+        # received, the sender's own state is only updated by its entry
+        payload = obj.get("payload") or {}
+        if self.data.apply("direct_message", {
+            "from_id": f"!{obj['from']:08x}",
+            "type": obj["type"],
+            "text": payload.get("text", ""),
+            "rx_time": payload.get("rx_time") or int(dt.now().timestamp()),
+        }):
+            return {"direct_message"}
+        return set()
 
-    async def _async_on_pb_message(self, message):
-        _LOGGER.debug(f"_async_on_pb_message: {message}")
-        try:
-            env = mqtt_pb2.ServiceEnvelope()
-            env.ParseFromString(message.payload)
-            _LOGGER.debug(f"_async_on_pb_message(): parsed {env}")
-            if env.packet.HasField("encrypted"):
-                try_encrypt_envelope(env, self._config.get("key", "AQ=="))
-                _LOGGER.debug(f"_async_on_pb_message(): decrypted {env.packet}")
-            obj = convert_envelope_to_json(env)
-            _LOGGER.debug(f"_async_on_pb_message(): JSON {obj}")
-            await self._async_process_message(obj)
-        except:
-            _LOGGER.exception(f"Error parsing protobuf message")
+    def _seen(self, now: float | None = None) -> set:
+        # A packet from the node was decoded, also called by the dispatcher for the ones it sheds
+        if now is None:
+            now = dt.now().timestamp()
+        changed = set()
+        if self.data.set("last_update", now):
+            changed.add("last_update")
+        if self._platform.liveness.seen(self._entry_id, now):
+            changed.add("online")
+        if (interval := self._platform.liveness.interval(self._entry_id)) is not None:
+            # Stored with the next save, nothing displays it
+            self.data.apply("liveness", {"interval": round(interval, 1)})
+        return changed
+
+    @callback
+    def _on_liveness(self, online: bool):
+        # Timed out: availability changes, the data doesn't
+        _LOGGER.debug(f"_on_liveness: {self._node_id} online: {online}")
+        self.changed_sections = {"online"}
+        self.async_update_listeners()
+
+    async def _async_process_message(self, obj):
+        await self._async_update_state(self._process_message(obj))
 
     # async def _async_on_json_message(self, message):
     #     _LOGGER.debug(f"_async_on_json_message: {message}")
@@ -133,19 +438,58 @@ class Coordinator(DataUpdateCoordinator):
 
     async def _async_on_stat_message(self, message):
         _LOGGER.debug(f"_async_on_stat_message: {message}")
-        await self._async_update_state({
-            "stat": message.payload,
-        })
+        if self.data.set("stat", message.payload):
+            await self._async_update_state({"stat"})
+
+    @property
+    def node_num(self) -> int:
+        return self._id
+
+    @property
+    def key(self) -> str:
+        return self._config.get("key", "AQ==")
+
+    @property
+    def private_key(self) -> str | None:
+        return self._config.get(CONF_PRIVATE_KEY) or None
+
+    @property
+    def online(self) -> bool | None:
+        return self._platform.liveness.online(self._entry_id)
 
     @property
     def last_update(self):
-        return datetime.fromtimestamp(self.data["last_update"], tz=dt.DEFAULT_TIME_ZONE) if "last_update" in self.data else None
+        return datetime.fromtimestamp(self.data.last_update, tz=dt.DEFAULT_TIME_ZONE) if self.data.last_update is not None else None
 
 class BaseEntity(CoordinatorEntity):
 
+    # Top-level coordinator data keys the entity reads, None - all of them
+    _sections = None
+    # Unavailable while the node is offline
+    _liveness = True
+
     def __init__(self, coordinator: Coordinator):
         super().__init__(coordinator)
 
+    def _should_write(self, changed: set | None) -> bool:
+        return True
+
+    @callback
+    def _handle_coordinator_update(self):
+        changed = self.coordinator.changed_sections
+        # Availability changes are always written, but the filters still see the update: a packet bringing
+        # the node back online publishes its new value, not the one from before the outage
+        online = changed is not None and self._liveness and "online" in changed
+        if self._sections is not None and changed is not None and changed.isdisjoint(self._sections) and not online:
+            return
+        if not self._should_write(changed) and not online:
+            return
+        super()._handle_coordinator_update()
+
+    @property
+    def available(self) -> bool:
+        return super().available and not (self._liveness and self.coordinator.online is False)
+
     def with_name(self, id: str, name: str):
         self._attr_has_entity_name = True
         self._attr_unique_id = f"mtastic_mqtt_{self.coordinator._entry_id}_{id}"
@@ -0,0 +1,33 @@
+from collections import OrderedDict
+
+import time
+
+class PacketIndex():
+
+    def __init__(self, max_size: int, ttl: float):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._seen = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._seen)
+
+    def seen(self, from_node: int, packet_id: int, now: float | None = None) -> bool:
+        # True if the packet was already seen within the TTL window, remembers it otherwise
+        if now is None:
+            now = time.monotonic()
+        seen = self._seen
+        while seen:
+            key, ts = next(iter(seen.items()))
+            if len(seen) < self._max_size and now - ts < self._ttl:
+                break
+            seen.popitem(last=False)
+        key = (from_node, packet_id)
+        if key in seen:
+            self.hits += 1
+            return True
+        seen[key] = now
+        self.misses += 1
+        return False
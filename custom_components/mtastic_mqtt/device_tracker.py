@@ -2,41 +2,61 @@ from homeassistant.components import device_tracker
 from homeassistant.helpers.entity import EntityCategory
 
 from .coordinator import BaseEntity
-from .constants import DOMAIN
+from .constants import DOMAIN, CONF_TYPE, TYPE_GATEWAY
+from .filters import MovementFilter
 
 import logging
+import time
 _LOGGER = logging.getLogger(__name__)
 
 async def async_setup_entry(hass, entry, async_setup_entities):
     coordinator = entry.runtime_data
+    if entry.options.get(CONF_TYPE) == TYPE_GATEWAY:
+        return
     async_setup_entities([_Position(coordinator)])
 
 class _Position(BaseEntity, device_tracker.TrackerEntity):
 
+    _sections = ("position", "device_metrics")
+
     def __init__(self, coordinator):
         super().__init__(coordinator)
         self.with_name(f"position_tracker", "Position")
         self._attr_entity_category = None
+        self._movement = MovementFilter(coordinator.filter_config)
+        self._movement.check(self._latitude(), self._longitude(), time.monotonic())
 
-    @property
-    def latitude(self) -> float | None:
-        if pos := self.coordinator.data.get("position"):
-            if value := pos.get("latitude_i"):
+    def _latitude(self) -> float | None:
+        if pos := self.coordinator.data.position:
+            if value := pos.latitude_i:
                 return value / 10000000.0
         return None
 
-    @property
-    def longitude(self) -> float | None:
-        if pos := self.coordinator.data.get("position"):
-            if value := pos.get("longitude_i"):
+    def _longitude(self) -> float | None:
+        if pos := self.coordinator.data.position:
+            if value := pos.longitude_i:
                 return value / 10000000.0
         return None
 
+    def _should_write(self, changed: set | None) -> bool:
+        if changed is None:
+            return True
+        if "position" in changed and self._movement.check(self._latitude(), self._longitude(), time.monotonic()):
+            return True
+        return "device_metrics" in changed
+
+    @property
+    def latitude(self) -> float | None:
+        return self._movement.lat
+
+    @property
+    def longitude(self) -> float | None:
+        return self._movement.lon
+
     @property
     def battery_level(self) -> int | None:
-        if tel := self.coordinator.data.get("device_metrics"):
-            if (value := tel.get("battery_level")) > 0:
-                return value
+        if tel := self.coordinator.data.device_metrics:
+            return tel.battery_level
         return None
 
     @property
@@ -46,8 +66,8 @@ class _Position(BaseEntity, device_tracker.TrackerEntity):
     @property
     def extra_state_attributes(self):
         result = dict()
-        if pos := self.coordinator.data.get("position"):
+        if pos := self.coordinator.data.position:
             for attr in ("altitude", "ground_speed", "sats_in_view"):
-                if value := pos.get(attr):
+                if (value := getattr(pos, attr)) is not None:
                     result[attr] = value
         return result
@@ -0,0 +1,24 @@
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.core import HomeAssistant
+
+from .constants import DOMAIN, CONF_PRIVATE_KEY
+
+TO_REDACT = {"key", CONF_PRIVATE_KEY}
+
+async def async_get_config_entry_diagnostics(hass: HomeAssistant, entry) -> dict:
+    platform = hass.data[DOMAIN]
+    coordinator = entry.runtime_data
+    return {
+        "options": async_redact_data(entry.options, TO_REDACT),
+        "data": coordinator.data.as_dict() if hasattr(coordinator.data, "as_dict") else coordinator.data,
+        "stats": coordinator.stats.as_dict(),
+        "history": history.as_dict() if (history := getattr(coordinator, "history", None)) else None,
+        "liveness": platform.liveness.as_dict(entry.entry_id),
+        "links": platform.links.as_dict([node_num]) if (node_num := coordinator.node_num) is not None else None,
+        "platform": {
+            "stats": platform.stats.as_dict(),
+            "dispatchers": {topic: d.as_dict() for topic, d in platform.dispatchers.items()},
+            "outbound": platform.outbound.as_dict(),
+            "events": platform.events.as_dict() if platform.events else None,
+        },
+    }
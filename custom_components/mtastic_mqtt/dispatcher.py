@@ -0,0 +1,422 @@
+from homeassistant.components.mqtt import client as mqtt_client
+
+from .constants import DOMAIN
+from .dedup import PacketIndex
+from .pb import mqtt_pb2, portnums_pb2
+from .proto import PKI_OVERHEAD, convert_envelope_to_json, decrypt_packet, decrypt_pki_packet, is_pki
+
+from collections import deque
+
+import asyncio
+import logging
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+DEDUP_SIZE = 1024
+DEDUP_TTL = 600
+BATCH_SIZE = 50
+# Queue depth from which batches are decoded in the worker pool, smaller ones are cheaper inline than a thread hop
+EXECUTOR_DEPTH = 8
+# Dropped first when the ingest queue is backlogged: repeats of these sections, once the node's listeners have them
+SHED_SECTIONS = {"nodeinfo": portnums_pb2.NODEINFO_APP, "neighborinfo": portnums_pb2.NEIGHBORINFO_APP}
+
+def topic_levels(pb_topic: str) -> tuple:
+    # (root levels up to and including "e" - "c" before firmware 2.3, channel level or None):
+    # msh/EU_868/2/e/LongFast/# -> (msh/EU_868/2/e, LongFast). A root subscription (msh/EU_868/2/e/#)
+    # or a "+" channel level covers every channel
+    levels = pb_topic.split("/")
+    if levels[-1] in ("#", "+") or levels[-1].startswith("!"):
+        levels = levels[:-1]
+    if marks := [i for i, level in enumerate(levels) if level in ("e", "c")]:
+        root = levels[:marks[-1] + 1]
+    else:
+        root = levels[:-1]
+    channel = levels[len(root)] if len(levels) > len(root) and levels[len(root)] != "+" else None
+    return root, channel
+
+def pki_topic(pb_topic: str) -> str | None:
+    # The firmware uplinks PKI direct messages on the "PKI" channel, None if `pb_topic` already covers it
+    root, channel = topic_levels(pb_topic)
+    return "/".join(root + ["PKI", "#"]) if channel is not None and channel != "PKI" else None
+
+class Packet():
+
+    # `to_node` is set for PKI direct messages, they go to the recipient's listeners as well as the sender's.
+    # Their single decoded object is under the None key of `objs`, whatever the listeners' channel keys
+    __slots__ = ("from_node", "to_node", "packet_id", "env", "objs", "error", "decode_ms")
+
+    def __init__(self, error: str | None = None):
+        self.from_node = None
+        self.to_node = None
+        self.packet_id = 0
+        self.env = None
+        self.objs = {}
+        self.error = error
+        self.decode_ms = 0.0
+
+def _convert(env, data):
+    try:
+        return convert_envelope_to_json(env, data)
+    except Exception:
+        _LOGGER.exception(f"Error parsing protobuf message")
+        return "parse_errors"
+
+def _decode_data(env, key: str, shed: tuple = ()):
+    # `shed` - portnums skipped before their payload is parsed
+    data = None
+    if env.packet.HasField("encrypted"):
+        try:
+            data = decrypt_packet(env.packet, key)
+        except Exception:
+            _LOGGER.debug("_decode_data(): decrypt failed", exc_info=True)
+            return "decrypt_failures"
+    if shed and (data if data is not None else env.packet.decoded).portnum in shed:
+        return "shed"
+    return _convert(env, data)
+
+def _decode_pki(env, private_keys: dict, public_keys: dict):
+    # Only direct messages to a node we have the private key of, from a peer whose public key we heard,
+    # anything else is skipped before touching the cipher
+    packet = env.packet
+    if (
+        (private_key := private_keys.get(packet.to)) is None
+        or (public_key := public_keys.get(getattr(packet, "from"))) is None
+        or len(packet.encrypted) <= PKI_OVERHEAD
+    ):
+        return "pki_skipped"
+    try:
+        data = decrypt_pki_packet(packet, private_key, public_key)
+    except Exception:
+        _LOGGER.debug("_decode_pki(): decrypt failed", exc_info=True)
+        return "decrypt_failures"
+    return _convert(env, data)
+
+def _decode_node_info(env, keys: tuple):
+    # Foreign sender: only its node info is converted, for the public key of PKI direct messages from it
+    packet = env.packet
+    if not packet.HasField("encrypted"):
+        return _convert(env, None) if packet.decoded.portnum == portnums_pb2.NODEINFO_APP else None
+    for key in keys:
+        try:
+            data = decrypt_packet(packet, key)
+        except Exception:
+            continue
+        if data.portnum == portnums_pb2.NODEINFO_APP:
+            return _convert(env, data)
+    return None
+
+def decode_payload(
+    payload: bytes, keys: dict, any_keys: tuple = (), seen=None, private_keys: dict = {}, public_keys: dict = {}, foreign_keys: tuple = (),
+    shed: dict | None = None,
+) -> Packet:
+    # Pure bytes -> decoded packet step, safe to run in a worker thread.
+    # `keys` maps node id to the channel keys of its listeners, `any_keys` are gateway keys used for packets from any node,
+    # `seen` is an optional duplicate check done before decryption. PKI direct messages are decrypted with
+    # `private_keys` of the recipient and `public_keys` of the sender (by node id) instead, once for all listeners.
+    # With `foreign_keys` node info of senders without listeners is decoded, if their public key isn't known yet.
+    # `shed` maps node id to the portnums dropped under overload (None - not overloaded), checked right after decryption
+    started = time.perf_counter()
+    try:
+        env = mqtt_pb2.ServiceEnvelope()
+        env.ParseFromString(payload)
+    except Exception:
+        _LOGGER.debug("decode_payload(): invalid envelope", exc_info=True)
+        return Packet("parse_errors")
+    result = Packet()
+    result.env = env
+    result.from_node = from_node = getattr(env.packet, "from")
+    result.packet_id = env.packet.id
+    if pki := env.packet.HasField("encrypted") and is_pki(env):
+        # Routed by the recipient, the node holding the private key
+        result.to_node = to_node = env.packet.to
+        if to_node not in keys and from_node not in keys and not any_keys:
+            result.error = "foreign"
+            return result
+        node_keys = ()
+    elif (node_keys := keys.get(from_node)) is None:
+        if not any_keys and (not foreign_keys or from_node in public_keys):
+            result.error = "foreign"
+            return result
+        node_keys = ()
+    if seen and result.packet_id and seen(from_node, result.packet_id):
+        result.error = "duplicates"
+        return result
+    if pki:
+        result.objs[None] = _decode_pki(env, private_keys, public_keys)
+        result.decode_ms = (time.perf_counter() - started) * 1000
+        return result
+    if not node_keys and not any_keys:
+        if (obj := _decode_node_info(env, foreign_keys)) is None:
+            result.error = "foreign"
+        else:
+            result.objs[None] = obj
+        result.decode_ms = (time.perf_counter() - started) * 1000
+        return result
+    node_shed = shed.get(from_node, ()) if shed else ()
+    for key in node_keys:
+        result.objs[key] = _decode_data(env, key, node_shed)
+    for key in any_keys:
+        if key not in result.objs:
+            result.objs[key] = _decode_data(env, key, node_shed)
+    result.decode_ms = (time.perf_counter() - started) * 1000
+    return result
+
+def _learn_shed(shed: dict | None, packet: Packet):
+    # Within a batch: once a node's section is decoded, its next packets of that section are repeats
+    if shed is None or packet.error:
+        return
+    for obj in packet.objs.values():
+        if isinstance(obj, dict) and (portnum := SHED_SECTIONS.get(obj.get("type"))) is not None:
+            if portnum not in (node_shed := shed.get(packet.from_node, ())):
+                shed[packet.from_node] = node_shed + (portnum, )
+            return
+
+def decode_batch(
+    payloads: list, keys: dict, any_keys: tuple, private_keys: dict = {}, public_keys: dict = {}, foreign_keys: tuple = (), shed: dict | None = None,
+) -> list:
+    seen = set()
+    def _seen(from_node, packet_id):
+        if (from_node, packet_id) in seen:
+            return True
+        seen.add((from_node, packet_id))
+        return False
+    result = []
+    for payload in payloads:
+        result.append(packet := decode_payload(payload, keys, any_keys, _seen, private_keys, public_keys, foreign_keys, shed))
+        _learn_shed(shed, packet)
+    return result
+
+class Dispatcher():
+
+    def __init__(self, platform, topic: str):
+        self.hass = platform.hass
+        self._platform = platform
+        self._topic = topic
+        self._nodes = {}
+        self._gateways = []
+        self._subs = None
+        self._lock = asyncio.Lock()
+        self.dedup = PacketIndex(DEDUP_SIZE, DEDUP_TTL)
+        self._trace_counter = 0
+        self._keys = {}
+        self._any_keys = ()
+        self._channel_keys = ()
+        self._queue = deque()
+        self._drain_task = None
+        # Deepest the ingest queue got
+        self.queue_peak = 0
+        # Packets from nodes not configured on this topic
+        self.foreign = 0
+
+    @property
+    def empty(self) -> bool:
+        return not self._nodes and not self._gateways
+
+    def has_node(self, node_num: int) -> bool:
+        return node_num in self._nodes
+
+    def listeners(self, node_num: int) -> list:
+        return self._nodes.get(node_num, [])
+
+    @property
+    def gateways(self) -> list:
+        return self._gateways
+
+    @property
+    def node_nums(self):
+        return self._nodes.keys()
+
+    async def async_add(self, listener):
+        # Node coordinators are routed by node id, gateways (node_num is None) see every packet
+        if (node_num := listener.node_num) is None:
+            self._gateways.append(listener)
+        else:
+            self._nodes.setdefault(node_num, []).append(listener)
+        self._update_keys()
+        async with self._lock:
+            if not self._subs and not self.empty:
+                _LOGGER.debug(f"async_add(): subscribing to {self._topic}")
+                self._subs = await mqtt_client.async_subscribe(self.hass, self._topic, self._async_on_message, encoding=None)
+
+    def remove(self, listener):
+        if (node_num := listener.node_num) is None:
+            if listener in self._gateways:
+                self._gateways.remove(listener)
+        elif coordinators := self._nodes.get(node_num):
+            if listener in coordinators:
+                coordinators.remove(listener)
+            if not coordinators:
+                del self._nodes[node_num]
+        self._update_keys()
+        if self.empty and self._subs:
+            _LOGGER.debug(f"remove(): unsubscribing from {self._topic}")
+            self._subs()
+            self._subs = None
+
+    def _update_keys(self):
+        # Immutable snapshot shared with the decode workers
+        self._keys = {
+            node_num: tuple(dict.fromkeys(c.key for c in coordinators)) for node_num, coordinators in self._nodes.items()
+        }
+        self._any_keys = tuple(dict.fromkeys(g.key for g in self._gateways))
+        self._channel_keys = tuple(dict.fromkeys(key for keys in self._keys.values() for key in keys))
+
+    def as_dict(self) -> dict:
+        return {
+            "nodes": len(self._nodes),
+            "gateways": len(self._gateways),
+            "subscribed": self._subs is not None,
+            "queued": len(self._queue),
+            "queue_peak": self.queue_peak,
+            "foreign": self.foreign,
+            "dedup": {
+                "size": len(self.dedup),
+                "hits": self.dedup.hits,
+                "misses": self.dedup.misses,
+            },
+        }
+
+    def _trace(self) -> bool:
+        if sample := self._platform.trace_sample:
+            self._trace_counter += 1
+            if self._trace_counter >= sample:
+                self._trace_counter = 0
+                return True
+        return False
+
+    async def _async_on_message(self, message):
+        if capture := self._platform.capture:
+            capture.write(message.topic, message.payload, time.time())
+        stats = self._platform.stats
+        stats.inc("received")
+        # Never decoded inline: messages delivered together queue up and are decoded as one batch by the drain task,
+        # which yields once per batch
+        if len(self._queue) >= self._platform.queue_size:
+            stats.inc("dropped")
+            return
+        self._queue.append(message)
+        if len(self._queue) > self.queue_peak:
+            self.queue_peak = len(self._queue)
+        if not self._drain_task:
+            self._drain_task = self.hass.async_create_background_task(self._async_drain(), f"{DOMAIN} ingest {self._topic}")
+
+    async def _async_drain(self):
+        try:
+            while self._queue:
+                depth = len(self._queue)
+                batch = [self._queue.popleft() for _ in range(min(depth, BATCH_SIZE))]
+                # Foreign node info only matters once a configured node can receive PKI direct messages
+                foreign_keys = self._channel_keys if self._platform.private_keys else ()
+                # Still backlogged after this batch - low value sections are skipped before they are parsed
+                shed = self._sheddable() if len(self._queue) >= self._platform.queue_size // 2 else None
+                if self._platform.executor and depth >= EXECUTOR_DEPTH:
+                    # Burst: decode in the worker pool, dedup is re-checked here against the shared index
+                    packets = await self.hass.loop.run_in_executor(
+                        self._platform.executor, decode_batch, [m.payload for m in batch], self._keys, self._any_keys,
+                        self._platform.private_keys, self._platform.public_keys, foreign_keys, shed,
+                    )
+                    for packet in packets:
+                        if not packet.error and packet.packet_id and self.dedup.seen(packet.from_node, packet.packet_id):
+                            packet.error = "duplicates"
+                else:
+                    packets = []
+                    for m in batch:
+                        packets.append(packet := decode_payload(
+                            m.payload, self._keys, self._any_keys, self.dedup.seen, self._platform.private_keys, self._platform.public_keys,
+                            foreign_keys, shed,
+                        ))
+                        _learn_shed(shed, packet)
+                changes = {}
+                for packet, message in zip(packets, batch):
+                    self._apply(packet, message, changes)
+                await self._async_commit(changes)
+                await asyncio.sleep(0)
+        finally:
+            self._drain_task = None
+
+    def _sheddable(self) -> dict:
+        # node id -> portnums of the sections all its listeners already have, a repeat is the first thing dropped
+        result = {}
+        for node_num, coordinators in self._nodes.items():
+            if portnums := tuple(
+                portnum for section, portnum in SHED_SECTIONS.items()
+                if all(getattr(c.data, section, None) is not None for c in coordinators)
+            ):
+                result[node_num] = portnums
+        return result
+
+    async def _async_commit(self, changes: dict):
+        # One state update per coordinator for the whole batch
+        for coordinator, changed in changes.items():
+            try:
+                await coordinator._async_update_state(changed)
+            except Exception:
+                _LOGGER.exception(f"Error updating state")
+
+    def _apply(self, packet: Packet, message, changes: dict):
+        stats = self._platform.stats
+        trace = self._trace() and packet.env is not None
+        if trace:
+            _LOGGER.info("Packet trace [%s]: %s", message.topic, packet.env)
+        elif packet.env is not None:
+            _LOGGER.debug("_apply(): [%s] parsed %s", message.topic, packet.env)
+        if packet.env is not None:
+            # Every copy counts for the link stats, duplicates and foreign nodes included
+            self._platform.links.record(packet.env)
+        if packet.error:
+            stats.inc(packet.error)
+            if packet.error == "foreign":
+                self.foreign += 1
+            if packet.error == "duplicates":
+                _LOGGER.debug("_apply(): duplicate packet %s/%s", packet.from_node, packet.packet_id)
+            return
+        obj = next((o for o in packet.objs.values() if isinstance(o, dict) and "type" in o), None)
+        if obj:
+            self._platform.on_packet(packet, obj)
+        for gateway in self._gateways:
+            gateway.on_packet(packet.from_node, packet.env, obj)
+        coordinators = self._nodes.get(packet.from_node)
+        if packet.to_node is not None:
+            # PKI direct message: the recipient's listeners here, the sender's on any topic (a telemetry reply applies to it)
+            coordinators = list(dict.fromkeys((*self._nodes.get(packet.to_node, ()), *self._platform.listeners(packet.from_node))))
+        if not coordinators:
+            stats.inc("foreign")
+            self.foreign += 1
+            return
+        stats.decode_ms.observe(packet.decode_ms)
+        counted = set()
+        # The channel the node is heard on, where packets to it are sent. PKI envelopes carry no channel name
+        channel = packet.env.channel_id if packet.env is not None and packet.env.channel_id != "PKI" else None
+        for coordinator in tuple(coordinators):
+            if channel:
+                coordinator.channel = channel
+            entry_stats = coordinator.stats
+            entry_stats.inc("received")
+            entry_stats.decode_ms.observe(packet.decode_ms)
+            obj = packet.objs.get(coordinator.key if packet.to_node is None else None)
+            if isinstance(obj, str):
+                entry_stats.inc(obj)
+                if obj not in counted:
+                    stats.inc(obj)
+                    counted.add(obj)
+                if obj == "shed" and (changed := coordinator._seen()):
+                    # Decrypted before it was dropped, the node is alive
+                    changes.setdefault(coordinator, set()).update(changed)
+                continue
+            if obj is None:
+                continue
+            if "type" not in obj:
+                entry_stats.inc("unsupported")
+                if "unsupported" not in counted:
+                    stats.inc("unsupported")
+                    counted.add("unsupported")
+            if trace:
+                _LOGGER.info("Packet trace JSON: %s", obj)
+            else:
+                _LOGGER.debug("_apply(): JSON %s", obj)
+            try:
+                if changed := coordinator._process_message(obj):
+                    changes.setdefault(coordinator, set()).update(changed)
+            except Exception:
+                _LOGGER.exception(f"Error processing message")
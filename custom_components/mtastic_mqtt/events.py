@@ -0,0 +1,103 @@
+from .constants import DOMAIN
+from .fields import TABLE
+
+import time
+
+EVENT_PACKET = f"{DOMAIN}_packet"
+
+# Packet types by portnum name, telemetry has one type per variant
+PORTNUM_TYPES = {
+    "NEIGHBORINFO_APP": {"neighborinfo"},
+    "TEXT_MESSAGE_APP": {"text_message"},
+}
+for _spec in TABLE:
+    PORTNUM_TYPES.setdefault(_spec.portnum, set()).add(_spec.section)
+TYPES = {type_ for types in PORTNUM_TYPES.values() for type_ in types}
+
+# Events per minute per node, and bucket entries kept before idle ones are dropped
+DEFAULT_RATE_LIMIT = 10
+MAX_BUCKETS = 4096
+
+def packet_types(names: list) -> set:
+    # Portnum names (TELEMETRY_APP) and packet types (device_metrics) -> packet types
+    result = set()
+    for name in names:
+        if name in PORTNUM_TYPES:
+            result |= PORTNUM_TYPES[name]
+        elif name in TYPES:
+            result.add(name)
+        else:
+            raise ValueError(f"Unknown portnum or packet type: {name}")
+    return result
+
+class PacketEvents():
+
+    # Fires an event per decoded packet. All filters are checked before the event data is built,
+    # each node has a token bucket refilled at `rate_limit` events per minute
+
+    def __init__(self, hass, types: set, nodes: set, channels: set, rate_limit: int = DEFAULT_RATE_LIMIT):
+        self.hass = hass
+        self._types = types
+        self._nodes = nodes
+        self._channels = channels
+        self._rate = rate_limit / 60
+        self._burst = float(max(1, rate_limit))
+        self._buckets = {} # node -> [tokens, ts]
+        self.counters = {"fired": 0, "filtered": 0, "limited": 0}
+
+    def _allow(self, node: int, now: float) -> bool:
+        if not (bucket := self._buckets.get(node)):
+            if len(self._buckets) >= MAX_BUCKETS:
+                self._prune(now)
+            bucket = self._buckets[node] = [self._burst, now]
+        else:
+            bucket[0] = min(self._burst, bucket[0] + (now - bucket[1]) * self._rate)
+            bucket[1] = now
+        if bucket[0] < 1:
+            return False
+        bucket[0] -= 1
+        return True
+
+    def _prune(self, now: float):
+        # Buckets refilled by now are the same as no bucket
+        refill = self._burst / self._rate
+        for node in [node for node, (_, ts) in self._buckets.items() if now - ts >= refill]:
+            del self._buckets[node]
+
+    def on_packet(self, packet, obj: dict, now: float | None = None):
+        env = packet.env
+        if (
+            (self._types and obj["type"] not in self._types)
+            or (self._nodes and packet.from_node not in self._nodes)
+            or (self._channels and env.channel_id not in self._channels)
+        ):
+            self.counters["filtered"] += 1
+            return
+        if not self._allow(packet.from_node, time.monotonic() if now is None else now):
+            self.counters["limited"] += 1
+            return
+        self.counters["fired"] += 1
+        mesh_packet = env.packet
+        self.hass.bus.async_fire(EVENT_PACKET, {
+            "from": f"!{packet.from_node:08x}",
+            "to": f"!{mesh_packet.to:08x}",
+            "id": packet.packet_id,
+            "channel": env.channel_id,
+            "gateway": env.gateway_id,
+            "type": obj["type"],
+            "payload": obj["payload"],
+            "rx_time": mesh_packet.rx_time,
+            "rx_snr": mesh_packet.rx_snr,
+            "rx_rssi": mesh_packet.rx_rssi,
+            "hop_start": mesh_packet.hop_start,
+            "hop_limit": mesh_packet.hop_limit,
+        })
+
+    def as_dict(self) -> dict:
+        return {
+            "types": sorted(self._types),
+            "nodes": [f"!{node:08x}" for node in sorted(self._nodes)],
+            "channels": sorted(self._channels),
+            "buckets": len(self._buckets),
+            **self.counters,
+        }
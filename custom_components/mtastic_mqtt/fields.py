@@ -0,0 +1,131 @@
+# Declarative field table: which protobuf fields become state sections and sensors.
+# proto.py compiles it into attribute getters at import, state.py generates the sections,
+# sensor.py the entities. Fields of a section are only ever appended, the storage snapshot is positional
+
+class Field():
+
+    # `path` - attribute path in the protobuf message (defaults to the name), `scale` - multiplier applied on decode,
+    # `binary` - bytes kept as base64 text (the storage is JSON).
+    # With a `label` the field gets a sensor: `unique_id` (defaults to <section>_<name>), `unit`, `device_class`,
+    # `precision`, `icon`, `diagnostic`, `max` (values above are clamped), `deadband` (smallest change published,
+    # in the field's unit). Unset fields with presence (proto3 optional) are None, for the others zero is "not reported"
+    # unless `zero` (counters of messages always sent whole)
+    __slots__ = ("name", "path", "scale", "repeated", "binary", "default", "label", "unique_id", "unit", "device_class", "precision", "icon", "diagnostic", "max", "deadband", "zero")
+
+    def __init__(self, name: str, path: str | None = None, scale: float | None = None, repeated: bool = False, binary: bool = False, default=0,
+                 label: str | None = None, unique_id: str | None = None, unit: str | None = None, device_class: str | None = None,
+                 precision: int | None = None, icon: str | None = None, diagnostic: bool = False, max: float | None = None,
+                 deadband: float | None = None, zero: bool = False):
+        self.name = name
+        self.path = path or name
+        self.scale = scale
+        self.repeated = repeated
+        self.binary = binary
+        self.default = () if repeated else default
+        self.label = label
+        self.unique_id = unique_id
+        self.unit = unit
+        self.device_class = device_class
+        self.precision = precision
+        self.icon = icon
+        self.diagnostic = diagnostic
+        self.max = max
+        self.deadband = deadband
+        self.zero = zero
+
+class Spec():
+
+    # A section decoded from `message` (pb module, class name) of `portnum`. Telemetry sections read the `variant` sub-message
+    __slots__ = ("section", "portnum", "message", "variant", "fields", "persist")
+
+    def __init__(self, section: str, portnum: str, message: tuple, fields: tuple, variant: str | None = None, persist: bool = True):
+        self.section = section
+        self.portnum = portnum
+        self.message = message
+        self.variant = variant
+        self.fields = fields
+        self.persist = persist
+
+def _telemetry(section: str, fields: tuple) -> Spec:
+    return Spec(section, "TELEMETRY_APP", ("telemetry_pb2", "Telemetry"), fields, variant=section)
+
+TABLE = (
+    Spec("position", "POSITION_APP", ("mesh_pb2", "Position"), (
+        Field("latitude_i"),
+        Field("longitude_i"),
+        Field("altitude"),
+        Field("ground_speed"),
+        Field("sats_in_view"),
+    )),
+    _telemetry("device_metrics", (
+        Field("battery_level", label="Battery", unique_id="tel_battery_level", unit="%", device_class="battery", diagnostic=True, max=100),
+        Field("voltage", label="Voltage", unique_id="tel_voltage", unit="V", device_class="voltage", precision=1, diagnostic=True, deadband=0.02),
+        Field("channel_utilization", label="Channel Utilization", unique_id="tel_channel_utilization", unit="%", precision=1, icon="mdi:gauge", diagnostic=True, deadband=0.5),
+        Field("air_util_tx", label="Tx Airtime Utilization", unique_id="tel_air_util_tx", unit="%", precision=1, icon="mdi:cloud-percent", diagnostic=True, deadband=0.1),
+        Field("uptime_seconds", label="Uptime", unit="s", device_class="duration", diagnostic=True),
+    )),
+    _telemetry("environment_metrics", (
+        Field("temperature", label="Temperature", unique_id="tel_temperature", unit="°C", device_class="temperature", precision=1, deadband=0.1),
+        Field("relative_humidity", label="Relative Humidity", unique_id="tel_relativehumidity", unit="%", device_class="humidity", precision=1, deadband=0.5),
+        Field("barometric_pressure", label="Barometric Pressure", unique_id="tel_barometric_pressure", unit="hPa", device_class="atmospheric_pressure", precision=1, deadband=0.1),
+        Field("gas_resistance", label="Gas Resistance (AQI)", unique_id="tel_gas_resistance", device_class="aqi", precision=1),
+        Field("voltage", label="Sensor Voltage", unit="V", device_class="voltage", precision=2, deadband=0.01),
+        Field("current", label="Sensor Current", unit="mA", device_class="current", precision=1, deadband=0.5),
+        Field("iaq", label="Indoor Air Quality (IAQ)", device_class="aqi"),
+        Field("lux", label="Illuminance", unit="lx", device_class="illuminance", precision=0, deadband=1),
+        Field("wind_direction", label="Wind Direction", unit="°", icon="mdi:compass-outline"),
+        Field("wind_speed", label="Wind Speed", unit="m/s", device_class="wind_speed", precision=1, deadband=0.1),
+    )),
+    Spec("nodeinfo", "NODEINFO_APP", ("mesh_pb2", "User"), (
+        Field("id", default=""),
+        Field("shortname", path="short_name", default=""),
+        Field("longname", path="long_name", default=""),
+        # Curve25519 key of PKI direct messages, firmware 2.5+
+        Field("public_key", binary=True, default=""),
+    )),
+    _telemetry("power_metrics", (
+        Field("ch1_voltage", label="Channel 1 Voltage", unit="V", device_class="voltage", precision=2),
+        Field("ch1_current", label="Channel 1 Current", unit="mA", device_class="current", precision=1),
+        Field("ch2_voltage", label="Channel 2 Voltage", unit="V", device_class="voltage", precision=2),
+        Field("ch2_current", label="Channel 2 Current", unit="mA", device_class="current", precision=1),
+        Field("ch3_voltage", label="Channel 3 Voltage", unit="V", device_class="voltage", precision=2),
+        Field("ch3_current", label="Channel 3 Current", unit="mA", device_class="current", precision=1),
+    )),
+    _telemetry("air_quality_metrics", (
+        Field("pm10_standard", label="PM1.0", unit="µg/m³", device_class="pm1"),
+        Field("pm25_standard", label="PM2.5", unit="µg/m³", device_class="pm25"),
+        Field("pm100_standard", label="PM10", unit="µg/m³", device_class="pm10"),
+        Field("co2", label="CO2", unit="ppm", device_class="carbon_dioxide"),
+    )),
+    _telemetry("local_stats", (
+        Field("uptime_seconds", label="Local Uptime", unit="s", device_class="duration", diagnostic=True),
+        Field("channel_utilization", label="Local Channel Utilization", unit="%", precision=1, icon="mdi:gauge", diagnostic=True),
+        Field("air_util_tx", label="Local Tx Airtime Utilization", unit="%", precision=1, icon="mdi:cloud-percent", diagnostic=True),
+        Field("num_packets_tx", label="Packets Sent", icon="mdi:counter", diagnostic=True, zero=True),
+        Field("num_packets_rx", label="Packets Heard", icon="mdi:counter", diagnostic=True, zero=True),
+        Field("num_packets_rx_bad", label="Bad Packets Heard", icon="mdi:counter", diagnostic=True, zero=True),
+        Field("num_online_nodes", label="Online Nodes", icon="mdi:access-point-network", diagnostic=True, zero=True),
+        Field("num_total_nodes", label="Known Nodes", icon="mdi:access-point-network", diagnostic=True),
+    )),
+    Spec("waypoint", "WAYPOINT_APP", ("mesh_pb2", "Waypoint"), (
+        Field("id"),
+        Field("name", default=""),
+        Field("description", default=""),
+        Field("latitude_i"),
+        Field("longitude_i"),
+        Field("expire"),
+    ), persist=False),
+    Spec("traceroute", "TRACEROUTE_APP", ("mesh_pb2", "RouteDiscovery"), (
+        Field("route", repeated=True),
+        Field("snr_towards", scale=0.25, repeated=True),
+        Field("route_back", repeated=True),
+        Field("snr_back", scale=0.25, repeated=True),
+    ), persist=False),
+    Spec("map_report", "MAP_REPORT_APP", ("mqtt_pb2", "MapReport"), (
+        Field("firmware_version", default=""),
+        Field("modem_preset"),
+        Field("num_online_local_nodes", label="Nodes Online Nearby", icon="mdi:access-point-network", diagnostic=True),
+    )),
+)
+
+SPECS = {spec.section: spec for spec in TABLE}
@@ -0,0 +1,72 @@
+import math
+
+EARTH_RADIUS = 6371000.0
+
+def distance_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    # Equirectangular approximation, accurate enough for the short distances filtered here
+    x = math.radians(lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return EARTH_RADIUS * math.hypot(x, y)
+
+class FilterConfig():
+
+    # Per entry settings, shared by the filters of all its entities and updated in place on options change
+    __slots__ = ("deadband_rel", "max_silence", "min_distance", "min_interval")
+
+    def __init__(self):
+        self.update({})
+
+    def update(self, options: dict):
+        for name in self.__slots__:
+            setattr(self, name, float(options.get(name) or 0))
+
+class Deadband():
+
+    # Publish a numeric value only when it moved enough, or nothing was published for max_silence seconds.
+    # `absolute` is the field's own minimum change (fields.py), the entry adds a relative one
+    __slots__ = ("config", "absolute", "value", "ts")
+
+    def __init__(self, config: FilterConfig, absolute: float | None = None):
+        self.config = config
+        self.absolute = absolute or 0.0
+        self.value = None
+        self.ts = None
+
+    def check(self, value, now: float) -> bool:
+        config = self.config
+        if (self.absolute or config.deadband_rel) and value is not None and self.value is not None:
+            if not (config.max_silence and now - self.ts >= config.max_silence):
+                delta = abs(value - self.value)
+                if delta < self.absolute or delta < abs(self.value) * config.deadband_rel / 100:
+                    return False
+        self.value = value
+        self.ts = now
+        return True
+
+class MovementFilter():
+
+    # Publish a new position only after moving min_distance meters, at most once per min_interval seconds,
+    # and at least every max_silence seconds
+    __slots__ = ("config", "lat", "lon", "ts")
+
+    def __init__(self, config: FilterConfig):
+        self.config = config
+        self.lat = None
+        self.lon = None
+        self.ts = None
+
+    def check(self, lat: float | None, lon: float | None, now: float) -> bool:
+        config = self.config
+        if lat is None or lon is None:
+            changed = self.lat is not None
+            self.lat = self.lon = None
+            return changed
+        if self.lat is not None and not (config.max_silence and now - self.ts >= config.max_silence):
+            if config.min_interval and now - self.ts < config.min_interval:
+                return False
+            if config.min_distance and distance_m(self.lat, self.lon, lat, lon) < config.min_distance:
+                return False
+        self.lat = lat
+        self.lon = lon
+        self.ts = now
+        return True
@@ -0,0 +1,129 @@
+from homeassistant.helpers.update_coordinator import DataUpdateCoordinator
+from homeassistant.helpers import discovery_flow
+from homeassistant.config_entries import SOURCE_INTEGRATION_DISCOVERY
+from homeassistant.core import callback
+
+from .constants import DOMAIN, CONF_ALLOWLIST, CONF_MIN_PACKETS, DEFAULT_MIN_PACKETS
+
+from collections import OrderedDict
+
+import logging
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+# Nodes kept in the registry, least recently heard dropped first
+MAX_REGISTRY = 4096
+
+def parse_allowlist(value: str | None) -> set:
+    result = set()
+    for item in (value or "").replace(";", ",").split(","):
+        if item := item.strip():
+            result.add(int(item[1:] if item[0] == "!" else item, 16))
+    return result
+
+class _NodeRecord():
+
+    __slots__ = ("count", "first_seen", "last_seen", "discovered")
+
+    def __init__(self, now: float):
+        self.count = 0
+        self.first_seen = now
+        self.last_seen = now
+        self.discovered = False
+
+class Gateway(DataUpdateCoordinator):
+
+    # Listens to every packet on a root topic, keeps a registry of the nodes heard there
+    # and starts discovery flows for the nodes worth adding as config entries
+
+    def __init__(self, platform, entry):
+        super().__init__(
+            platform.hass,
+            _LOGGER,
+            name=DOMAIN,
+            update_method=self._async_update,
+        )
+        self._platform = platform
+        self._entry = entry
+        self._entry_id = entry.entry_id
+        self.changed_sections = None
+        self.stats = platform.entry_stats(entry.entry_id)
+        self._registry = OrderedDict()
+        self._topology_version = -1
+
+    async def _async_update(self):
+        return {"nodes": len(self._registry)}
+
+    async def async_load(self):
+        self._config = self._entry.as_dict()["options"]
+        self._allowlist = parse_allowlist(self._config.get(CONF_ALLOWLIST))
+        self._min_packets = int(self._config.get(CONF_MIN_PACKETS, DEFAULT_MIN_PACKETS))
+        _LOGGER.debug(f"async_load: {self._config}")
+        self._pb_topic = self._config.get("pb_topic")
+        await self._platform.async_subscribe(self._pb_topic, self)
+
+    async def async_unload(self):
+        _LOGGER.debug(f"async_unload:")
+        self._platform.unsubscribe(self._pb_topic, self)
+
+    @property
+    def node_num(self) -> None:
+        return None
+
+    @property
+    def online(self) -> None:
+        return None
+
+    @property
+    def key(self) -> str:
+        return self._config.get("key", "AQ==")
+
+    @property
+    def registry(self) -> dict:
+        return self._registry
+
+    @callback
+    def on_packet(self, from_node: int, env, obj: dict | None):
+        now = time.time()
+        changed = set()
+        if record := self._registry.get(from_node):
+            self._registry.move_to_end(from_node)
+        else:
+            record = self._registry[from_node] = _NodeRecord(now)
+            if len(self._registry) > MAX_REGISTRY:
+                self._registry.popitem(last=False)
+            changed.add("nodes")
+        if (version := self._platform.topology.version) != self._topology_version:
+            self._topology_version = version
+            changed.add("topology")
+        if changed:
+            self.changed_sections = changed
+            self.async_set_updated_data({"nodes": len(self._registry)})
+        record.count += 1
+        record.last_seen = now
+        if not record.discovered:
+            # Configured nodes stay undiscovered, removing their entry makes them discoverable again
+            if (
+                (from_node in self._allowlist or (self._min_packets and record.count >= self._min_packets))
+                and not self._platform.is_configured(from_node)
+            ):
+                record.discovered = True
+                self._discover(from_node)
+
+    @callback
+    def on_topology(self):
+        # Edges aged out without any packet
+        self._topology_version = self._platform.topology.version
+        self.changed_sections = {"topology"}
+        self.async_update_listeners()
+
+    def _discover(self, from_node: int):
+        node_id = f"!{from_node:08x}"
+        _LOGGER.debug(f"_discover(): {node_id}")
+        discovery_flow.async_create_flow(self.hass, DOMAIN, context={"source": SOURCE_INTEGRATION_DISCOVERY}, data={
+            "title": node_id,
+            "id": node_id,
+            "pb_topic": self._pb_topic,
+            "key": self.key,
+        })
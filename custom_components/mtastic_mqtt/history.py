@@ -0,0 +1,162 @@
+from array import array
+
+import time
+
+RAW_SIZE = 32
+# (bucket seconds, buckets kept): 1 min for 2 h, 15 min for 1 day, 1 h for 1 week
+TIERS = ((60, 120), (900, 96), (3600, 168))
+# Numeric fields kept per section
+FIELDS = {
+    "device_metrics": ("battery_level", "voltage", "channel_utilization", "air_util_tx"),
+    "environment_metrics": ("temperature", "relative_humidity", "barometric_pressure", "gas_resistance"),
+    "position": ("altitude", "ground_speed", "sats_in_view"),
+}
+MIN_DRAIN_SPAN = 900
+
+class _Tier():
+
+    # Fixed size ring of min / max / sum / count buckets
+    __slots__ = ("period", "size", "bucket", "head", "mins", "maxs", "sums", "counts")
+
+    def __init__(self, period: int, size: int):
+        self.period = period
+        self.size = size
+        self.bucket = None
+        self.head = 0
+        self.mins = array("d", bytes(8 * size))
+        self.maxs = array("d", bytes(8 * size))
+        self.sums = array("d", bytes(8 * size))
+        self.counts = array("I", bytes(4 * size))
+
+    def add(self, ts: float, value: float):
+        bucket = int(ts // self.period)
+        if self.bucket is None:
+            self.bucket = bucket
+        elif bucket > self.bucket:
+            # Clear skipped buckets, at most one full turn
+            for _ in range(min(bucket - self.bucket, self.size)):
+                self.head = (self.head + 1) % self.size
+                self.counts[self.head] = 0
+            self.bucket = bucket
+        elif bucket < self.bucket:
+            return # out of order sample
+        i = self.head
+        if self.counts[i]:
+            if value < self.mins[i]:
+                self.mins[i] = value
+            if value > self.maxs[i]:
+                self.maxs[i] = value
+            self.sums[i] += value
+            self.counts[i] += 1
+        else:
+            self.mins[i] = self.maxs[i] = self.sums[i] = value
+            self.counts[i] = 1
+
+    def window_mean(self, window: float, now: float) -> float | None:
+        # Mean of the bucket means within `window` seconds of `now`, every bucket weighs the same whatever its sample count
+        if self.bucket is None:
+            return None
+        first = int(now // self.period) - int(window // self.period)
+        total = 0.0
+        count = 0
+        for age in range(self.size):
+            if self.bucket - age <= first:
+                break
+            i = (self.head - age) % self.size
+            if self.counts[i]:
+                total += self.sums[i] / self.counts[i]
+                count += 1
+        return total / count if count else None
+
+    def points(self) -> list:
+        # [(bucket start, min, max, mean)], oldest first
+        result = []
+        if self.bucket is None:
+            return result
+        for age in range(self.size - 1, -1, -1):
+            i = (self.head - age) % self.size
+            if count := self.counts[i]:
+                result.append(((self.bucket - age) * self.period, self.mins[i], self.maxs[i], self.sums[i] / count))
+        return result
+
+class Series():
+
+    # Last RAW_SIZE samples plus downsampled tiers, memory doesn't grow with time
+    __slots__ = ("_values", "_times", "_head", "_count", "_sum", "_tiers")
+
+    def __init__(self):
+        self._values = array("d", bytes(8 * RAW_SIZE))
+        self._times = array("d", bytes(8 * RAW_SIZE))
+        self._head = -1
+        self._count = 0
+        self._sum = 0.0
+        self._tiers = tuple(_Tier(period, size) for period, size in TIERS)
+
+    def add(self, ts: float, value: float):
+        self._head = (self._head + 1) % RAW_SIZE
+        if self._count == RAW_SIZE:
+            self._sum -= self._values[self._head]
+        else:
+            self._count += 1
+        self._values[self._head] = value
+        self._times[self._head] = ts
+        self._sum += value
+        for tier in self._tiers:
+            tier.add(ts, value)
+
+    @property
+    def mean(self) -> float | None:
+        return self._sum / self._count if self._count else None
+
+    def window_mean(self, window: float, now: float | None = None) -> float | None:
+        # Time window average from the coarsest tier holding the whole window, independent of the reporting cadence
+        if now is None:
+            now = time.time()
+        for tier in reversed(self._tiers):
+            if tier.period <= window and tier.period * tier.size >= window:
+                return tier.window_mean(window, now)
+        return None
+
+    def _oldest(self) -> int:
+        return (self._head - self._count + 1) % RAW_SIZE
+
+    def rate(self, per: float = 3600) -> float | None:
+        # Change per `per` seconds between the oldest and the newest raw sample
+        if self._count < 2:
+            return None
+        first = self._oldest()
+        span = self._times[self._head] - self._times[first]
+        if span < MIN_DRAIN_SPAN:
+            return None
+        return (self._values[self._head] - self._values[first]) * per / span
+
+    def as_dict(self) -> dict:
+        first = self._oldest()
+        return {
+            "raw": [(self._times[(first + i) % RAW_SIZE], self._values[(first + i) % RAW_SIZE]) for i in range(self._count)],
+            **{f"{tier.period}s": tier.points() for tier in self._tiers},
+        }
+
+class NodeHistory():
+
+    def __init__(self):
+        self._series = {}
+
+    def add(self, type_: str, payload: dict, ts: float | None = None):
+        if not (fields := FIELDS.get(type_)):
+            return
+        if ts is None:
+            ts = time.time()
+        for name in fields:
+            # None - the field wasn't reported
+            if (value := payload.get(name)) is not None:
+                key = (type_, name)
+                if not (series := self._series.get(key)):
+                    series = self._series[key] = Series()
+                series.add(ts, value)
+
+    def get(self, type_: str, name: str) -> Series | None:
+        return self._series.get((type_, name))
+
+    def as_dict(self) -> dict:
+        return {f"{type_}.{name}": series.as_dict() for (type_, name), series in self._series.items()}
@@ -0,0 +1,108 @@
+from array import array
+from collections import OrderedDict
+
+import time
+
+# (node, gateway) pairs kept, least recently heard dropped first
+MAX_LINKS = 4096
+# Weight of the newest sample in the averages
+ALPHA = 0.1
+MAX_HOPS = 7
+# Gateway clocks off by more than that don't count towards the delay
+MAX_DELAY = 3600
+
+class _Link():
+
+    # Streaming stats of one node as heard by one gateway, O(1) per packet
+    __slots__ = ("count", "first_seen", "last_seen", "snr", "rssi", "delay", "interval", "hops")
+
+    def __init__(self, now: float):
+        self.count = 0
+        self.first_seen = now
+        self.last_seen = now
+        self.snr = None
+        self.rssi = None
+        self.delay = None
+        self.interval = None
+        self.hops = array("I", bytes(4 * (MAX_HOPS + 1)))
+
+    def add(self, packet, now: float):
+        if self.count:
+            interval = now - self.last_seen
+            self.interval = interval if self.interval is None else self.interval + ALPHA * (interval - self.interval)
+        self.count += 1
+        self.last_seen = now
+        # Zero RSSI: not received over the air (the gateway's own packets)
+        if packet.rx_rssi:
+            self.snr = packet.rx_snr if self.snr is None else self.snr + ALPHA * (packet.rx_snr - self.snr)
+            self.rssi = packet.rx_rssi if self.rssi is None else self.rssi + ALPHA * (packet.rx_rssi - self.rssi)
+        if packet.rx_time and 0 <= (delay := now - packet.rx_time) <= MAX_DELAY:
+            self.delay = delay if self.delay is None else self.delay + ALPHA * (delay - self.delay)
+        # Firmware before 2.3 doesn't set hop_start
+        if packet.hop_start:
+            self.hops[min(MAX_HOPS, max(0, packet.hop_start - packet.hop_limit))] += 1
+
+    @property
+    def rate(self) -> float | None:
+        # Packets per hour
+        return 3600 / self.interval if self.interval else None
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "first_seen": self.first_seen,
+            "last_seen": self.last_seen,
+            "snr": round(self.snr, 2) if self.snr is not None else None,
+            "rssi": round(self.rssi, 1) if self.rssi is not None else None,
+            "delay": round(self.delay, 2) if self.delay is not None else None,
+            "rate": round(rate, 2) if (rate := self.rate) is not None else None,
+            "hops": {str(h): c for h, c in enumerate(self.hops) if c},
+        }
+
+class Links():
+
+    # Link quality per (node, gateway) from the envelope metadata of every copy of a packet, duplicates included
+
+    def __init__(self, max_size: int = MAX_LINKS):
+        self._max_size = max_size
+        self._links = OrderedDict()
+        self._by_node = {}
+
+    def __len__(self) -> int:
+        return len(self._links)
+
+    def record(self, env, now: float | None = None):
+        if now is None:
+            now = time.time()
+        packet = env.packet
+        key = (node := getattr(packet, "from"), env.gateway_id)
+        if link := self._links.get(key):
+            self._links.move_to_end(key)
+        else:
+            link = self._links[key] = _Link(now)
+            self._by_node.setdefault(node, set()).add(env.gateway_id)
+            if len(self._links) > self._max_size:
+                (old_node, old_gateway), _ = self._links.popitem(last=False)
+                gateways = self._by_node[old_node]
+                gateways.discard(old_gateway)
+                if not gateways:
+                    del self._by_node[old_node]
+        link.add(packet, now)
+
+    def gateways(self, node: int) -> dict:
+        return {gateway: self._links[(node, gateway)] for gateway in self._by_node.get(node, ())}
+
+    def best(self, node: int) -> tuple:
+        # (gateway, link) with the best average SNR
+        result = (None, None)
+        for gateway, link in self.gateways(node).items():
+            if link.snr is not None and (result[1] is None or link.snr > result[1].snr):
+                result = (gateway, link)
+        return result
+
+    def as_dict(self, nodes=None) -> dict:
+        nodes = self._by_node.keys() if nodes is None else nodes
+        return {
+            f"!{node:08x}": {gateway: link.as_dict() for gateway, link in self.gateways(node).items()}
+            for node in nodes if node in self._by_node
+        }
@@ -0,0 +1,124 @@
+import heapq
+import time
+
+# Seconds between deadline checks, shared by all nodes
+TICK = 30
+# Weight of the newest interval in the reporting cadence average
+ALPHA = 0.25
+# Intervals shorter than that are bursts (telemetry right after position), not cadence
+MIN_SAMPLE = 30
+MAX_TIMEOUT = 2 * 86400
+DEFAULT_FACTOR = 3.0
+DEFAULT_MIN_TIMEOUT = 900
+
+class _Node():
+
+    __slots__ = ("last_seen", "interval", "deadline", "online", "scheduled", "listener")
+
+    def __init__(self, listener):
+        self.last_seen = None
+        self.interval = None
+        self.deadline = None
+        self.online = None
+        self.scheduled = None
+        self.listener = listener
+
+class Liveness():
+
+    # Offline detection for all nodes: a deadline per node derived from its reporting cadence, kept in one heap.
+    # A later deadline just updates the node and its heap entry is re-armed when it comes due, an earlier one
+    # (the first interval learned) pushes a new entry and the old one is skipped
+
+    def __init__(self, factor: float = DEFAULT_FACTOR, min_timeout: float = DEFAULT_MIN_TIMEOUT):
+        self._factor = factor
+        self._min_timeout = min_timeout
+        self._nodes = {}
+        self._heap = []
+        self._seq = 0
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def _timeout(self, node: _Node) -> float:
+        # Until the cadence is known any reporting interval is plausible
+        if node.interval is None:
+            return MAX_TIMEOUT
+        return min(MAX_TIMEOUT, max(self._min_timeout, node.interval * self._factor))
+
+    def _schedule(self, key: str, node: _Node):
+        if node.scheduled is None or node.deadline < node.scheduled:
+            node.scheduled = node.deadline
+            self._seq += 1
+            heapq.heappush(self._heap, (node.deadline, self._seq, key, node))
+
+    def add(self, key: str, last_seen: float | None, listener, interval: float | None = None, now: float | None = None):
+        # `listener(online)` is called on timeout transitions only, packets report theirs from seen().
+        # `interval` is the cadence learned before a restart
+        if now is None:
+            now = time.time()
+        node = self._nodes[key] = _Node(listener)
+        node.interval = interval
+        if last_seen is not None:
+            node.last_seen = last_seen
+            node.deadline = last_seen + self._timeout(node)
+            node.online = now < node.deadline
+            if node.online:
+                self._schedule(key, node)
+
+    def remove(self, key: str):
+        # Heap entries of removed (or re-added) nodes are skipped when they come due
+        self._nodes.pop(key, None)
+
+    def seen(self, key: str, now: float | None = None) -> bool:
+        # Returns True if the node just came back online
+        if not (node := self._nodes.get(key)):
+            return False
+        if now is None:
+            now = time.time()
+        # Sampled whether or not the node timed out in between, a gap longer than any timeout counts as MAX_TIMEOUT
+        if node.last_seen is not None and (interval := now - node.last_seen) >= MIN_SAMPLE:
+            interval = min(interval, MAX_TIMEOUT)
+            node.interval = interval if node.interval is None else node.interval + ALPHA * (interval - node.interval)
+        node.last_seen = now
+        node.deadline = now + self._timeout(node)
+        self._schedule(key, node)
+        if node.online:
+            return False
+        node.online = True
+        return True
+
+    def interval(self, key: str) -> float | None:
+        return node.interval if (node := self._nodes.get(key)) else None
+
+    def online(self, key: str) -> bool | None:
+        return node.online if (node := self._nodes.get(key)) else None
+
+    def tick(self, now: float | None = None) -> list:
+        # Returns the keys that went offline, their listeners were called
+        if now is None:
+            now = time.time()
+        result = []
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            deadline, _, key, node = heapq.heappop(heap)
+            if self._nodes.get(key) is not node or node.scheduled != deadline:
+                continue
+            node.scheduled = None
+            if node.deadline > now:
+                self._schedule(key, node)
+            elif node.online:
+                node.online = False
+                result.append(key)
+                node.listener(False)
+        return result
+
+    def as_dict(self, key: str) -> dict | None:
+        if not (node := self._nodes.get(key)):
+            return None
+        return {
+            "online": node.online,
+            "last_seen": node.last_seen,
+            "interval": round(node.interval, 1) if node.interval is not None else None,
+            "timeout": round(self._timeout(node), 1),
+            "deadline": node.deadline,
+        }
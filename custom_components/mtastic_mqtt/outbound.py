@@ -0,0 +1,209 @@
+from homeassistant.components.mqtt import client as mqtt_client
+
+from .constants import DOMAIN
+from .dispatcher import topic_levels
+from .pb import mesh_pb2, mqtt_pb2, portnums_pb2, telemetry_pb2
+from .proto import channel_hash, encrypt_packet
+
+from collections import OrderedDict
+
+import asyncio
+import logging
+import random
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+HOP_LIMIT = 3
+# Seconds between packets on a quiet channel
+MIN_SPACING = 5
+# Channel utilization (%) where the spacing starts growing, up to MAX_SPACING_FACTOR times,
+# and where sending pauses - the firmware stops sending its own telemetry at 25%
+BUSY_UTIL = 10
+CONGESTED_UTIL = 25
+MAX_SPACING_FACTOR = 6
+# Hourly TX airtime (%) of the target node above which requests needing its reply wait
+AIR_TX_LIMIT = 8
+BACKOFF = 30
+MAX_BACKOFF = 600
+# Utilization reports older than that don't count
+LOAD_MAX_AGE = 900
+# Pending packets older than that are dropped
+MAX_AGE = 900
+MAX_PENDING = 100
+
+def downlink_topic(pb_topic: str, channel: str | None, sender: int) -> tuple | None:
+    # (topic, channel name): <root>/2/e/<channel>/<our gateway id>. `channel` is the channel_id of the node's
+    # last envelope, without one the channel level of the subscription is used - a root topic (msh/EU_868/2/e/#)
+    # has none and None is returned
+    root, topic_channel = topic_levels(pb_topic)
+    if (channel := channel or topic_channel) is None:
+        return None
+    return "/".join(root + [channel, f"!{sender:08x}"]), channel
+
+# Outbound kinds: (portnum, payload builder, wants a reply)
+KINDS = {
+    "text": (portnums_pb2.TEXT_MESSAGE_APP, lambda text: text.encode("utf8"), False),
+    "position": (portnums_pb2.POSITION_APP, lambda _: mesh_pb2.Position().SerializeToString(), True),
+    "device_metrics": (portnums_pb2.TELEMETRY_APP, lambda _: telemetry_pb2.Telemetry(
+        device_metrics=telemetry_pb2.DeviceMetrics()).SerializeToString(), True),
+    "environment_metrics": (portnums_pb2.TELEMETRY_APP, lambda _: telemetry_pb2.Telemetry(
+        environment_metrics=telemetry_pb2.EnvironmentMetrics()).SerializeToString(), True),
+}
+
+def make_data(kind: str, text: str | None = None):
+    portnum, payload, want_response = KINDS[kind]
+    return mesh_pb2.Data(portnum=portnum, payload=payload(text), want_response=want_response)
+
+class Request():
+
+    __slots__ = ("node", "kind", "data", "topic", "channel", "key", "queued")
+
+    def __init__(self, node: int, kind: str, data, topic: str, channel: str, key: str):
+        self.node = node
+        self.kind = kind
+        self.data = data
+        self.topic = topic
+        self.channel = channel
+        self.key = key
+        self.queued = time.monotonic()
+
+    @property
+    def dedup_key(self) -> tuple:
+        # Requests of a kind to a node collapse, texts only when identical
+        if self.kind == "text":
+            return (self.node, self.kind, self.data.payload)
+        return (self.node, self.kind)
+
+    def as_dict(self) -> dict:
+        return {"node": f"!{self.node:08x}", "kind": self.kind, "topic": self.topic, "age": round(time.monotonic() - self.queued)}
+
+class Outbound():
+
+    # Queue of packets sent to the mesh through the MQTT downlink, paced by the channel utilization
+    # and TX airtime the nodes report in their device metrics
+
+    def __init__(self, hass, sender: int | None):
+        self.hass = hass
+        self.sender = sender
+        self._pending = OrderedDict()
+        self._load = {} # node -> (ts, channel_utilization, air_util_tx)
+        self._task = None
+        self._last_sent = 0.0
+        self.counters = {"sent": 0, "collapsed": 0, "expired": 0, "rejected": 0}
+
+    def observe(self, node: int, payload: dict, now: float | None = None):
+        self._load[node] = (
+            time.time() if now is None else now,
+            payload.get("channel_utilization") or 0.0,
+            payload.get("air_util_tx") or 0.0,
+        )
+
+    def channel_load(self, now: float | None = None) -> float:
+        # Busiest recently reported channel utilization, the channel is shared so the worst view counts
+        if now is None:
+            now = time.time()
+        result = 0.0
+        for node, (ts, utilization, _) in tuple(self._load.items()):
+            if now - ts > LOAD_MAX_AGE:
+                del self._load[node]
+            elif utilization > result:
+                result = utilization
+        return result
+
+    def _air_util_tx(self, node: int, now: float) -> float:
+        if (load := self._load.get(node)) and now - load[0] <= LOAD_MAX_AGE:
+            return load[2]
+        return 0.0
+
+    @staticmethod
+    def spacing(load: float) -> float | None:
+        # None - congested, wait
+        if load >= CONGESTED_UTIL:
+            return None
+        if load <= BUSY_UTIL:
+            return MIN_SPACING
+        return MIN_SPACING * (1 + (MAX_SPACING_FACTOR - 1) * (load - BUSY_UTIL) / (CONGESTED_UTIL - BUSY_UTIL))
+
+    def submit(self, request: Request) -> str:
+        if (key := request.dedup_key) in self._pending:
+            self.counters["collapsed"] += 1
+            return "collapsed"
+        if len(self._pending) >= MAX_PENDING:
+            self.counters["rejected"] += 1
+            return "rejected"
+        self._pending[key] = request
+        if not self._task:
+            self._task = self.hass.async_create_background_task(self._async_drain(), f"{DOMAIN} outbound")
+        return "queued"
+
+    def _expire(self, now: float):
+        for key, request in tuple(self._pending.items()):
+            if now - request.queued > MAX_AGE:
+                _LOGGER.warning(f"Outbound {request.kind} to !{request.node:08x} expired, channel busy")
+                del self._pending[key]
+                self.counters["expired"] += 1
+
+    def _next(self) -> Request | None:
+        # Oldest request whose target isn't over its TX airtime
+        wall = time.time()
+        for key, request in tuple(self._pending.items()):
+            if not request.data.want_response or self._air_util_tx(request.node, wall) < AIR_TX_LIMIT:
+                del self._pending[key]
+                return request
+        return None
+
+    async def _async_drain(self):
+        backoff = 0
+        try:
+            while self._pending:
+                # Also while congested, requests don't wait longer than MAX_AGE
+                self._expire(time.monotonic())
+                if not self._pending:
+                    break
+                if (spacing := self.spacing(self.channel_load())) is None:
+                    backoff = min(MAX_BACKOFF, max(BACKOFF, backoff * 2))
+                    _LOGGER.debug(f"_async_drain(): channel congested, waiting {backoff}s")
+                    await asyncio.sleep(backoff)
+                    continue
+                backoff = 0
+                if (wait := self._last_sent + spacing - time.monotonic()) > 0:
+                    await asyncio.sleep(wait)
+                    continue
+                if not (request := self._next()):
+                    if self._pending:
+                        await asyncio.sleep(BACKOFF)
+                    continue
+                try:
+                    await self._async_publish(request)
+                except Exception:
+                    _LOGGER.exception(f"Error publishing outbound {request.kind}")
+                self._last_sent = time.monotonic()
+        finally:
+            self._task = None
+
+    def build(self, request: Request) -> bytes:
+        packet = mesh_pb2.MeshPacket(
+            to=request.node,
+            id=random.getrandbits(32) or 1,
+            hop_limit=HOP_LIMIT,
+            hop_start=HOP_LIMIT,
+            channel=channel_hash(request.channel, request.key),
+        )
+        setattr(packet, "from", self.sender)
+        encrypt_packet(packet, request.data, request.key)
+        env = mqtt_pb2.ServiceEnvelope(packet=packet, channel_id=request.channel, gateway_id=f"!{self.sender:08x}")
+        return env.SerializeToString()
+
+    async def _async_publish(self, request: Request):
+        _LOGGER.debug(f"_async_publish(): {request.kind} to !{request.node:08x} on {request.topic}")
+        await mqtt_client.async_publish(self.hass, request.topic, self.build(request), encoding=None)
+        self.counters["sent"] += 1
+
+    def as_dict(self) -> dict:
+        return {
+            "sender": f"!{self.sender:08x}" if self.sender is not None else None,
+            "channel_load": self.channel_load(),
+            "pending": [r.as_dict() for r in self._pending.values()],
+            **self.counters,
+        }
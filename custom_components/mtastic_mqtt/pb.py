@@ -0,0 +1,66 @@
+# Meshtastic protobuf modules, loaded without running the meshtastic package __init__:
+# it pulls in the serial / BLE / pubsub client stack, the integration only needs the generated _pb2 modules
+
+import importlib
+import importlib.abc
+import importlib.util
+import logging
+import os
+import sys
+import types
+
+_LOGGER = logging.getLogger(__name__)
+
+MODULES = ("mesh_pb2", "mqtt_pb2", "portnums_pb2", "telemetry_pb2")
+# The generated files are loaded by path under this name, sys.modules["meshtastic"] is never touched,
+# so a concurrent or later `import meshtastic` gets the real package
+_PACKAGE = "_mtastic_mqtt_protobuf"
+
+class _Loader(importlib.abc.Loader):
+
+    # Compiled from source, with the generated `from meshtastic.protobuf import` of the dependencies pointed
+    # at the private package. No bytecode cache: it would be shared with the real modules
+    def __init__(self, path: str):
+        self.path = path
+
+    def exec_module(self, module):
+        with open(self.path, "rb") as f:
+            source = f.read().replace(b"from meshtastic.protobuf import", f"from {_PACKAGE} import".encode("ascii"))
+        exec(compile(source, self.path, "exec", dont_inherit=True), module.__dict__)
+
+class _Finder(importlib.abc.MetaPathFinder):
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def find_spec(self, fullname, path=None, target=None):
+        package, _, name = fullname.rpartition(".")
+        if package == _PACKAGE and os.path.exists(file := os.path.join(self.path, f"{name}.py")):
+            return importlib.util.spec_from_file_location(fullname, file, loader=_Loader(file))
+        return None
+
+def _load_slim() -> list:
+    if _PACKAGE not in sys.modules:
+        # find_spec of a top level package doesn't import it
+        spec = importlib.util.find_spec("meshtastic")
+        if spec is None or not spec.submodule_search_locations:
+            raise ImportError("meshtastic package not found")
+        path = os.path.join(spec.submodule_search_locations[0], "protobuf")
+        if not os.path.isdir(path):
+            raise ImportError(f"meshtastic protobuf modules not found in {path}")
+        sys.meta_path.append(_Finder(path))
+        package = types.ModuleType(_PACKAGE)
+        package.__path__ = []
+        sys.modules[_PACKAGE] = package
+    return [importlib.import_module(f"{_PACKAGE}.{name}") for name in MODULES]
+
+def _load() -> list:
+    if "meshtastic" not in sys.modules:
+        try:
+            return _load_slim()
+        except Exception:
+            _LOGGER.debug("_load(): slim protobuf import failed, importing meshtastic", exc_info=True)
+    meshtastic = importlib.import_module("meshtastic")
+    return [getattr(meshtastic, name) for name in MODULES]
+
+mesh_pb2, mqtt_pb2, portnums_pb2, telemetry_pb2 = _load()
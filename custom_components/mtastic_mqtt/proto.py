@@ -1,50 +1,21 @@
-from meshtastic import mesh_pb2, mqtt_pb2, portnums_pb2, telemetry_pb2
-
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.backends import default_backend
+from .pb import mesh_pb2, mqtt_pb2, portnums_pb2, telemetry_pb2
+from .fields import TABLE, Spec
 
 import base64
-
+import functools
+import operator
+import struct
 
 import logging
 
 _LOGGER = logging.getLogger(__name__)
 
+_NONCE = struct.Struct("<QQ")
+_PKI_NONCE = struct.Struct("<I4sIx")
+# (section, field) of the fields with presence (proto3 optional), the others have no "not reported" state:
+# a zero may be a real value or a field the sender didn't set
+PRESENCE = set()
 
-def _as_position(obj, envelope):
-    return ("position", {
-        "latitude_i": obj.latitude_i,
-        "longitude_i": obj.longitude_i,
-        "altitude": obj.altitude,
-        "ground_speed": obj.ground_speed,
-        "sats_in_view": obj.sats_in_view,
-    })
-
-def _as_telemetry(obj, envelope):
-    type_ = obj.WhichOneof("variant")
-    _LOGGER.debug(f"_as_telemetry: {type_}")
-    if type_ == "device_metrics":
-        return ("device_metrics", {
-            "battery_level": obj.device_metrics.battery_level,
-            "voltage": obj.device_metrics.voltage,
-            "channel_utilization": obj.device_metrics.channel_utilization,
-            "air_util_tx": obj.device_metrics.air_util_tx,
-        })
-    elif type_ == "environment_metrics":
-        return ("environment_metrics", {
-            "temperature": obj.environment_metrics.temperature,
-            "relative_humidity": obj.environment_metrics.relative_humidity,
-            "barometric_pressure": obj.environment_metrics.barometric_pressure,
-            "gas_resistance": obj.environment_metrics.gas_resistance,
-        })
-    return (None, {})
-
-def _as_node_info(obj, envelope):
-    return ("nodeinfo", {
-        "id": obj.id,
-        "shortname": obj.short_name,
-        "longname": obj.long_name,
-    })
 
 def _as_neighbor_info(obj, envelope):
     payload = {
@@ -59,29 +30,95 @@ def _as_text_message(obj, envelope):
         "rx_time": envelope.packet.rx_time,
     })
 
-_converters = {
-    portnums_pb2.POSITION_APP: (mesh_pb2.Position, _as_position),
-    portnums_pb2.TELEMETRY_APP: (telemetry_pb2.Telemetry, _as_telemetry),
-    portnums_pb2.NODEINFO_APP: (mesh_pb2.User, _as_node_info),
-    portnums_pb2.NEIGHBORINFO_APP: (mesh_pb2.NeighborInfo, _as_neighbor_info),
-    portnums_pb2.TEXT_MESSAGE_APP: (None, _as_text_message)
-}
+def _compile(spec: Spec, cls):
+    # Converter of one table section: a single attrgetter for all its fields, fixups only for scaled / repeated ones.
+    # Fields with presence that aren't set become None, real zeros are kept
+    descriptor = cls.DESCRIPTOR.fields_by_name[spec.variant].message_type if spec.variant else cls.DESCRIPTOR
+    fields = [f for f in spec.fields if f.path.split(".")[0] in descriptor.fields_by_name]
+    if missing := [f.name for f in spec.fields if f not in fields]:
+        _LOGGER.debug("_compile(): %s fields not in the installed protobufs: %s", spec.section, missing)
+    if not fields:
+        return None
+    names = tuple(f.name for f in fields)
+    prefix = f"{spec.variant}." if spec.variant else ""
+    getter = operator.attrgetter(*(prefix + f.path for f in fields))
+    if len(fields) == 1:
+        getter = lambda obj, _getter=getter: (_getter(obj), )
+    fixups = tuple((i, f.scale, f.repeated, f.binary) for i, f in enumerate(fields) if f.scale or f.repeated or f.binary)
+    optional = tuple((i, f.path) for i, f in enumerate(fields) if getattr(descriptor.fields_by_name[f.path], "has_presence", False) and not f.repeated)
+    section = spec.section
+    PRESENCE.update((section, fields[i].name) for i, _ in optional)
+    if not fixups and not optional:
+        return lambda obj, envelope: (section, dict(zip(names, getter(obj))))
+    variant = spec.variant
+    def convert(obj, envelope):
+        values = list(getter(obj))
+        if optional:
+            message = getattr(obj, variant) if variant else obj
+            for i, path in optional:
+                if not message.HasField(path):
+                    values[i] = None
+        for i, scale, repeated, binary in fixups:
+            if values[i] is None:
+                continue
+            if binary:
+                values[i] = base64.b64encode(values[i]).decode("ascii")
+            elif repeated:
+                values[i] = [v * scale for v in values[i]] if scale else list(values[i])
+            else:
+                values[i] *= scale
+        return (section, dict(zip(names, values)))
+    return convert
+
+def _build_converters() -> dict:
+    modules = {"mesh_pb2": mesh_pb2, "mqtt_pb2": mqtt_pb2, "telemetry_pb2": telemetry_pb2}
+    result = {
+        portnums_pb2.NEIGHBORINFO_APP: (mesh_pb2.NeighborInfo, _as_neighbor_info),
+        portnums_pb2.TEXT_MESSAGE_APP: (None, _as_text_message),
+    }
+    variants = {}
+    for spec in TABLE:
+        if (portnum := getattr(portnums_pb2, spec.portnum, None)) is None or not hasattr(modules[spec.message[0]], spec.message[1]):
+            _LOGGER.debug("_build_converters(): %s not in the installed protobufs", spec.section)
+            continue
+        cls = getattr(modules[spec.message[0]], spec.message[1])
+        if spec.variant and spec.variant not in cls.DESCRIPTOR.fields_by_name:
+            continue
+        if not (converter := _compile(spec, cls)):
+            continue
+        if spec.variant:
+            variants.setdefault(portnum, (cls, {}))[1][spec.variant] = converter
+        else:
+            result[portnum] = (cls, converter)
+    for portnum, (cls, by_variant) in variants.items():
+        # Oneof messages: one dict lookup by the set variant instead of an if / elif chain
+        def convert(obj, envelope, _by_variant=by_variant):
+            if converter := _by_variant.get(obj.WhichOneof("variant")):
+                return converter(obj, envelope)
+            return (None, {})
+        result[portnum] = (cls, convert)
+    return result
+
+_converters = _build_converters()
 
-def convert_envelope_to_json(envelope) -> dict:
+def convert_envelope_to_json(envelope, data=None) -> dict:
+    if data is None:
+        data = envelope.packet.decoded
     result = {
         "from": getattr(envelope.packet, "from"),
+        "to": envelope.packet.to,
         "sender": envelope.gateway_id,
     }
-    if config := _converters.get(envelope.packet.decoded.portnum):
+    if config := _converters.get(data.portnum):
         if config[0]:
             obj = config[0]()
-            obj.ParseFromString(envelope.packet.decoded.payload)
-            _LOGGER.debug(f"convert_packet_to_json(): proto = {obj}")
+            obj.ParseFromString(data.payload)
+            _LOGGER.debug("convert_packet_to_json(): proto = %s", obj)
         else:
-            obj = envelope.packet.decoded.payload.decode("utf8")
+            obj = data.payload.decode("utf8")
 
         type_, payload = config[1](obj, envelope)
-        _LOGGER.debug(f"convert_packet_to_json(): result = {type_}, {payload}")
+        _LOGGER.debug("convert_packet_to_json(): result = %s, %s", type_, payload)
         if type_ and payload:
             result = {
                 **result,
@@ -89,27 +126,96 @@ def convert_envelope_to_json(envelope) -> dict:
                 "payload": payload
             }
     else:
-        _LOGGER.debug(f"convert_packet_to_json(): unsupported portnum = {envelope.packet.decoded.portnum}")
+        _LOGGER.debug("convert_packet_to_json(): unsupported portnum = %s", data.portnum)
     return result
 
 DEFAULT_ENC_KEY = "1PG7OiApB1nwvP+rz05pAQ=="
-
-def try_encrypt_envelope(envelope, key_b64):
-
-    key_bytes = base64.b64decode(key_b64.replace("_", "/").replace("-", "+").encode("ascii"))
-    if len(key_bytes) == 1 and key_bytes[0] == 0x01:
+KEY_CACHE_SIZE = 32
+
+_ciphers = None
+
+def _cipher_stack():
+    # cryptography is imported with the first key, not when the integration loads
+    global _ciphers
+    if _ciphers is None:
+        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+        _ciphers = (Cipher, algorithms, modes)
+    return _ciphers
+
+_pki = None
+
+def _pki_stack():
+    global _pki
+    if _pki is None:
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey, X25519PublicKey
+        from cryptography.hazmat.primitives.ciphers.aead import AESCCM
+        _pki = (hashes, X25519PrivateKey, X25519PublicKey, AESCCM)
+    return _pki
+
+def key_bytes(key_b64: str) -> bytes:
+    result = base64.b64decode(key_b64.replace("_", "/").replace("-", "+").encode("ascii"))
+    if len(result) == 1 and result[0] == 0x01:
         # Use default key
-        key_bytes = base64.b64decode(DEFAULT_ENC_KEY.encode("ascii"))
-    
-    nonce_packet_id = getattr(envelope.packet, "id").to_bytes(8, "little")
-    nonce_from_node = getattr(envelope.packet, "from").to_bytes(8, "little")
-    nonce = nonce_packet_id + nonce_from_node
+        result = base64.b64decode(DEFAULT_ENC_KEY.encode("ascii"))
+    return result
+
+@functools.lru_cache(maxsize=KEY_CACHE_SIZE)
+def cipher_key(key_b64: str):
+    return _cipher_stack()[1].AES(key_bytes(key_b64))
 
-    cipher = Cipher(algorithms.AES(key_bytes), modes.CTR(nonce), backend=default_backend())
-    decryptor = cipher.decryptor()
-    decrypted_bytes = decryptor.update(getattr(envelope.packet, "encrypted")) + decryptor.finalize()
+def decrypt_bytes(key, packet_id: int, from_node: int, encrypted: bytes) -> bytes:
+    Cipher, _, modes = _cipher_stack()
+    nonce = _NONCE.pack(packet_id, from_node)
+    decryptor = Cipher(key, modes.CTR(nonce)).decryptor()
+    return decryptor.update(encrypted) + decryptor.finalize()
 
+def decrypt_packet(packet, key_b64):
+    decrypted_bytes = decrypt_bytes(cipher_key(key_b64), packet.id, getattr(packet, "from"), packet.encrypted)
     data = mesh_pb2.Data()
     data.ParseFromString(decrypted_bytes)
-    envelope.packet.decoded.CopyFrom(data)
+    return data
+
+def try_encrypt_envelope(envelope, key_b64):
+    envelope.packet.decoded.CopyFrom(decrypt_packet(envelope.packet, key_b64))
+
+def encrypt_packet(packet, data, key_b64):
+    # AES-CTR is symmetric, the same keystream encrypts
+    packet.encrypted = decrypt_bytes(cipher_key(key_b64), packet.id, getattr(packet, "from"), data.SerializeToString())
+
+# PKI direct messages: ciphertext | 8 byte auth tag | 4 byte extra nonce
+PKI_TAG_SIZE = 8
+PKI_OVERHEAD = PKI_TAG_SIZE + 4
+# (own private key, peer public key) pairs whose shared key is kept
+PKI_CACHE_SIZE = 256
+
+def is_pki(envelope) -> bool:
+    # Older protobufs don't have pki_encrypted, the firmware uplinks PKI packets on the "PKI" channel
+    return envelope.channel_id == "PKI" or getattr(envelope.packet, "pki_encrypted", False)
+
+@functools.lru_cache(maxsize=PKI_CACHE_SIZE)
+def pki_key(private_b64: str, public_b64: str):
+    # X25519 agreement hashed with SHA256, as the firmware does. Once per peer, not per packet
+    hashes, X25519PrivateKey, X25519PublicKey, AESCCM = _pki_stack()
+    private_key = X25519PrivateKey.from_private_bytes(base64.b64decode(private_b64))
+    shared = private_key.exchange(X25519PublicKey.from_public_bytes(base64.b64decode(public_b64)))
+    digest = hashes.Hash(hashes.SHA256())
+    digest.update(shared)
+    return AESCCM(digest.finalize(), tag_length=PKI_TAG_SIZE)
+
+def decrypt_pki_packet(packet, private_b64: str, public_b64: str):
+    encrypted = packet.encrypted
+    nonce = _PKI_NONCE.pack(packet.id, encrypted[-4:], getattr(packet, "from"))
+    data = mesh_pb2.Data()
+    data.ParseFromString(pki_key(private_b64, public_b64).decrypt(nonce, encrypted[:-4], None))
+    return data
+
+def _xor_hash(value: bytes) -> int:
+    result = 0
+    for b in value:
+        result ^= b
+    return result
 
+def channel_hash(name: str, key_b64: str) -> int:
+    # Channel number of encrypted packets, as computed by the firmware
+    return _xor_hash(name.encode("utf8")) ^ _xor_hash(key_bytes(key_b64))
@@ -2,122 +2,148 @@ from homeassistant.components import sensor
 from homeassistant.helpers.entity import EntityCategory
 
 from .coordinator import BaseEntity
-from .constants import DOMAIN
+from .constants import DOMAIN, CONF_TYPE, TYPE_GATEWAY
+from .filters import Deadband
+from .fields import TABLE, Field
+from .proto import PRESENCE
 
 import logging
+import time
 _LOGGER = logging.getLogger(__name__)
 
+# Window of the average channel utilization, from the hourly history tier
+AVG_WINDOW = 86400
+
 async def async_setup_entry(hass, entry, async_setup_entities):
     coordinator = entry.runtime_data
+    if entry.options.get(CONF_TYPE) == TYPE_GATEWAY:
+        async_setup_entities([
+            _NodesSeen(coordinator),
+            _MeshTopology(coordinator, "nodes", "Mesh Nodes", "mdi:graph-outline"),
+            _MeshTopology(coordinator, "links", "Mesh Links", "mdi:vector-polyline"),
+            _MeshTopology(coordinator, "components", "Mesh Components", "mdi:set-split"),
+            _MeshTopology(coordinator, "articulation", "Mesh Articulation Nodes", "mdi:call-split"),
+        ])
+        return
     async_setup_entities([
         _LastUpdate(coordinator),
-        _TelemetryBattery(coordinator),
-        _TelemetryVoltage(coordinator),
-        _TelemetryAirtimelUtil(coordinator),
-        _TelemetryChannelUtil(coordinator),
+        _DirectMessage(coordinator),
+        *(_FieldSensor(coordinator, spec.section, field) for spec in TABLE for field in spec.fields if field.label),
         _Neighbors(coordinator),
-        _TelemetryTemperature(coordinator),
-        _TelemetryRelativeHumidity(coordinator),
-        _TelemetryBarometricPressure(coordinator),
-        _TelemetryGasResistance(coordinator),
+        _BatteryDrain(coordinator),
+        _AvgChannelUtil(coordinator),
+        _StatCounter(coordinator, "received", "Packets Received"),
+        _StatCounter(coordinator, "decrypt_failures", "Decrypt Failures"),
+        _StatCounter(coordinator, "unsupported", "Unsupported Packets"),
+        _StatCounter(coordinator, "parse_errors", "Parse Errors"),
+        _StatCounter(coordinator, "storage_writes", "Storage Writes"),
+        _StatCounter(coordinator, "shed", "Packets Shed (overload)"),
+        _DecodeLatency(coordinator),
+        _LinkStat(coordinator, "gateways", "Gateways Heard", None, "mdi:router-wireless"),
+        _LinkStat(coordinator, "snr", "Best Link SNR", "dB", "mdi:signal"),
+        _LinkStat(coordinator, "rssi", "Best Link RSSI", "dBm", "mdi:signal"),
+        _LinkStat(coordinator, "delay", "Uplink Delay", "s", "mdi:timer-sand"),
     ])
 
-class _TelemetryBattery(BaseEntity, sensor.SensorEntity):
+class _TelemetrySensor(BaseEntity, sensor.SensorEntity):
+
+    # Numeric value published through the deadband filter
+    _deadband_abs = None
 
     def __init__(self, coordinator):
         super().__init__(coordinator)
-        self.with_name(f"tel_battery_level", "Battery")
-        self._attr_device_class = sensor.SensorDeviceClass.BATTERY
-        self._attr_state_class = "measurement"
-        self._attr_native_unit_of_measurement = "%"
-        self._attr_entity_registry_enabled_default = False
-        self._attr_entity_category = EntityCategory.DIAGNOSTIC
+        self._deadband = Deadband(coordinator.filter_config, self._deadband_abs)
+        self._deadband.check(value := self._value(), time.monotonic())
+        self._published = value
 
-    @property
-    def native_value(self) -> float | None:
-        if tel := self.coordinator.data.get("device_metrics"):
-            if (value := tel.get("battery_level")) > 0:
-                return 100 if value > 100 else value
+    def _value(self) -> float | None:
         return None
 
-class _TelemetryVoltage(BaseEntity, sensor.SensorEntity):
-
-    def __init__(self, coordinator):
-        super().__init__(coordinator)
-        self.with_name(f"tel_voltage", "Voltage")
-        self._attr_device_class = sensor.SensorDeviceClass.VOLTAGE
-        self._attr_state_class = "measurement"
-        self._attr_native_unit_of_measurement = "V"
-        self._attr_suggested_display_precision = 1
-        self._attr_entity_registry_enabled_default = False
-        self._attr_entity_category = EntityCategory.DIAGNOSTIC
+    def _should_write(self, changed: set | None) -> bool:
+        if self._deadband.check(value := self._value(), time.monotonic()):
+            self._published = value
+            return True
+        return False
 
     @property
     def native_value(self) -> float | None:
-        if tel := self.coordinator.data.get("device_metrics"):
-            if (value := tel.get("voltage")) > 0:
-                return value
-        return None
+        return self._published
 
-class _TelemetryAirtimelUtil(BaseEntity, sensor.SensorEntity):
+class _FieldSensor(_TelemetrySensor):
 
-    def __init__(self, coordinator):
+    # Sensor of a numeric field of the declarative table, see fields.py
+
+    def __init__(self, coordinator, section: str, field: Field):
+        self._section = section
+        self._field = field.name
+        self._max = field.max
+        self._zero = field.zero or (section, field.name) in PRESENCE
+        self._deadband_abs = field.deadband
+        self._sections = (section, )
         super().__init__(coordinator)
-        self.with_name(f"tel_air_util_tx", "Tx Airtime Utilization")
+        self.with_name(field.unique_id or f"{section}_{field.name}", field.label)
         self._attr_state_class = "measurement"
-        self._attr_native_unit_of_measurement = "%"
-        self._attr_suggested_display_precision = 1
+        self._attr_native_unit_of_measurement = field.unit
         self._attr_entity_registry_enabled_default = False
-        self._attr_icon = "mdi:cloud-percent"
-        self._attr_entity_category = EntityCategory.DIAGNOSTIC
-
-    @property
-    def native_value(self) -> float | None:
-        if tel := self.coordinator.data.get("device_metrics"):
-            if value := tel.get("air_util_tx"):
-                return value
+        if field.device_class:
+            self._attr_device_class = sensor.SensorDeviceClass(field.device_class)
+        if field.precision is not None:
+            self._attr_suggested_display_precision = field.precision
+        if field.icon:
+            self._attr_icon = field.icon
+        if field.diagnostic:
+            self._attr_entity_category = EntityCategory.DIAGNOSTIC
+
+    def _value(self) -> float | None:
+        if section := getattr(self.coordinator.data, self._section):
+            # None - not reported. Without presence zero is the protobuf default - not reported either
+            if (value := getattr(section, self._field)) is None or (not value and not self._zero):
+                return None
+            return self._max if self._max is not None and value > self._max else value
         return None
 
-class _TelemetryChannelUtil(BaseEntity, sensor.SensorEntity):
+class _NodesSeen(BaseEntity, sensor.SensorEntity):
+
+    _sections = ("nodes",)
 
     def __init__(self, coordinator):
         super().__init__(coordinator)
-        self.with_name(f"tel_channel_utilization", "Channel Utilization")
+        self.with_name(f"gw_nodes", "Nodes Seen")
         self._attr_state_class = "measurement"
-        self._attr_native_unit_of_measurement = "%"
-        self._attr_suggested_display_precision = 1
-        self._attr_entity_registry_enabled_default = False
-        self._attr_icon = "mdi:gauge"
-        self._attr_entity_category = EntityCategory.DIAGNOSTIC
+        self._attr_icon = "mdi:access-point-network"
 
     @property
-    def native_value(self) -> float | None:
-        if tel := self.coordinator.data.get("device_metrics"):
-            if value := tel.get("channel_utilization"):
-                return value
-        return None
+    def native_value(self) -> int | None:
+        return self.coordinator.data.get("nodes")
 
-class _TelemetryChannelUtil(BaseEntity, sensor.SensorEntity):
+class _MeshTopology(BaseEntity, sensor.SensorEntity):
 
-    def __init__(self, coordinator):
+    _sections = ("topology",)
+
+    def __init__(self, coordinator, metric: str, name: str, icon: str):
         super().__init__(coordinator)
-        self.with_name(f"tel_channel_utilization", "Channel Utilization")
+        self.with_name(f"mesh_{metric}", name)
+        self._metric = metric
         self._attr_state_class = "measurement"
-        self._attr_native_unit_of_measurement = "%"
-        self._attr_suggested_display_precision = 1
-        self._attr_entity_registry_enabled_default = False
-        self._attr_icon = "mdi:gauge"
+        self._attr_icon = icon
         self._attr_entity_category = EntityCategory.DIAGNOSTIC
 
     @property
-    def native_value(self) -> float | None:
-        if tel := self.coordinator.data.get("device_metrics"):
-            if value := tel.get("channel_utilization"):
-                return value
-        return None
+    def native_value(self) -> int:
+        topology = self.coordinator._platform.topology
+        if self._metric == "nodes":
+            return topology.nodes
+        if self._metric == "links":
+            return topology.links
+        if self._metric == "components":
+            return len(topology.components)
+        return len(topology.articulation)
 
 class _LastUpdate(BaseEntity, sensor.SensorEntity):
 
+    _sections = ("last_update", "nodeinfo")
+    _liveness = False
+
     def __init__(self, coordinator):
         super().__init__(coordinator)
         self.with_name(f"last_update", "Last Update")
@@ -132,100 +158,176 @@ class _LastUpdate(BaseEntity, sensor.SensorEntity):
     @property
     def extra_state_attributes(self):
         result = dict()
-        if pos := self.coordinator.data.get("nodeinfo"):
+        if pos := self.coordinator.data.nodeinfo:
             for attr in ("id", "longname", "shortname"):
-                if value := pos.get(attr):
+                if value := getattr(pos, attr):
                     result[attr] = value
         return result
 
-class _Neighbors(BaseEntity, sensor.SensorEntity):
+class _DirectMessage(BaseEntity, sensor.SensorEntity):
+
+    # Last PKI direct message to the node, needs its private key
+    _sections = ("direct_message",)
+    _liveness = False
 
     def __init__(self, coordinator):
         super().__init__(coordinator)
-        self.with_name(f"nn_neighbors", "Neighbors Count")
+        self.with_name(f"direct_message", "Last Direct Message")
+        self._attr_entity_registry_enabled_default = False
+        self._attr_icon = "mdi:message-lock"
+
+    @property
+    def native_value(self) -> str | None:
+        if message := self.coordinator.data.direct_message:
+            # Text messages show the text, other packets their type
+            return message.text[:255] or message.type
+        return None
+
+    @property
+    def extra_state_attributes(self):
+        if message := self.coordinator.data.direct_message:
+            return {"from": message.from_id, "type": message.type, "rx_time": message.rx_time}
+        return None
+
+class _BatteryDrain(BaseEntity, sensor.SensorEntity):
+
+    _sections = ("history",)
+
+    def __init__(self, coordinator):
+        super().__init__(coordinator)
+        self.with_name(f"hist_battery_drain", "Battery Drain")
         self._attr_state_class = "measurement"
-        self._attr_suggested_display_precision = 0
+        self._attr_native_unit_of_measurement = "%/h"
+        self._attr_suggested_display_precision = 2
         self._attr_entity_registry_enabled_default = False
-        self._attr_icon = "mdi:map-marker-multiple-outline"
+        self._attr_icon = "mdi:battery-minus-variant"
         self._attr_entity_category = EntityCategory.DIAGNOSTIC
 
     @property
     def native_value(self) -> float | None:
-        if nn := self.coordinator.data.get("neighborinfo"):
-            if (value := nn.get("neighbors_count")) >= 0:
-                return value
+        if series := self.coordinator.history.get("device_metrics", "battery_level"):
+            if (value := series.rate()) is not None:
+                return -value
         return None
 
+class _AvgChannelUtil(BaseEntity, sensor.SensorEntity):
 
-class _TelemetryTemperature(BaseEntity, sensor.SensorEntity):
+    _sections = ("history",)
 
     def __init__(self, coordinator):
         super().__init__(coordinator)
-        self.with_name(f"tel_temperature", "Temperature")
-        self._attr_device_class = sensor.SensorDeviceClass.TEMPERATURE
+        self.with_name(f"hist_channel_utilization", "Average Channel Utilization (24h)")
         self._attr_state_class = "measurement"
-        self._attr_native_unit_of_measurement = "°C"
+        self._attr_native_unit_of_measurement = "%"
         self._attr_suggested_display_precision = 1
         self._attr_entity_registry_enabled_default = False
+        self._attr_icon = "mdi:gauge"
+        self._attr_entity_category = EntityCategory.DIAGNOSTIC
 
     @property
     def native_value(self) -> float | None:
-        if tel := self.coordinator.data.get("environment_metrics"):
-            if (value := tel.get("temperature")) > 0:
-                return value
+        if series := self.coordinator.history.get("device_metrics", "channel_utilization"):
+            return series.window_mean(AVG_WINDOW)
         return None
 
+class _StatCounter(BaseEntity, sensor.SensorEntity):
 
-class _TelemetryRelativeHumidity(BaseEntity, sensor.SensorEntity):
+    _sections = ("last_update",)
+    _liveness = False
+
+    def __init__(self, coordinator, counter: str, name: str):
+        super().__init__(coordinator)
+        self.with_name(f"stat_{counter}", name)
+        self._counter = counter
+        self._attr_state_class = sensor.SensorStateClass.TOTAL_INCREASING
+        self._attr_entity_registry_enabled_default = False
+        self._attr_icon = "mdi:counter"
+        self._attr_entity_category = EntityCategory.DIAGNOSTIC
+
+    @property
+    def native_value(self) -> int:
+        return self.coordinator.stats.counters[self._counter]
+
+class _DecodeLatency(BaseEntity, sensor.SensorEntity):
+
+    _sections = ("last_update",)
+    _liveness = False
 
     def __init__(self, coordinator):
         super().__init__(coordinator)
-        self.with_name(f"tel_relativehumidity", "Relative Humidity")
-        self._attr_device_class = sensor.SensorDeviceClass.HUMIDITY
+        self.with_name(f"stat_decode_latency", "Decode Latency")
         self._attr_state_class = "measurement"
-        self._attr_native_unit_of_measurement = "%"
-        self._attr_suggested_display_precision = 1
+        self._attr_native_unit_of_measurement = "ms"
+        self._attr_suggested_display_precision = 2
         self._attr_entity_registry_enabled_default = False
+        self._attr_icon = "mdi:timer-outline"
+        self._attr_entity_category = EntityCategory.DIAGNOSTIC
 
     @property
     def native_value(self) -> float | None:
-        if tel := self.coordinator.data.get("environment_metrics"):
-            if (value := tel.get("relative_humidity")) > 0:
-                return value
-        return None
+        return self.coordinator.stats.decode_ms.mean
+
+    @property
+    def extra_state_attributes(self):
+        hist = self.coordinator.stats.decode_ms
+        return {
+            "p50": hist.percentile(50),
+            "p99": hist.percentile(99),
+            "max": hist.max,
+            "count": hist.count,
+        }
 
+class _Neighbors(BaseEntity, sensor.SensorEntity):
 
-class _TelemetryBarometricPressure(BaseEntity, sensor.SensorEntity):
+    _sections = ("neighborinfo",)
 
     def __init__(self, coordinator):
         super().__init__(coordinator)
-        self.with_name(f"tel_barometric_pressure", "Barometric Pressure")
-        self._attr_device_class = sensor.SensorDeviceClass.ATMOSPHERIC_PRESSURE
+        self.with_name(f"nn_neighbors", "Neighbors Count")
         self._attr_state_class = "measurement"
-        self._attr_native_unit_of_measurement = "hPa"
-        self._attr_suggested_display_precision = 1
+        self._attr_suggested_display_precision = 0
         self._attr_entity_registry_enabled_default = False
+        self._attr_icon = "mdi:map-marker-multiple-outline"
+        self._attr_entity_category = EntityCategory.DIAGNOSTIC
 
     @property
     def native_value(self) -> float | None:
-        if tel := self.coordinator.data.get("environment_metrics"):
-            if (value := tel.get("barometric_pressure")) > 0:
+        if nn := self.coordinator.data.neighborinfo:
+            if (value := nn.neighbors_count) >= 0:
                 return value
         return None
 
-class _TelemetryGasResistance(BaseEntity, sensor.SensorEntity):
+class _LinkStat(BaseEntity, sensor.SensorEntity):
 
-    def __init__(self, coordinator):
+    _sections = ("last_update",)
+    _liveness = False
+
+    def __init__(self, coordinator, metric: str, name: str, unit: str | None, icon: str):
         super().__init__(coordinator)
-        self.with_name(f"tel_gas_resistance", "Gas Resistance (AQI)")
-        self._attr_device_class = sensor.SensorDeviceClass.AQI
+        self.with_name(f"link_{metric}", name)
+        self._metric = metric
         self._attr_state_class = "measurement"
-        self._attr_suggested_display_precision = 1
+        self._attr_native_unit_of_measurement = unit
+        self._attr_suggested_display_precision = 0 if metric == "gateways" else 1
         self._attr_entity_registry_enabled_default = False
+        self._attr_icon = icon
+        self._attr_entity_category = EntityCategory.DIAGNOSTIC
 
     @property
     def native_value(self) -> float | None:
-        if tel := self.coordinator.data.get("environment_metrics"):
-            if (value := tel.get("gas_resistance")) > 0:
-                return value
+        links = self.coordinator._platform.links
+        node_num = self.coordinator.node_num
+        if self._metric == "gateways":
+            return len(links.gateways(node_num))
+        if self._metric == "delay":
+            delays = [link.delay for link in links.gateways(node_num).values() if link.delay is not None]
+            return min(delays) if delays else None
+        _, link = links.best(node_num)
+        return getattr(link, self._metric) if link else None
+
+    @property
+    def extra_state_attributes(self):
+        if self._metric in ("snr", "rssi"):
+            gateway, _ = self.coordinator._platform.links.best(self.coordinator.node_num)
+            return {"gateway": gateway}
         return None
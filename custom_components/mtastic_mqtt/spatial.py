@@ -0,0 +1,149 @@
+import heapq
+import math
+import time
+
+EARTH_RADIUS = 6371000.0
+# Grid cell size in degrees, ~11 km north-south
+CELL = 0.1
+# Cells around a parallel, longitude indexes wrap at the antimeridian
+LON_CELLS = round(360 / CELL)
+M_PER_DEG = math.pi * EARTH_RADIUS / 180
+# Positions older than that are dropped
+MAX_AGE = 24 * 3600
+EXPIRE_INTERVAL = 300
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    p1 = math.radians(lat1)
+    p2 = math.radians(lat2)
+    a = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+def _cell(lat: float, lon: float) -> tuple:
+    return (math.floor(lat / CELL), math.floor(lon / CELL) % LON_CELLS)
+
+class SpatialIndex():
+
+    # Latest position of every node heard, bucketed in a fixed degree grid. Queries only visit the cells
+    # that can hold a match
+
+    def __init__(self, max_age: float = MAX_AGE):
+        self._max_age = max_age
+        self._nodes = {} # node -> (lat, lon, ts, cell)
+        self._cells = {} # cell -> set of nodes
+        self._expired_at = 0.0
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def _remove(self, node: int):
+        _, _, _, cell = self._nodes.pop(node)
+        nodes = self._cells[cell]
+        nodes.discard(node)
+        if not nodes:
+            del self._cells[cell]
+
+    def update(self, node: int, lat: float, lon: float, now: float | None = None):
+        if now is None:
+            now = time.time()
+        cell = _cell(lat, lon)
+        if (old := self._nodes.get(node)) and old[3] != cell:
+            self._remove(node)
+        if not old or old[3] != cell:
+            self._cells.setdefault(cell, set()).add(node)
+        self._nodes[node] = (lat, lon, now, cell)
+        self._expire_due(now)
+
+    def _expire_due(self, now: float):
+        if now - self._expired_at >= EXPIRE_INTERVAL:
+            self.expire(now)
+
+    def expire(self, now: float | None = None):
+        if now is None:
+            now = time.time()
+        self._expired_at = now
+        for node in [node for node, (_, _, ts, _) in self._nodes.items() if now - ts > self._max_age]:
+            self._remove(node)
+
+    def get(self, node: int) -> tuple | None:
+        # (lat, lon, ts)
+        return entry[:3] if (entry := self._nodes.get(node)) else None
+
+    def _cells_around(self, lat: float, lon: float, radius_m: float):
+        # Cells of the bounding box of the circle, or all occupied cells if that is fewer
+        dlat = radius_m / M_PER_DEG
+        dlon = dlat / max(0.01, math.cos(math.radians(min(89.0, abs(lat) + dlat))))
+        lat0, lat1 = math.floor((lat - dlat) / CELL), math.floor((lat + dlat) / CELL)
+        lon0, lon1 = math.floor((lon - dlon) / CELL), math.floor((lon + dlon) / CELL)
+        if (lat1 - lat0 + 1) * (lon1 - lon0 + 1) > len(self._cells) or lon1 - lon0 + 1 >= LON_CELLS:
+            return list(self._cells.values())
+        return [nodes for x in range(lat0, lat1 + 1) for y in range(lon0, lon1 + 1) if (nodes := self._cells.get((x, y % LON_CELLS)))]
+
+    def within(self, lat: float, lon: float, radius_m: float, now: float | None = None) -> list:
+        # [(distance m, node)] closest first
+        if now is None:
+            now = time.time()
+        self._expire_due(now)
+        result = []
+        for nodes in self._cells_around(lat, lon, radius_m):
+            for node in nodes:
+                n_lat, n_lon, ts, _ = self._nodes[node]
+                # Not expired yet, expire() runs every EXPIRE_INTERVAL
+                if now - ts > self._max_age:
+                    continue
+                if (distance := haversine_m(lat, lon, n_lat, n_lon)) <= radius_m:
+                    result.append((distance, node))
+        result.sort()
+        return result
+
+    def nearest(self, lat: float, lon: float, count: int, max_radius_m: float | None = None, now: float | None = None) -> list:
+        # [(distance m, node)] closest first. Rings of cells around the point are searched outwards
+        # until the next ring can't be closer than the count-th match
+        if now is None:
+            now = time.time()
+        self._expire_due(now)
+        if count <= 0 or not self._nodes:
+            return []
+        cx, cy = _cell(lat, lon)
+        heap = [] # max heap of the best `count`: (-distance, node)
+        visited = 0
+        ring = 0
+        while visited < len(self._nodes):
+            if (2 * ring + 1) ** 2 > 4 * len(self._cells) or 2 * ring + 1 > LON_CELLS:
+                # Sparse grid, rings would mostly visit empty cells (or wrap onto themselves)
+                return self._nearest_scan(lat, lon, count, max_radius_m, now)
+            if ring:
+                cells = [(cx + dx, (cy + dy) % LON_CELLS) for dx in range(-ring, ring + 1) for dy in (-ring, ring)]
+                cells += [(cx + dx, (cy + dy) % LON_CELLS) for dx in (-ring, ring) for dy in range(-ring + 1, ring)]
+            else:
+                cells = [(cx, cy)]
+            for cell in cells:
+                for node in self._cells.get(cell, ()):
+                    visited += 1
+                    n_lat, n_lon, ts, _ = self._nodes[node]
+                    if now - ts > self._max_age:
+                        continue
+                    distance = haversine_m(lat, lon, n_lat, n_lon)
+                    if max_radius_m is not None and distance > max_radius_m:
+                        continue
+                    if len(heap) < count:
+                        heapq.heappush(heap, (-distance, node))
+                    elif distance < -heap[0][0]:
+                        heapq.heapreplace(heap, (-distance, node))
+            # Anything outside the searched rings is at least `ring` cell widths away,
+            # cells are narrowest at the poleward edge of the rings
+            bound = ring * CELL * M_PER_DEG * max(0.01, math.cos(math.radians(min(89.0, abs(lat) + (ring + 1) * CELL))))
+            if len(heap) == count and -heap[0][0] <= bound:
+                break
+            if max_radius_m is not None and bound > max_radius_m:
+                break
+            ring += 1
+        return sorted((-d, node) for d, node in heap)
+
+    def _nearest_scan(self, lat: float, lon: float, count: int, max_radius_m: float | None, now: float) -> list:
+        result = (
+            (haversine_m(lat, lon, n_lat, n_lon), node)
+            for node, (n_lat, n_lon, ts, _) in self._nodes.items() if now - ts <= self._max_age
+        )
+        if max_radius_m is not None:
+            result = (r for r in result if r[0] <= max_radius_m)
+        return heapq.nsmallest(count, result)
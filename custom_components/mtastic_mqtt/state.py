@@ -0,0 +1,142 @@
+from .fields import SPECS, Spec
+
+class Section():
+
+    # Fixed set of fields updated in place, defaults match protobuf defaults
+    __slots__ = ()
+    DEFAULTS = {}
+    # Fields kept in the storage snapshot, None - all of them. New fields are only ever appended
+    PERSIST = None
+
+    def __init__(self):
+        for name, value in self.DEFAULTS.items():
+            setattr(self, name, value)
+
+    def update(self, payload: dict) -> bool:
+        changed = False
+        defaults = self.DEFAULTS
+        for name, value in payload.items():
+            if name in defaults and getattr(self, name) != value:
+                setattr(self, name, value)
+                changed = True
+        return changed
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.DEFAULTS}
+
+    @classmethod
+    def persisted(cls) -> tuple:
+        return tuple(cls.DEFAULTS) if cls.PERSIST is None else cls.PERSIST
+
+class NeighborInfo(Section):
+
+    __slots__ = ("neighbors", "neighbors_count")
+    DEFAULTS = {"neighbors": (), "neighbors_count": 0}
+    PERSIST = ("neighbors_count",)
+
+class TextMessage(Section):
+
+    __slots__ = ("text", "rx_time")
+    DEFAULTS = {"text": "", "rx_time": 0}
+    PERSIST = ()
+
+class Liveness(Section):
+
+    # Learned reporting cadence, the offline timeout survives a restart
+    __slots__ = ("interval", )
+    DEFAULTS = {"interval": None}
+
+class DirectMessage(Section):
+
+    # Last PKI direct message to the node: sender node id, packet type and the text of text messages
+    __slots__ = ("from_id", "type", "text", "rx_time")
+    DEFAULTS = {"from_id": "", "type": "", "text": "", "rx_time": 0}
+    PERSIST = ()
+
+def _section_class(spec: Spec):
+    fields = tuple(f.name for f in spec.fields)
+    return type(f"{spec.section.title().replace('_', '')}Section", (Section, ), {
+        "__slots__": fields,
+        "DEFAULTS": {f.name: f.default for f in spec.fields},
+        "PERSIST": None if spec.persist else (),
+    })
+
+_CUSTOM = {
+    "neighborinfo": NeighborInfo,
+    "text_message": TextMessage,
+    "liveness": Liveness,
+    "direct_message": DirectMessage,
+}
+
+# Snapshot order of the sections, new ones are only ever appended
+ORDER = (
+    "position", "device_metrics", "environment_metrics", "neighborinfo", "nodeinfo", "text_message",
+    "power_metrics", "air_quality_metrics", "local_stats", "waypoint", "traceroute", "map_report", "liveness",
+    "direct_message",
+)
+
+SECTIONS = {name: _CUSTOM.get(name) or _section_class(SPECS[name]) for name in ORDER}
+
+class NodeState():
+
+    # Latest known values of a node. Sections are None until the first packet of that type
+    __slots__ = (*SECTIONS, "stat", "last_update")
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, None)
+
+    def apply(self, type_: str, payload: dict) -> bool:
+        if (section := getattr(self, type_)) is None:
+            section = SECTIONS[type_]()
+            setattr(self, type_, section)
+            section.update(payload)
+            return True
+        return section.update(payload)
+
+    def set(self, name: str, value) -> bool:
+        if getattr(self, name) != value:
+            setattr(self, name, value)
+            return True
+        return False
+
+    def as_dict(self) -> dict:
+        result = {}
+        for name in SECTIONS:
+            if (section := getattr(self, name)) is not None:
+                result[name] = section.as_dict()
+        for name in ("stat", "last_update"):
+            if (value := getattr(self, name)) is not None:
+                result[name] = value
+        return result
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        result = cls()
+        for name, value in (data or {}).items():
+            if name in SECTIONS:
+                result.apply(name, value)
+            elif name in ("stat", "last_update"):
+                setattr(result, name, value)
+        return result
+
+    def snapshot(self) -> list:
+        # Compact storage form: [stat, last_update, [section values in persisted() order] or None per section]
+        result = [self.stat, self.last_update]
+        for name, cls in SECTIONS.items():
+            if (fields := cls.persisted()) and (section := getattr(self, name)) is not None:
+                result.append([getattr(section, field) for field in fields])
+            else:
+                result.append(None)
+        return result
+
+    @classmethod
+    def from_snapshot(cls, data: list):
+        result = cls()
+        if not data:
+            return result
+        result.stat, result.last_update = data[0], data[1]
+        for (name, section_cls), values in zip(SECTIONS.items(), data[2:]):
+            if values is not None:
+                result.apply(name, dict(zip(section_cls.persisted(), values)))
+        return result
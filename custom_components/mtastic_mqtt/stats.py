@@ -0,0 +1,77 @@
+import bisect
+
+COUNTERS = (
+    "received",
+    "foreign",
+    "duplicates",
+    "decrypt_failures",
+    "pki_skipped",
+    "unsupported",
+    "parse_errors",
+    "storage_writes",
+    "dropped",
+    "shed",
+)
+
+# Upper bucket bounds, milliseconds
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100)
+
+class Histogram():
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self._bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.buckets[bisect.bisect_left(self._bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def mean(self) -> float | None:
+        return self.total / self.count if self.count else None
+
+    def percentile(self, pct: float) -> float | None:
+        # Upper bound of the bucket containing the percentile
+        if not self.count:
+            return None
+        rank = self.count * pct / 100
+        seen = 0
+        for i, value in enumerate(self.buckets):
+            seen += value
+            if seen >= rank:
+                return self._bounds[i] if i < len(self._bounds) else self.max
+        return self.max
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "max": self.max,
+            "buckets": {
+                **{f"le_{b}": v for b, v in zip(self._bounds, self.buckets)},
+                "inf": self.buckets[-1],
+            },
+        }
+
+class Stats():
+
+    def __init__(self):
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.decode_ms = Histogram()
+
+    def inc(self, name: str, value: int = 1):
+        self.counters[name] += value
+
+    def as_dict(self) -> dict:
+        return {
+            **self.counters,
+            "decode_ms": self.decode_ms.as_dict(),
+        }
@@ -0,0 +1,195 @@
+import time
+
+# Neighbor reports older than that are dropped
+MAX_AGE = 3 * 3600
+EXPIRE_INTERVAL = 60
+
+def node_id(node_num: int) -> str:
+    return f"!{node_num:08x}"
+
+class Topology():
+
+    # Undirected mesh graph built from NEIGHBORINFO reports. The adjacency is updated in place per report,
+    # derived metrics are recomputed lazily, only after the set of edges changed
+
+    def __init__(self, max_age: float = MAX_AGE):
+        self._max_age = max_age
+        self._reports = {} # node -> (ts, {neighbor: snr})
+        self._adj = {} # node -> {neighbor: number of sides reporting the edge}
+        self.version = 0
+        self._metrics = None
+        self._metrics_version = -1
+        self._hops = {}
+        self._expired_at = 0.0
+
+    def _link(self, a: int, b: int):
+        for x, y in ((a, b), (b, a)):
+            edges = self._adj.setdefault(x, {})
+            edges[y] = edges.get(y, 0) + 1
+
+    def _unlink(self, a: int, b: int):
+        for x, y in ((a, b), (b, a)):
+            edges = self._adj[x]
+            if edges[y] > 1:
+                edges[y] -= 1
+            else:
+                del edges[y]
+                if not edges:
+                    del self._adj[x]
+
+    def update(self, node: int, neighbors, now: float | None = None) -> bool:
+        # Returns True if the set of edges changed
+        if now is None:
+            now = time.time()
+        new = {n["node_id"]: n["snr"] for n in neighbors if n["node_id"] != node}
+        _, old = self._reports.get(node, (0, {}))
+        self._reports[node] = (now, new)
+        changed = False
+        for neighbor in old.keys() - new.keys():
+            self._unlink(node, neighbor)
+            changed = True
+        for neighbor in new.keys() - old.keys():
+            self._link(node, neighbor)
+            changed = True
+        if changed:
+            self.version += 1
+        return self.tick(now) or changed
+
+    def tick(self, now: float | None = None) -> bool:
+        # Expiry at most every EXPIRE_INTERVAL, called on reports and periodically so edges age out without them
+        if now is None:
+            now = time.time()
+        if now - self._expired_at >= EXPIRE_INTERVAL:
+            return self.expire(now)
+        return False
+
+    def expire(self, now: float | None = None) -> bool:
+        if now is None:
+            now = time.time()
+        self._expired_at = now
+        stale = [node for node, (ts, _) in self._reports.items() if now - ts > self._max_age]
+        for node in stale:
+            _, old = self._reports.pop(node)
+            for neighbor in old:
+                self._unlink(node, neighbor)
+        if stale:
+            self.version += 1
+        return bool(stale)
+
+    @property
+    def nodes(self) -> int:
+        return len(self._adj)
+
+    @property
+    def links(self) -> int:
+        return sum(len(edges) for edges in self._adj.values()) // 2
+
+    def snr(self, a: int, b: int) -> float | None:
+        # Latest SNR reported for the edge, from either side
+        if (report := self._reports.get(a)) and b in report[1]:
+            return report[1][b]
+        if (report := self._reports.get(b)) and a in report[1]:
+            return report[1][a]
+        return None
+
+    def _ensure_metrics(self):
+        if self._metrics_version == self.version:
+            return self._metrics
+        self._metrics = (self._components(), self._articulation())
+        self._metrics_version = self.version
+        self._hops = {}
+        return self._metrics
+
+    def _components(self) -> list:
+        seen = set()
+        result = []
+        for start in self._adj:
+            if start in seen:
+                continue
+            seen.add(start)
+            component = [start]
+            stack = [start]
+            while stack:
+                for neighbor in self._adj[stack.pop()]:
+                    if neighbor not in seen:
+                        seen.add(neighbor)
+                        component.append(neighbor)
+                        stack.append(neighbor)
+            result.append(component)
+        result.sort(key=len, reverse=True)
+        return result
+
+    def _articulation(self) -> set:
+        # Iterative Tarjan
+        disc = {}
+        low = {}
+        result = set()
+        counter = 0
+        for root in self._adj:
+            if root in disc:
+                continue
+            disc[root] = low[root] = counter
+            counter += 1
+            root_children = 0
+            stack = [(root, None, iter(self._adj[root]))]
+            while stack:
+                node, parent, neighbors = stack[-1]
+                for neighbor in neighbors:
+                    if neighbor == parent:
+                        continue
+                    if neighbor in disc:
+                        low[node] = min(low[node], disc[neighbor])
+                    else:
+                        disc[neighbor] = low[neighbor] = counter
+                        counter += 1
+                        if node == root:
+                            root_children += 1
+                        stack.append((neighbor, node, iter(self._adj[neighbor])))
+                        break
+                else:
+                    stack.pop()
+                    if parent is not None:
+                        low[parent] = min(low[parent], low[node])
+                        if parent != root and low[node] >= disc[parent]:
+                            result.add(parent)
+            if root_children > 1:
+                result.add(root)
+        return result
+
+    @property
+    def components(self) -> list:
+        return self._ensure_metrics()[0]
+
+    @property
+    def articulation(self) -> set:
+        return self._ensure_metrics()[1]
+
+    def hops(self, roots) -> dict:
+        # BFS hop distance from the closest of `roots`, cached until the edges change
+        self._ensure_metrics()
+        key = frozenset(roots)
+        if (result := self._hops.get(key)) is not None:
+            return result
+        result = {root: 0 for root in key if root in self._adj}
+        queue = list(result)
+        for node in queue:
+            distance = result[node] + 1
+            for neighbor in self._adj[node]:
+                if neighbor not in result:
+                    result[neighbor] = distance
+                    queue.append(neighbor)
+        self._hops[key] = result
+        return result
+
+    def as_dict(self, roots=()) -> dict:
+        hops = self.hops(roots) if roots else {}
+        return {
+            "nodes": self.nodes,
+            "links": [
+                {"from": node_id(node), "to": node_id(neighbor), "snr": snr, "age": round(time.time() - ts)}
+                for node, (ts, neighbors) in self._reports.items() for neighbor, snr in neighbors.items()
+            ],
+            "components": [[node_id(n) for n in component] for component in self.components],
+            "articulation": sorted(node_id(n) for n in self.articulation),
+            "hops": {node_id(n): h for n, h in hops.items()},
+        }
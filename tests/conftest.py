@@ -0,0 +1,19 @@
+# Integration modules are imported without running the package __init__ (Home Assistant setup), so the pure
+# ones (liveness, spatial, ...) are testable on their own. Tests needing Home Assistant, meshtastic or
+# cryptography skip when those aren't installed
+
+import os
+import sys
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def _package(name: str, path: str):
+    if name not in sys.modules:
+        module = types.ModuleType(name)
+        module.__path__ = [path]
+        sys.modules[name] = module
+
+_package("custom_components", os.path.join(ROOT, "custom_components"))
+_package("custom_components.mtastic_mqtt", os.path.join(ROOT, "custom_components", "mtastic_mqtt"))
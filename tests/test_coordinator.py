@@ -0,0 +1,53 @@
+import pytest
+
+pytest.importorskip("homeassistant")
+pytest.importorskip("meshtastic")
+
+from types import SimpleNamespace
+
+from custom_components.mtastic_mqtt.coordinator import Coordinator
+from custom_components.mtastic_mqtt.history import NodeHistory
+from custom_components.mtastic_mqtt.liveness import Liveness
+from custom_components.mtastic_mqtt.state import NodeState
+from custom_components.mtastic_mqtt.stats import Stats
+
+NODE = 0x10000001
+OTHER = 0x20000002
+
+def _coordinator(node: int = NODE):
+    # The message handling part only, without the Home Assistant setup
+    coordinator = Coordinator.__new__(Coordinator)
+    coordinator._id = node
+    coordinator._node_id = f"!{node:08x}"
+    coordinator._entry_id = f"entry_{node:08x}"
+    coordinator._config = {}
+    coordinator.data = NodeState()
+    coordinator.history = NodeHistory()
+    coordinator.stats = Stats()
+    coordinator.channel = None
+    coordinator._platform = SimpleNamespace(liveness=Liveness())
+    coordinator._platform.liveness.add(coordinator._entry_id, None, lambda online: None)
+    return coordinator
+
+def test_unsupported_portnum_is_sign_of_life():
+    coordinator = _coordinator()
+    # Routing / admin traffic: decoded, no type
+    changed = coordinator._process_message({"from": NODE, "sender": "!0f000001"})
+    assert changed == {"last_update", "online"}
+    assert coordinator.online
+    assert coordinator.data.last_update is not None
+
+def test_other_sender_ignored():
+    coordinator = _coordinator()
+    assert coordinator._process_message({"from": OTHER, "to": 0xffffffff, "sender": "!0f000001"}) == set()
+    assert coordinator.online is None
+
+def test_direct_message_to_node():
+    coordinator = _coordinator()
+    obj = {"from": OTHER, "to": NODE, "sender": "!0f000001", "type": "text_message", "payload": {"text": "hi", "rx_time": 1700000000}}
+    assert coordinator._process_message(obj) == {"direct_message"}
+    message = coordinator.data.direct_message
+    assert (message.from_id, message.type, message.text, message.rx_time) == ("!20000002", "text_message", "hi", 1700000000)
+    # Not the node's own data, and not a sign of life of the recipient
+    assert coordinator.data.text_message is None
+    assert coordinator.online is None
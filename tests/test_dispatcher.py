@@ -0,0 +1,171 @@
+import pytest
+
+pytest.importorskip("homeassistant")
+pytest.importorskip("meshtastic")
+
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import asyncio
+import base64
+
+from custom_components.mtastic_mqtt import dispatcher
+from custom_components.mtastic_mqtt.links import Links
+from custom_components.mtastic_mqtt.pb import mesh_pb2, mqtt_pb2, portnums_pb2
+from custom_components.mtastic_mqtt.proto import encrypt_packet
+from custom_components.mtastic_mqtt.stats import Stats
+
+from test_coordinator import _coordinator
+from test_proto import PKI_PRIVATE, PKI_PUBLIC, pki_packet
+
+TOPIC = "msh/EU_868/2/e/LongFast/#"
+NODE = 0x10000001
+
+class _Hass():
+
+    def __init__(self, loop):
+        self.loop = loop
+
+    def async_create_background_task(self, coro, name):
+        return self.loop.create_task(coro)
+
+class _Listener():
+
+    def __init__(self, node_num: int):
+        self.node_num = node_num
+        self.key = "AQ=="
+        self.stats = Stats()
+        self.data = SimpleNamespace(nodeinfo=None, neighborinfo=None)
+        self.applied = []
+        self.seen = 0
+
+    def _process_message(self, obj) -> set:
+        self.applied.append(obj)
+        setattr(self.data, obj["type"], obj["payload"])
+        return {obj["type"]}
+
+    def _seen(self) -> set:
+        self.seen += 1
+        return set()
+
+    async def _async_update_state(self, changed: set):
+        pass
+
+def _message(packet_id: int):
+    data = mesh_pb2.Data(portnum=portnums_pb2.POSITION_APP, payload=mesh_pb2.Position(latitude_i=520000000 + packet_id).SerializeToString())
+    packet = mesh_pb2.MeshPacket(to=0xffffffff, id=packet_id, decoded=data)
+    setattr(packet, "from", NODE)
+    env = mqtt_pb2.ServiceEnvelope(packet=packet, channel_id="LongFast", gateway_id="!0f000001")
+    return SimpleNamespace(topic=TOPIC, payload=env.SerializeToString())
+
+def _pki_message():
+    env = mqtt_pb2.ServiceEnvelope(packet=pki_packet(), channel_id="PKI", gateway_id="!0f000001")
+    return SimpleNamespace(topic="msh/EU_868/2/e/PKI/#", payload=env.SerializeToString())
+
+def _node_info_message(node: int, public_key: bytes, packet_id: int = 7):
+    data = mesh_pb2.Data(portnum=portnums_pb2.NODEINFO_APP, payload=mesh_pb2.User(id=f"!{node:08x}", public_key=public_key).SerializeToString())
+    packet = mesh_pb2.MeshPacket(to=0xffffffff, id=packet_id, channel=8)
+    setattr(packet, "from", node)
+    encrypt_packet(packet, data, "AQ==")
+    env = mqtt_pb2.ServiceEnvelope(packet=packet, channel_id="LongFast", gateway_id="!0f000001")
+    return SimpleNamespace(topic=TOPIC, payload=env.SerializeToString())
+
+async def _run(
+    messages: list, workers: int, monkeypatch, node: int = NODE, private_keys: dict = {}, public_keys: dict = {}, queue_size: int = 1000,
+    listener=None,
+) -> tuple:
+    batches = []
+    decode_batch = dispatcher.decode_batch
+    def _decode_batch(payloads, *args):
+        batches.append(len(payloads))
+        return decode_batch(payloads, *args)
+    monkeypatch.setattr(dispatcher, "decode_batch", _decode_batch)
+
+    async def _async_subscribe(hass, topic, msg_callback, encoding=None):
+        return lambda: None
+    monkeypatch.setattr(dispatcher.mqtt_client, "async_subscribe", _async_subscribe)
+
+    executor = ThreadPoolExecutor(max_workers=workers) if workers else None
+    packets = []
+    platform = SimpleNamespace(
+        hass=_Hass(asyncio.get_running_loop()), stats=Stats(), links=Links(), executor=executor, queue_size=queue_size,
+        trace_sample=0, capture=None, private_keys=private_keys, public_keys=public_keys,
+        on_packet=lambda packet, obj: packets.append(obj), listeners=lambda node_num: [],
+    )
+    d = dispatcher.Dispatcher(platform, TOPIC)
+    d.on_packets = packets
+    if listener is None:
+        listener = _Listener(node)
+    await d.async_add(listener)
+    # Delivered together, as the MQTT client does for everything read from the socket at once
+    for message in messages:
+        await d._async_on_message(message)
+    while d._drain_task:
+        await asyncio.sleep(0)
+    if executor:
+        executor.shutdown()
+    return batches, listener, d
+
+def test_burst_decoded_in_executor(monkeypatch):
+    messages = [_message(i + 1) for i in range(100)]
+    batches, listener, d = asyncio.run(_run(messages, 2, monkeypatch))
+    assert sum(batches) >= dispatcher.EXECUTOR_DEPTH
+    assert len(listener.applied) == 100
+    assert d.queue_peak == 100
+
+def test_single_packet_inline(monkeypatch):
+    batches, listener, d = asyncio.run(_run([_message(1)], 2, monkeypatch))
+    assert batches == []
+    assert len(listener.applied) == 1
+
+def test_duplicates_across_batches(monkeypatch):
+    messages = [_message(i % 30 + 1) for i in range(120)]
+    batches, listener, d = asyncio.run(_run(messages, 2, monkeypatch))
+    assert len(listener.applied) == 30
+
+def test_pki_routed_to_recipient(monkeypatch):
+    pytest.importorskip("cryptography")
+    # From a node that isn't configured, to the node holding the private key, through the real message handling
+    coordinator = _coordinator(0x7a6d648c)
+    updates = []
+    async def _async_update_state(changed):
+        updates.append(changed)
+    coordinator._async_update_state = _async_update_state
+    batches, listener, d = asyncio.run(_run(
+        [_pki_message()], 0, monkeypatch, private_keys={0x7a6d648c: PKI_PRIVATE}, public_keys={0x0929: PKI_PUBLIC}, listener=coordinator,
+    ))
+    assert d.foreign == 0
+    assert coordinator.stats.counters["received"] == 1
+    assert updates == [{"direct_message"}]
+    message = coordinator.data.direct_message
+    assert (message.from_id, message.type, message.text) == ("!00000929", "text_message", "test")
+
+def test_foreign_node_info_decoded(monkeypatch):
+    public_key = bytes(range(32))
+    messages = [_node_info_message(0x20000002, public_key), _message(1)]
+    # Only with a private key on the platform, and only node info
+    batches, listener, d = asyncio.run(_run(messages, 0, monkeypatch, private_keys={NODE: PKI_PRIVATE}))
+    assert [obj["type"] for obj in d.on_packets] == ["nodeinfo", "position"]
+    assert d.on_packets[0]["payload"]["public_key"] == base64.b64encode(public_key).decode("ascii")
+    assert d.foreign == 1
+    batches, listener, d = asyncio.run(_run(messages, 0, monkeypatch))
+    assert [obj["type"] for obj in d.on_packets] == ["position"]
+
+def test_shed_repeated_node_info(monkeypatch):
+    # Backlogged: the first batch leaves half the queue behind
+    messages = [_node_info_message(NODE, b"", 1000 + i) if i % 2 else _message(i + 1) for i in range(100)]
+    parsed = []
+    convert = dispatcher.convert_envelope_to_json
+    def _convert(env, data=None):
+        parsed.append(env.packet.id)
+        return convert(env, data)
+    monkeypatch.setattr(dispatcher, "convert_envelope_to_json", _convert)
+    batches, listener, d = asyncio.run(_run(messages, 0, monkeypatch, queue_size=100))
+    types = [obj["type"] for obj in listener.applied]
+    # The first node info of the node is kept, its repeats are dropped before they are parsed while backlogged
+    assert types.count("nodeinfo") == 1 + 25
+    assert types.count("position") == 50
+    assert listener.stats.counters["shed"] == 24
+    # Still signs of life
+    assert listener.seen == 24
+    assert len(parsed) == 76
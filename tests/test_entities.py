@@ -0,0 +1,53 @@
+import pytest
+
+pytest.importorskip("homeassistant")
+pytest.importorskip("meshtastic")
+
+from types import SimpleNamespace
+
+from custom_components.mtastic_mqtt.device_tracker import _Position
+from custom_components.mtastic_mqtt.fields import SPECS
+from custom_components.mtastic_mqtt.filters import FilterConfig
+from custom_components.mtastic_mqtt.sensor import _FieldSensor
+from custom_components.mtastic_mqtt.state import NodeState
+
+def _coordinator():
+    return SimpleNamespace(
+        data=NodeState(), filter_config=FilterConfig(), changed_sections=None, online=True, last_update_success=True,
+        _entry_id="entry", _entry=SimpleNamespace(title="!10000001"),
+    )
+
+def _update(coordinator, entity, changed: set, online: bool):
+    coordinator.online = online
+    coordinator.changed_sections = changed
+    entity._handle_coordinator_update()
+
+def _entity(cls, coordinator, *args):
+    entity = cls(coordinator, *args)
+    entity.writes = []
+    entity.async_write_ha_state = lambda: entity.writes.append(entity.available)
+    return entity
+
+def test_sensor_back_online_publishes_new_value():
+    coordinator = _coordinator()
+    coordinator.data.apply("device_metrics", {"battery_level": 80})
+    field = next(f for f in SPECS["device_metrics"].fields if f.name == "battery_level")
+    battery = _entity(_FieldSensor, coordinator, "device_metrics", field)
+    assert battery.native_value == 80
+    _update(coordinator, battery, {"online"}, False)
+    assert battery.writes == [False]
+    coordinator.data.apply("device_metrics", {"battery_level": 50})
+    _update(coordinator, battery, {"online", "device_metrics", "last_update"}, True)
+    assert battery.writes == [False, True]
+    assert battery.native_value == 50
+
+def test_tracker_back_online_publishes_new_position():
+    coordinator = _coordinator()
+    coordinator.data.apply("position", {"latitude_i": 520000000, "longitude_i": 50000000})
+    tracker = _entity(_Position, coordinator)
+    assert tracker.latitude == 52.0
+    _update(coordinator, tracker, {"online"}, False)
+    coordinator.data.apply("position", {"latitude_i": 530000000, "longitude_i": 60000000})
+    _update(coordinator, tracker, {"online", "position", "last_update"}, True)
+    assert tracker.writes == [False, True]
+    assert (tracker.latitude, tracker.longitude) == (53.0, 6.0)
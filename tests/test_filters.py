@@ -0,0 +1,21 @@
+from custom_components.mtastic_mqtt.filters import Deadband, FilterConfig
+
+def test_absolute_deadband_per_field():
+    config = FilterConfig()
+    volts = Deadband(config, 0.01)
+    pressure = Deadband(config, 0.1)
+    assert volts.check(3.70, 0) and pressure.check(1013.0, 0)
+    assert not volts.check(3.705, 1)
+    assert volts.check(3.72, 2)
+    assert not pressure.check(1013.05, 1)
+    assert pressure.check(1013.2, 2)
+
+def test_relative_override_and_silence():
+    config = FilterConfig()
+    config.update({"deadband_rel": 10, "max_silence": 60})
+    deadband = Deadband(config)
+    assert deadband.check(100.0, 0)
+    assert not deadband.check(105.0, 1)
+    assert deadband.check(105.0, 61)
+    # No minimum change at all: every value is published
+    assert Deadband(FilterConfig()).check(1.0, 0)
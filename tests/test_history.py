@@ -0,0 +1,23 @@
+from custom_components.mtastic_mqtt.history import Series
+
+HOUR = 3600
+START = 1000000 * HOUR
+
+def test_window_mean_independent_of_cadence():
+    series = Series()
+    # 12 h of 10% reported every 5 minutes, then 12 h of 30% reported hourly
+    for h in range(12):
+        for k in range(12):
+            series.add(START + h * HOUR + k * 300, 10.0)
+    for h in range(12, 24):
+        series.add(START + h * HOUR, 30.0)
+    assert series.window_mean(24 * HOUR, START + 23 * HOUR + 10) == 20.0
+    # The raw sample mean is skewed by the faster cadence
+    assert series.mean != 20.0
+
+def test_window_mean_ages_out():
+    series = Series()
+    series.add(START, 10.0)
+    series.add(START + 30 * HOUR, 30.0)
+    assert series.window_mean(24 * HOUR, START + 30 * HOUR) == 30.0
+    assert series.window_mean(24 * HOUR, START + 60 * HOUR) is None
@@ -0,0 +1,58 @@
+from custom_components.mtastic_mqtt.liveness import DEFAULT_MIN_TIMEOUT, MAX_TIMEOUT, Liveness
+
+CADENCE = 1800
+
+def _listener(calls: list):
+    return lambda online: calls.append(online)
+
+def test_slow_cadence_stays_online():
+    liveness = Liveness()
+    calls = []
+    liveness.add("a", None, _listener(calls), now=0)
+    for i in range(48):
+        now = i * CADENCE
+        liveness.tick(now=now)
+        liveness.seen("a", now)
+        liveness.tick(now=now + CADENCE - 1)
+        assert liveness.online("a")
+    assert calls == []
+    assert liveness.interval("a") == CADENCE
+    assert liveness.as_dict("a")["timeout"] == 3 * CADENCE
+
+def test_slow_cadence_goes_offline():
+    liveness = Liveness()
+    calls = []
+    liveness.add("a", None, _listener(calls), now=0)
+    liveness.seen("a", 0)
+    liveness.seen("a", CADENCE)
+    assert liveness.tick(now=CADENCE + 3 * CADENCE - 1) == []
+    assert liveness.tick(now=CADENCE + 3 * CADENCE) == ["a"]
+    assert calls == [False]
+
+def test_interval_sampled_while_offline():
+    liveness = Liveness(min_timeout=60)
+    calls = []
+    liveness.add("a", None, _listener(calls), now=0)
+    liveness.seen("a", 0)
+    liveness.seen("a", 60)
+    assert liveness.tick(now=300) == ["a"]
+    # Cadence slowed down: the packets after the timeout still count
+    for now in range(CADENCE, 20 * CADENCE, CADENCE):
+        liveness.seen("a", now)
+    assert liveness.interval("a") > 0.9 * CADENCE
+    assert not liveness.tick(now=20 * CADENCE)
+
+def test_restart_with_stored_interval():
+    liveness = Liveness()
+    calls = []
+    # Last packet 40 minutes before the restart, older than the minimum timeout
+    liveness.add("a", 0, _listener(calls), CADENCE, now=2400)
+    assert liveness.online("a")
+    assert liveness.tick(now=3 * CADENCE) == ["a"]
+
+def test_restart_without_interval():
+    liveness = Liveness()
+    liveness.add("a", 0, _listener([]), now=2 * DEFAULT_MIN_TIMEOUT)
+    assert liveness.online("a")
+    liveness.add("b", 0, _listener([]), now=MAX_TIMEOUT)
+    assert liveness.online("b") is False
@@ -0,0 +1,20 @@
+import pytest
+
+pytest.importorskip("homeassistant")
+pytest.importorskip("meshtastic")
+
+from custom_components.mtastic_mqtt.outbound import downlink_topic
+
+SENDER = 0xaabbccdd
+
+@pytest.mark.parametrize("pb_topic, channel, expected", [
+    ("msh/EU_868/2/e/LongFast/#", "LongFast", ("msh/EU_868/2/e/LongFast/!aabbccdd", "LongFast")),
+    ("msh/EU_868/2/e/LongFast/!0f000001", None, ("msh/EU_868/2/e/LongFast/!aabbccdd", "LongFast")),
+    # Root topic of a mesh gateway entry: the channel comes from the envelope
+    ("msh/EU_868/2/e/#", "MediumFast", ("msh/EU_868/2/e/MediumFast/!aabbccdd", "MediumFast")),
+    ("msh/EU_868/2/e/+/#", "LongFast", ("msh/EU_868/2/e/LongFast/!aabbccdd", "LongFast")),
+    ("msh/EU_868/2/e/LongFast/#", "Private", ("msh/EU_868/2/e/Private/!aabbccdd", "Private")),
+    ("msh/EU_868/2/e/#", None, None),
+])
+def test_downlink_topic(pb_topic, channel, expected):
+    assert downlink_topic(pb_topic, channel, SENDER) == expected
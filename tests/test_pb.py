@@ -0,0 +1,29 @@
+import pytest
+
+pytest.importorskip("meshtastic")
+
+import os
+import subprocess
+import sys
+
+from conftest import ROOT
+
+# Runs in a fresh interpreter, with the package skeleton of conftest
+SCRIPT = """
+import sys, types
+for name, path in (("custom_components", "custom_components"), ("custom_components.mtastic_mqtt", "custom_components/mtastic_mqtt")):
+    module = types.ModuleType(name)
+    module.__path__ = [path]
+    sys.modules[name] = module
+from custom_components.mtastic_mqtt import pb
+assert "meshtastic" not in sys.modules, "meshtastic package imported"
+assert "serial" not in sys.modules, "client stack imported"
+payload = pb.mesh_pb2.MeshPacket(id=5).SerializeToString()
+import meshtastic
+from meshtastic.protobuf import mesh_pb2
+assert mesh_pb2.MeshPacket.FromString(payload).id == 5
+assert pb.mqtt_pb2.ServiceEnvelope(packet=mesh_pb2.MeshPacket(id=3)).packet.id == 3
+"""
+
+def test_slim_import_leaves_meshtastic_alone():
+    subprocess.run([sys.executable, "-c", SCRIPT], cwd=ROOT, env=os.environ, check=True)
@@ -0,0 +1,62 @@
+import pytest
+
+pytest.importorskip("meshtastic")
+
+import base64
+
+from custom_components.mtastic_mqtt.pb import mesh_pb2, mqtt_pb2, portnums_pb2, telemetry_pb2
+from custom_components.mtastic_mqtt.proto import PRESENCE, _PKI_NONCE, convert_envelope_to_json, decrypt_pki_packet
+
+# Firmware PKI test vector (CryptoEngine unit test): radio packet header + payload, the recipient's private key
+# and the sender's public key
+PKI_RADIO = bytes.fromhex("8c646d7a2909000062d6b2136b00000040df24abfcc30a17a3d9046726099e796a1c036a792b")
+PKI_PRIVATE = base64.b64encode(bytes.fromhex("a00330633e63522f8a4d81ec6d9d1e6617f6c8ffd3a4c698229537d44e522277")).decode("ascii")
+PKI_PUBLIC = base64.b64encode(bytes.fromhex("db18fc50eea47f00251cb784819a3cf5fc361882597f589f0d7ff820e8064457")).decode("ascii")
+
+def pki_packet():
+    packet = mesh_pb2.MeshPacket(to=0x7a6d648c, id=0x13b2d662, encrypted=PKI_RADIO[16:])
+    setattr(packet, "from", 0x0929)
+    return packet
+
+def _convert(telemetry) -> dict:
+    data = mesh_pb2.Data(portnum=portnums_pb2.TELEMETRY_APP, payload=telemetry.SerializeToString())
+    env = mqtt_pb2.ServiceEnvelope(packet=mesh_pb2.MeshPacket(id=1), gateway_id="!0f000001")
+    return convert_envelope_to_json(env, data)
+
+def test_optional_zero_kept():
+    metrics = telemetry_pb2.EnvironmentMetrics(temperature=0.0, wind_direction=0, relative_humidity=55.0)
+    obj = _convert(telemetry_pb2.Telemetry(environment_metrics=metrics))
+    assert obj["type"] == "environment_metrics"
+    payload = obj["payload"]
+    assert payload["temperature"] == 0.0
+    assert payload["wind_direction"] == 0
+    assert payload["relative_humidity"] == 55.0
+    # Not set by the sender
+    assert payload["lux"] is None
+    assert payload["current"] is None
+    assert ("environment_metrics", "temperature") in PRESENCE
+
+def test_without_presence_zero():
+    stats = telemetry_pb2.LocalStats(num_packets_tx=10, num_packets_rx_bad=0)
+    payload = _convert(telemetry_pb2.Telemetry(local_stats=stats))["payload"]
+    assert payload["num_packets_tx"] == 10
+    assert payload["num_packets_rx_bad"] == 0
+    assert ("local_stats", "num_packets_rx_bad") not in PRESENCE
+
+def test_pki_vector():
+    pytest.importorskip("cryptography")
+    packet = pki_packet()
+    encrypted = packet.encrypted
+    assert _PKI_NONCE.pack(packet.id, encrypted[-4:], 0x0929) == bytes.fromhex("62d6b213036a792b2909000000")
+    data = decrypt_pki_packet(packet, PKI_PRIVATE, PKI_PUBLIC)
+    assert data.SerializeToString() == bytes.fromhex("08011204746573744800")
+    assert data.portnum == portnums_pb2.TEXT_MESSAGE_APP
+    assert data.payload == b"test"
+
+def test_pki_tampered():
+    pytest.importorskip("cryptography")
+    from cryptography.exceptions import InvalidTag
+    packet = pki_packet()
+    packet.encrypted = bytes([packet.encrypted[0] ^ 1]) + packet.encrypted[1:]
+    with pytest.raises(InvalidTag):
+        decrypt_pki_packet(packet, PKI_PRIVATE, PKI_PUBLIC)
@@ -0,0 +1,39 @@
+import random
+
+from custom_components.mtastic_mqtt.spatial import EXPIRE_INTERVAL, MAX_AGE, SpatialIndex, haversine_m
+
+def test_antimeridian():
+    index = SpatialIndex()
+    index.update(1, -17.0, 179.98, now=0)
+    index.update(2, -17.0, -179.98, now=0)
+    index.update(3, -17.0, 170.0, now=0)
+    # ~4.3 km apart across the antimeridian
+    assert [node for _, node in index.within(-17.0, 179.99, 5000, now=0)] == [1, 2]
+    assert [node for _, node in index.within(-17.0, -179.99, 5000, now=0)] == [2, 1]
+    assert [node for _, node in index.nearest(-17.0, -179.999, 2, now=0)] == [2, 1]
+
+def test_nearest_matches_scan():
+    rng = random.Random(1)
+    index = SpatialIndex()
+    points = {}
+    for node in range(2000):
+        points[node] = (rng.uniform(-60, 60), rng.uniform(-180, 180))
+        index.update(node, *points[node], now=0)
+    for _ in range(50):
+        lat, lon = rng.uniform(-60, 60), rng.choice((rng.uniform(-180, 180), rng.uniform(179, 180), rng.uniform(-180, -179)))
+        expected = sorted((haversine_m(lat, lon, *p), node) for node, p in points.items())[:5]
+        assert index.nearest(lat, lon, 5, now=0) == expected
+        radius = 300000
+        assert index.within(lat, lon, radius, now=0) == [r for r in sorted(
+            (haversine_m(lat, lon, *p), node) for node, p in points.items()) if r[0] <= radius]
+
+def test_queries_skip_old_positions():
+    index = SpatialIndex()
+    index.update(1, 52.0, 5.0, now=0)
+    index.update(2, 52.01, 5.0, now=MAX_AGE - 100)
+    # No update since: the queries expire on their own
+    now = MAX_AGE + 1
+    assert [node for _, node in index.within(52.0, 5.0, 5000, now=now)] == [2]
+    assert [node for _, node in index.nearest(52.0, 5.0, 5, now=now)] == [2]
+    index.within(52.0, 5.0, 5000, now=now + EXPIRE_INTERVAL)
+    assert len(index) == 1
@@ -0,0 +1,15 @@
+from custom_components.mtastic_mqtt.topology import MAX_AGE, Topology
+
+def _neighbors(*nodes):
+    return [{"node_id": node, "snr": 5.0} for node in nodes]
+
+def test_edges_age_out_without_reports():
+    topology = Topology()
+    topology.update(1, _neighbors(2, 3), now=0)
+    topology.update(2, _neighbors(1), now=0)
+    assert topology.links == 2
+    version = topology.version
+    assert not topology.tick(now=MAX_AGE)
+    assert topology.tick(now=MAX_AGE + 60)
+    assert topology.links == 0
+    assert topology.version > version
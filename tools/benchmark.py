@@ -0,0 +1,127 @@
+# Throughput / latency / allocation benchmark of the packet pipeline, runs offline:
+#
+#   python tools/benchmark.py --packets 20000 --nodes 50 --dup-ratio 0.6
+
+from harness import KEY, Pipeline, as_message, make_stream, node_ids
+
+from custom_components.mtastic_mqtt import proto
+from custom_components.mtastic_mqtt.pb import mqtt_pb2
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+import tracemalloc
+
+def _percentile(values, pct: float):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+def _report(name: str, count: int, total_ns: int, latencies, alloc_bytes: float):
+    return {
+        "name": name,
+        "packets": count,
+        "packets_per_sec": round(count / (total_ns / 1e9)) if total_ns else 0,
+        "p50_us": round(_percentile(latencies, 50) / 1000, 2),
+        "p99_us": round(_percentile(latencies, 99) / 1000, 2),
+        "alloc_bytes_per_packet": round(alloc_bytes),
+    }
+
+def _time_sync(fn, items):
+    latencies = []
+    start = time.perf_counter_ns()
+    for item in items:
+        t = time.perf_counter_ns()
+        fn(item)
+        latencies.append(time.perf_counter_ns() - t)
+    return time.perf_counter_ns() - start, latencies
+
+def _alloc_sync(fn, items):
+    # Peak of traced memory above the baseline while handling a packet
+    tracemalloc.start()
+    allocated = 0
+    for item in items:
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        fn(item)
+        allocated += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return allocated / len(items) if items else 0
+
+async def _time_async(fn, items):
+    latencies = []
+    start = time.perf_counter_ns()
+    for item in items:
+        t = time.perf_counter_ns()
+        await fn(item)
+        latencies.append(time.perf_counter_ns() - t)
+    return time.perf_counter_ns() - start, latencies
+
+async def _alloc_async(fn, items):
+    tracemalloc.start()
+    allocated = 0
+    for item in items:
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        await fn(item)
+        allocated += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return allocated / len(items) if items else 0
+
+def _parse(payload):
+    env = mqtt_pb2.ServiceEnvelope()
+    env.ParseFromString(payload)
+    return env
+
+def bench_convert(stream):
+    envs = [env for env in (_parse(p) for _, p in stream) if env.packet.HasField("decoded")]
+    fn = proto.convert_envelope_to_json
+    return _report("convert_envelope_to_json", len(envs), *_time_sync(fn, envs), _alloc_sync(fn, envs))
+
+def bench_decrypt(stream, key: str):
+    envs = [env for env in (_parse(p) for _, p in stream) if env.packet.HasField("encrypted")]
+    fn = lambda env: proto.decrypt_packet(env.packet, key)
+    return _report("decrypt_packet", len(envs), *_time_sync(fn, envs), _alloc_sync(fn, envs))
+
+async def bench_dispatch(stream, args):
+    # Separate pipelines for timing and allocations, the second pass would only see duplicates otherwise
+    messages = [as_message(topic, payload) for topic, payload in stream]
+    nodes = node_ids(args.configured or args.nodes)
+    async with Pipeline(nodes, args.key) as pipeline:
+        timing = await _time_async(pipeline.async_handle, messages)
+    async with Pipeline(nodes, args.key) as pipeline:
+        allocated = await _alloc_async(pipeline.async_handle, messages)
+    return _report("dispatch", len(messages), *timing, allocated)
+
+async def _async_main(args):
+    stream = make_stream(args.packets, args.nodes, args.dup_ratio, args.encrypted_ratio, args.gateways, args.seed, args.key)
+    results = [
+        bench_convert(stream),
+        bench_decrypt(stream, args.key),
+        await bench_dispatch(stream, args),
+    ]
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'benchmark':<26}{'packets':>10}{'pkt/s':>12}{'p50 us':>10}{'p99 us':>10}{'alloc B/pkt':>13}")
+        for r in results:
+            print(f"{r['name']:<26}{r['packets']:>10}{r['packets_per_sec']:>12}{r['p50_us']:>10}{r['p99_us']:>10}{r['alloc_bytes_per_packet']:>13}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Meshtastic MQTT pipeline benchmark")
+    parser.add_argument("--packets", type=int, default=10000)
+    parser.add_argument("--nodes", type=int, default=20, help="Distinct sender nodes in the stream")
+    parser.add_argument("--configured", type=int, default=0, help="Nodes with a config entry (default: all)")
+    parser.add_argument("--dup-ratio", type=float, default=0.5, help="Share of duplicate uplinks")
+    parser.add_argument("--encrypted-ratio", type=float, default=0.8)
+    parser.add_argument("--gateways", type=int, default=4)
+    parser.add_argument("--key", default=KEY)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(_async_main(args))
+
+if __name__ == "__main__":
+    main()
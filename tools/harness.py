@@ -0,0 +1,184 @@
+# Offline harness for the decode / decrypt / dispatch pipeline.
+# Requires the integration requirements (homeassistant, meshtastic) but no MQTT broker.
+
+from collections import namedtuple
+
+import asyncio
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from custom_components.mtastic_mqtt import proto, dispatcher
+from custom_components.mtastic_mqtt.pb import mesh_pb2, mqtt_pb2, portnums_pb2, telemetry_pb2
+from custom_components.mtastic_mqtt.coordinator import Coordinator, Platform
+
+Message = namedtuple("Message", ["topic", "payload", "qos", "retain", "subscribed_topic", "timestamp"])
+
+TOPIC = "msh/EU_868/2/e/LongFast"
+KEY = "AQ=="
+BROADCAST = 0xffffffff
+FIRST_NODE = 0x10000000
+
+def _position(rnd, node):
+    return portnums_pb2.POSITION_APP, mesh_pb2.Position(
+        latitude_i=int((52.0 + rnd.random()) * 1e7),
+        longitude_i=int((13.0 + rnd.random()) * 1e7),
+        altitude=rnd.randint(0, 500),
+        ground_speed=rnd.randint(0, 10),
+        sats_in_view=rnd.randint(0, 12),
+    )
+
+def _device_metrics(rnd, node):
+    return portnums_pb2.TELEMETRY_APP, telemetry_pb2.Telemetry(device_metrics=telemetry_pb2.DeviceMetrics(
+        battery_level=rnd.randint(1, 101),
+        voltage=3.3 + rnd.random(),
+        channel_utilization=rnd.random() * 30,
+        air_util_tx=rnd.random() * 5,
+    ))
+
+def _environment_metrics(rnd, node):
+    return portnums_pb2.TELEMETRY_APP, telemetry_pb2.Telemetry(environment_metrics=telemetry_pb2.EnvironmentMetrics(
+        temperature=rnd.random() * 30,
+        relative_humidity=rnd.random() * 100,
+        barometric_pressure=950 + rnd.random() * 100,
+        gas_resistance=rnd.random() * 10,
+    ))
+
+def _node_info(rnd, node):
+    return portnums_pb2.NODEINFO_APP, mesh_pb2.User(
+        id=f"!{node:08x}",
+        short_name=f"{node & 0xffff:04x}",
+        long_name=f"Node {node:08x}",
+    )
+
+def _neighbor_info(rnd, node):
+    return portnums_pb2.NEIGHBORINFO_APP, mesh_pb2.NeighborInfo(
+        node_id=node,
+        neighbors=[mesh_pb2.Neighbor(node_id=FIRST_NODE + rnd.randint(0, 100), snr=rnd.random() * 10) for _ in range(rnd.randint(1, 5))],
+    )
+
+def _text_message(rnd, node):
+    return portnums_pb2.TEXT_MESSAGE_APP, f"Hello from {node:08x} #{rnd.randint(0, 1000)}"
+
+GENERATORS = (
+    (_position, 3),
+    (_device_metrics, 3),
+    (_environment_metrics, 1),
+    (_node_info, 1),
+    (_neighbor_info, 1),
+    (_text_message, 1),
+)
+
+def encrypt(packet, key: str, plain: bytes):
+    # AES-CTR is symmetric
+    packet.encrypted = proto.decrypt_bytes(proto.cipher_key(key), packet.id, getattr(packet, "from"), plain)
+
+def make_packet(rnd, node: int, packet_id: int, encrypted: bool, key: str = KEY):
+    gen = rnd.choices([g for g, _ in GENERATORS], weights=[w for _, w in GENERATORS])[0]
+    portnum, msg = gen(rnd, node)
+    data = mesh_pb2.Data(portnum=portnum, payload=msg.encode("utf8") if isinstance(msg, str) else msg.SerializeToString())
+    packet = mesh_pb2.MeshPacket(to=BROADCAST, id=packet_id, hop_limit=3, hop_start=3, rx_time=1700000000 + packet_id)
+    setattr(packet, "from", node)
+    if encrypted:
+        encrypt(packet, key, data.SerializeToString())
+    else:
+        packet.decoded.CopyFrom(data)
+    return packet
+
+def make_stream(count: int, nodes: int = 20, dup_ratio: float = 0.5, encrypted_ratio: float = 0.8, gateways: int = 4, seed: int = 1, key: str = KEY):
+    # List of (topic, payload) with `dup_ratio` of the packets being copies of a recent one uplinked by another gateway
+    rnd = random.Random(seed)
+    result = []
+    recent = []
+    for i in range(count):
+        gateway = FIRST_NODE + 0x0f000000 + rnd.randrange(gateways)
+        if recent and rnd.random() < dup_ratio:
+            packet = rnd.choice(recent)
+        else:
+            node = FIRST_NODE + rnd.randrange(nodes)
+            packet = make_packet(rnd, node, i + 1, rnd.random() < encrypted_ratio, key)
+            recent = (recent + [packet])[-16:]
+        env = mqtt_pb2.ServiceEnvelope(packet=packet, channel_id="LongFast", gateway_id=f"!{gateway:08x}")
+        result.append((f"{TOPIC}/!{gateway:08x}", env.SerializeToString()))
+    return result
+
+def node_ids(nodes: int):
+    return [FIRST_NODE + i for i in range(nodes)]
+
+def as_message(topic: str, payload: bytes, timestamp: float = 0.0):
+    return Message(topic, payload, 0, False, f"{TOPIC}/#", timestamp)
+
+class _Entry():
+
+    def __init__(self, node: int, key: str, topic: str):
+        self.entry_id = f"bench_{node:08x}"
+        self.title = f"Node {node:08x}"
+        self.options = {
+            "id": f"!{node:08x}",
+            "pb_topic": topic,
+            "key": key,
+        }
+
+    def as_dict(self):
+        return {"options": self.options}
+
+class Pipeline():
+
+    # Real Platform / Dispatcher / Coordinator objects on top of a throwaway HomeAssistant instance
+    # with the MQTT subscription stubbed out - the handler is called directly
+
+    def __init__(self, nodes, key: str = KEY, topic: str = f"{TOPIC}/#", config: dict = {}):
+        self._nodes = nodes
+        self._key = key
+        self._topic = topic
+        self._config = config
+        self.handlers = {}
+
+    async def __aenter__(self):
+        from homeassistant.core import HomeAssistant
+
+        self._tmp = tempfile.TemporaryDirectory()
+        self.hass = HomeAssistant(self._tmp.name)
+
+        async def _async_subscribe(hass, topic, msg_callback, qos=0, encoding="utf-8"):
+            self.handlers[topic] = msg_callback
+            def _unsubscribe():
+                self.handlers.pop(topic, None)
+            return _unsubscribe
+
+        self._orig_subscribe = dispatcher.mqtt_client.async_subscribe
+        dispatcher.mqtt_client.async_subscribe = _async_subscribe
+        self.platform = Platform(self.hass, self._config)
+        await self.platform.async_load()
+        self.coordinators = []
+        for node in self._nodes:
+            coordinator = Coordinator(self.platform, _Entry(node, self._key, self._topic))
+            await coordinator.async_load()
+            await coordinator.async_refresh()
+            self.coordinators.append(coordinator)
+        return self
+
+    async def __aexit__(self, *args):
+        for coordinator in self.coordinators:
+            await coordinator.async_unload()
+        await self.platform.async_flush()
+        await self.platform.async_shutdown()
+        dispatcher.mqtt_client.async_subscribe = self._orig_subscribe
+        self._tmp.cleanup()
+
+    @property
+    def handler(self):
+        return self.handlers[self._topic]
+
+    async def async_drain(self):
+        # The handler only queues, packets are decoded and applied by the ingest drain tasks
+        while any(d._drain_task for d in self.platform.dispatchers.values()):
+            await asyncio.sleep(0)
+
+    async def async_handle(self, message):
+        # One message through the whole pipeline
+        await self.handler(message)
+        await self.async_drain()
@@ -0,0 +1,77 @@
+# Import time of the integration modules, each measured in a fresh interpreter with `python -X importtime`:
+#
+#   python tools/import_time.py --runs 5 --top 15
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TARGETS = (
+    "meshtastic", # what the integration used to import
+    "custom_components.mtastic_mqtt.pb",
+    "custom_components.mtastic_mqtt.proto",
+    "custom_components.mtastic_mqtt",
+)
+
+def _measure(module: str) -> dict | None:
+    # {module: cumulative us} of one run, None if the import failed
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    if proc.returncode:
+        return None
+    result = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        try:
+            result[parts[2].strip()] = int(parts[1])
+        except ValueError:
+            continue # header
+    return result
+
+def measure(module: str, runs: int) -> dict:
+    results = [r for r in (_measure(module) for _ in range(runs)) if r is not None]
+    if not results:
+        return {"module": module, "error": "import failed"}
+    totals = [r.get(module, 0) for r in results]
+    last = results[-1]
+    return {
+        "module": module,
+        "median_ms": round(statistics.median(totals) / 1000, 1),
+        "min_ms": round(min(totals) / 1000, 1),
+        "modules": len(last),
+        "slowest": sorted(((name, round(us / 1000, 1)) for name, us in last.items() if name != module), key=lambda x: -x[1]),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Integration import time")
+    parser.add_argument("modules", nargs="*", default=TARGETS)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="Slowest nested imports listed per module")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+    results = [measure(module, args.runs) for module in args.modules]
+    for r in results:
+        if "slowest" in r:
+            r["slowest"] = r["slowest"][:args.top]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for r in results:
+        if "error" in r:
+            print(f"{r['module']:<40}{r['error']:>30}")
+            continue
+        print(f"{r['module']:<40}{r['median_ms']:>10} ms median{r['min_ms']:>10} ms min{r['modules']:>8} modules")
+        for name, ms in r["slowest"]:
+            print(f"    {name:<60}{ms:>10} ms")
+
+if __name__ == "__main__":
+    main()
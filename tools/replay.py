@@ -0,0 +1,88 @@
+# Replays a packet capture (see `capture_path` in the README) through the pipeline, runs offline:
+#
+#   python tools/replay.py capture.bin capture.bin.1 --realtime
+#   python tools/replay.py capture.bin --decoded before.jsonl
+#
+# Every node found in the capture gets a config entry unless --nodes is given.
+
+from harness import KEY, Pipeline, as_message
+
+from custom_components.mtastic_mqtt import dispatcher
+from custom_components.mtastic_mqtt.capture import read_capture
+from custom_components.mtastic_mqtt.gateway import parse_allowlist
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+def _load(paths):
+    # Rotated files are given newest first by habit (capture.bin capture.bin.1), replay in time order
+    records = [record for path in paths for record in read_capture(path)]
+    records.sort(key=lambda r: r[0])
+    return records
+
+def _senders(records, key: str) -> set:
+    result = set()
+    for _, _, payload in records:
+        packet = dispatcher.decode_payload(payload, {}, (key, ))
+        if packet.from_node is not None:
+            result.add(packet.from_node)
+    return result
+
+def write_decoded(records, path: str, key: str):
+    # One JSON line per packet, stable across runs - diff two files to check a change keeps the decoded output
+    with open(path, "w") as f:
+        for ts, topic, payload in records:
+            packet = dispatcher.decode_payload(payload, {}, (key, ))
+            obj = packet.error or packet.objs.get(key)
+            f.write(json.dumps({"ts": ts, "topic": topic, "from": packet.from_node, "id": packet.packet_id, "decoded": obj}, sort_keys=True, default=str))
+            f.write("\n")
+
+async def replay(records, args):
+    nodes = parse_allowlist(args.nodes) if args.nodes else _senders(records, args.key)
+    async with Pipeline(sorted(nodes), args.key) as pipeline:
+        handler = pipeline.handler
+        first_ts = records[0][0] if records else 0
+        start = time.monotonic()
+        for ts, topic, payload in records:
+            if args.realtime:
+                if (delay := (ts - first_ts) / args.speed - (time.monotonic() - start)) > 0:
+                    await asyncio.sleep(delay)
+            await handler(as_message(topic, payload, ts))
+        await pipeline.async_drain()
+        elapsed = time.monotonic() - start
+        result = {
+            "packets": len(records),
+            "nodes": len(nodes),
+            "seconds": round(elapsed, 3),
+            "packets_per_sec": round(len(records) / elapsed) if elapsed else 0,
+            "stats": pipeline.platform.stats.as_dict(),
+        }
+        if args.state:
+            result["state"] = {f"!{c.node_num:08x}": c.data.as_dict() for c in pipeline.coordinators}
+        return result
+
+async def _async_main(args):
+    records = _load(args.capture)
+    if args.decoded:
+        write_decoded(records, args.decoded, args.key)
+    print(json.dumps(await replay(records, args), indent=2, default=str))
+
+def main():
+    parser = argparse.ArgumentParser(description="Meshtastic MQTT capture replay")
+    parser.add_argument("capture", nargs="+", help="Capture files, rotated ones included")
+    parser.add_argument("--nodes", help="Comma separated node ids to configure (default: every sender)")
+    parser.add_argument("--key", default=KEY)
+    parser.add_argument("--realtime", action="store_true", help="Keep the recorded packet timing")
+    parser.add_argument("--speed", type=float, default=1.0, help="Time scale with --realtime")
+    parser.add_argument("--decoded", help="Also write the decoded packets to this JSON lines file")
+    parser.add_argument("--state", action="store_true", help="Include the final node states")
+    parser.add_argument("--debug", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARNING)
+    asyncio.run(_async_main(args))
+
+if __name__ == "__main__":
+    main()